@@ -6,7 +6,8 @@ from typing import Dict, List
 import numpy as np
 import pandas as pd
 
-from ..utils import CollectiveBodyBolt
+from ..storage import IntermediateStorage
+from ..utils import CollectiveBodyBolt, COLUMNS, METADATA_KEYS
 
 # TODO - move mass assumptions to constants file
 # Source: https://exrx.net/Kinesiology/Segments
@@ -17,11 +18,54 @@ human_mass = 73
 torso_legs_head_mass = human_mass - hand_arm_mass*2 # Based on average weight of human in KG
 body_radius = 0.1
 
+# Derived columns and the fundamental kinematics columns they are calculated from
+HEAD_POSITION_COLUMNS = ['head_pos_x','head_pos_y','head_pos_z']
+HEAD_ROTATION_COLUMNS = ['head_rot_i','head_rot_j','head_rot_k','head_rot_l']
+MOMENT_ARM_COLUMNS = ['left_xzplanar_moment_arm_len','right_xzplanar_moment_arm_len']
+VELOCITY_MAGNITUDE_COLUMNS = ['head_vel_pos_magnitude','left_vel_pos_magnitude','right_vel_pos_magnitude']
+DERIVED_COLUMN_INPUTS = {
+    'cartesian_displacement': HEAD_POSITION_COLUMNS,
+    'total_cartesian_distance': HEAD_POSITION_COLUMNS,
+    'rotational_displacement': HEAD_ROTATION_COLUMNS,
+    'total_rotational_distance': HEAD_ROTATION_COLUMNS,
+    'linear_kinetic_energy': VELOCITY_MAGNITUDE_COLUMNS,
+    'linear_power': VELOCITY_MAGNITUDE_COLUMNS + ['head_accel_pos_magnitude','left_accel_pos_magnitude','right_accel_pos_magnitude'],
+    'rotational_inertia': MOMENT_ARM_COLUMNS,
+    'rotational_kinetic_energy': MOMENT_ARM_COLUMNS + ['head_vel_rot_magnitude','left_vel_rot_magnitude','right_vel_rot_magnitude'],
+}
+DERIVED_COLUMNS = list(DERIVED_COLUMN_INPUTS)
+
 class DerivedKinematicsBolt(CollectiveBodyBolt):
 
-    def __init__(self, output_directory_path: str, save_intermediate_output: bool=False) -> None:
-        super().__init__(output_directory_path, save_intermediate_output)
+    stage_inputs = {
+        METADATA_KEYS: ["cleaned_metadata"], 
+        COLUMNS: sorted(set(column for columns in DERIVED_COLUMN_INPUTS.values() for column in columns)),
+    }
+    stage_outputs = {METADATA_KEYS: ["derived_kinematics_metadata"], COLUMNS: DERIVED_COLUMNS}
+
+    def __init__(
+            self, 
+            output_directory_path: str, 
+            save_intermediate_output: bool=False, 
+            storage: IntermediateStorage=None) -> None:
+        super().__init__(output_directory_path, save_intermediate_output, storage)
+
+    def get_config(self) -> Dict:
+        return {"requested_columns": self.requested_columns}
+
+    def get_stage_inputs(self) -> Dict[str, List[str]]:
+        # Only the fundamental kinematics of requested columns are read
+        input_columns = set(
+            column for derived_column in self._get_requested_derived_columns() 
+            for column in DERIVED_COLUMN_INPUTS[derived_column]
+        )
+        return {**self.stage_inputs, COLUMNS: sorted(input_columns)}
+
+    def get_stage_outputs(self) -> Dict[str, List[str]]:
+        return {**self.stage_outputs, COLUMNS: self._get_requested_derived_columns()}
 
+    def _get_requested_derived_columns(self) -> List[str]:
+        return [column for column in DERIVED_COLUMNS if self._is_requested(column)]
 
 
     def process(
@@ -55,7 +99,8 @@ class DerivedKinematicsBolt(CollectiveBodyBolt):
             output_metadata["derived_kinematics_metadata"] = {}
 
             if output_metadata["cleaned_metadata"]["is_valid"]:
-                output_df, output_metadata = self._derived_kinematics(output_df, output_metadata)
+                with self._profile_dataset(output_dataset_id):
+                    output_df, output_metadata = self._derived_kinematics(output_df, output_metadata)
 
             else: 
                 output_metadata["derived_kinematics_metadata"] = {
@@ -74,97 +119,91 @@ class DerivedKinematicsBolt(CollectiveBodyBolt):
         return output_df_list, output_metadata_list
 
     def _derived_kinematics(self, output_df: pd.DataFrame, output_metadata: Dict):
-
-        output_df, output_metadata = self._cumulative_distance(output_df, output_metadata)
-        output_df, output_metadata = self._cumulative_rotational_distance(output_df, output_metadata)
-        output_df, output_metadata = self._linear_kinetic_energy(output_df, output_metadata)
-        output_df, output_metadata = self._linear_power(output_df, output_metadata)
-        output_df, output_metadata = self._rotational_inertia(output_df, output_metadata)
-        output_df, output_metadata = self._rotational_kinetic_energy(output_df, output_metadata)
-        
-        return output_df, output_metadata
-    
-
-    def _cumulative_distance(self, output_df: pd.DataFrame, output_metadata: Dict):
-        timestep = output_metadata["fundamental_kinematics_metadata"]["avg_timestep"]
-    
-        # Caculate displacement for every timestep
-        output_df['cartesian_displacement'] = np.sqrt(
-            output_df['head_pos_x'].diff()**2 + output_df['head_pos_y'].diff()**2 + output_df['head_pos_z'].diff()**2
-        )
-        output_df.loc[0, 'cartesian_displacement'] = 0  # Set distance traveled at first row as 0   
-        
-        # Calculate cumulative sum of displacement
-        output_df['total_cartesian_distance'] = output_df['cartesian_displacement'].cumsum()
-
-        return output_df, output_metadata
-    
-    def _cumulative_rotational_distance(self, output_df: pd.DataFrame, output_metadata: Dict):
-        timestep = output_metadata["fundamental_kinematics_metadata"]["avg_timestep"]
-
-        # Caculate displacement for every timestep
-        output_df['rotational_displacement'] = np.sqrt(
-            output_df['head_rot_i'].diff()**2 + output_df['head_rot_j'].diff()**2 + output_df['head_rot_k'].diff()**2 + output_df['head_rot_l'].diff()**2
-        )
-        output_df.loc[0, 'rotational_displacement'] = 0  # Set distance traveled at first row as 0
-   
-        
-        # Calculate cumulative sum of displacement
-        output_df['total_rotational_distance'] = output_df['rotational_displacement'].cumsum()
+        """
+        Calculate the requested derived kinematics in a single pass over NumPy views of the 
+        fundamental kinematics columns, and append them to the dataframe in one operation.
+        """
+        requested_columns = self._get_requested_derived_columns()
+        if len(requested_columns) == 0:
+            return output_df, output_metadata
+        column = lambda name: output_df[name].to_numpy(dtype=np.float64)
+
+        derived_columns = {}
+
+        # Caculate displacement for every timestep and the cumulative distance
+        if 'cartesian_displacement' in requested_columns or 'total_cartesian_distance' in requested_columns:
+            derived_columns['cartesian_displacement'], derived_columns['total_cartesian_distance'] = \
+                self._cumulative_distance(output_df[HEAD_POSITION_COLUMNS].to_numpy(dtype=np.float64))
+        if 'rotational_displacement' in requested_columns or 'total_rotational_distance' in requested_columns:
+            derived_columns['rotational_displacement'], derived_columns['total_rotational_distance'] = \
+                self._cumulative_distance(output_df[HEAD_ROTATION_COLUMNS].to_numpy(dtype=np.float64))
+
+        # Calculate linear kinetic energy and power from position and velocity magnitudes
+        if 'linear_kinetic_energy' in requested_columns or 'linear_power' in requested_columns:
+            head_vel_pos = column("head_vel_pos_magnitude")
+            left_vel_pos = column("left_vel_pos_magnitude")
+            right_vel_pos = column("right_vel_pos_magnitude")
+        if 'linear_kinetic_energy' in requested_columns:
+            derived_columns['linear_kinetic_energy'] = np.sqrt(
+                head_vel_pos**2 * 1/2 * torso_legs_head_mass + \
+                    left_vel_pos**2 * 1/2 * hand_arm_mass + \
+                        right_vel_pos**2 * 1/2 * hand_arm_mass
+            )
+        if 'linear_power' in requested_columns:
+            derived_columns['linear_power'] = \
+                column("head_accel_pos_magnitude") * head_vel_pos * torso_legs_head_mass + \
+                column("left_accel_pos_magnitude") * left_vel_pos * hand_arm_mass + \
+                column("right_accel_pos_magnitude") * right_vel_pos * hand_arm_mass
+
+        # Calculate rotational inertia and kinetic energy from moment arms in the xz plane
+        if 'rotational_inertia' in requested_columns or 'rotational_kinetic_energy' in requested_columns:
+            left_moment_arm_sq = column("left_xzplanar_moment_arm_len")**2
+            right_moment_arm_sq = column("right_xzplanar_moment_arm_len")**2
+        if 'rotational_inertia' in requested_columns:
+            derived_columns['rotational_inertia'] = (
+                1/2 * torso_legs_head_mass * body_radius**2 +
+                1/3 * arm_mass * left_moment_arm_sq + 
+                1/3 * arm_mass * right_moment_arm_sq + 
+                1/1 * hand_mass * left_moment_arm_sq + 
+                1/1 * hand_mass * right_moment_arm_sq 
+            )
+        if 'rotational_kinetic_energy' in requested_columns:
+            derived_columns['rotational_kinetic_energy'] = (
+                column("head_vel_rot_magnitude")**2 * 1/2 * 1/2 * torso_legs_head_mass * body_radius**2 +
+                column("left_vel_rot_magnitude")**2 * 1/2 * (
+                    hand_mass * left_moment_arm_sq + 1/3 * arm_mass * left_moment_arm_sq
+                ) +
+                column("right_vel_rot_magnitude")**2 * 1/2 * (
+                    hand_mass * right_moment_arm_sq + 1/3 * arm_mass * right_moment_arm_sq
+                )
+            )
+
+        # Store in the type of the sensor columns, calculations are in float64
+        sensor_dtype = output_df["head_pos_x"].dtype
+        derived_df = pd.DataFrame(
+            {name: derived_columns[name].astype(sensor_dtype, copy=False) for name in requested_columns}, 
+            index=output_df.index)
+        output_df = pd.concat([output_df, derived_df], axis=1)
         
-
-        return output_df, output_metadata
-    
-    def _linear_kinetic_energy(self, output_df: pd.DataFrame, output_metadata: Dict):
-        # Caculate displacement for every timestep
-        output_df['linear_kinetic_energy'] = np.sqrt(
-            output_df['head_vel_pos_magnitude']**2 * 1/2 * torso_legs_head_mass + \
-                output_df['left_vel_pos_magnitude']**2 * 1/2 * hand_arm_mass + \
-                    output_df['right_vel_pos_magnitude']**2 * 1/2 * hand_arm_mass
-        )
-
         return output_df, output_metadata
-    
-    def _linear_power(self, output_df: pd.DataFrame, output_metadata: Dict):
 
-        # Calculate linear power from position and velocity magnitudes        
-        output_df['linear_power'] = \
-            output_df["head_accel_pos_magnitude"]* output_df["head_vel_pos_magnitude"] * torso_legs_head_mass + \
-            output_df["left_accel_pos_magnitude"]* output_df["left_vel_pos_magnitude"] * hand_arm_mass + \
-            output_df["right_accel_pos_magnitude"]* output_df["right_vel_pos_magnitude"] * hand_arm_mass
-
-    
-        return output_df, output_metadata
-
-    def _rotational_inertia(self, output_df: pd.DataFrame, output_metadata: Dict):
-        # Caculate displacement for every timestep
-        output_df = output_df.assign(
-                rotational_inertia=lambda x: (
-                    1/2 * torso_legs_head_mass * body_radius**2 +
-                    1/3 * arm_mass * x["left_xzplanar_moment_arm_len"]**2 + 
-                    1/3 * arm_mass * x["right_xzplanar_moment_arm_len"]**2 + 
-                    1/1 * hand_mass * x["left_xzplanar_moment_arm_len"]**2 + 
-                    1/1 * hand_mass * x["right_xzplanar_moment_arm_len"]**2 
-                )
-            )  
-    
-        return output_df, output_metadata
-    
-    
-    def _rotational_kinetic_energy(self, output_df: pd.DataFrame, output_metadata: Dict):
-        # Caculate displacement for every timestep
-        output_df = output_df.assign(
-                rotational_kinetic_energy=lambda x: (
-                    x["head_vel_rot_magnitude"]**2 * 1/2 * 1/2 * torso_legs_head_mass * body_radius**2 +
-                    x["left_vel_rot_magnitude"]**2 * 1/2 * (
-                        hand_mass * x["left_xzplanar_moment_arm_len"]**2 + 1/3 * arm_mass * x["left_xzplanar_moment_arm_len"]**2
-
-                    ) +
-                    x["right_vel_rot_magnitude"]**2 * 1/2 * (
-                        hand_mass * x["right_xzplanar_moment_arm_len"]**2 + 1/3 * arm_mass * x["right_xzplanar_moment_arm_len"]**2
-
-                    )
-                )
-            )  
-    
-        return output_df, output_metadata
\ No newline at end of file
+    def _cumulative_distance(self, position_block: np.ndarray):
+        """Return the displacement between frames of a (frames x axes) block and its cumulative sum."""
+        displacement = np.full(len(position_block), np.nan)
+        if len(position_block) == 0:
+            return displacement, displacement.copy()
+
+        # Sum squared axis differences in axis order
+        squared_diff = np.diff(position_block, axis=0)**2
+        squared_distance = squared_diff[:, 0].copy()
+        for axis_index in range(1, squared_diff.shape[1]):
+            squared_distance += squared_diff[:, axis_index]
+        np.sqrt(squared_distance, out=displacement[1:])
+        displacement[0] = 0  # Set distance traveled at first row as 0
+
+        # Cumulative sum skipping missing displacements, as pandas cumsum
+        missing_displacement = np.isnan(displacement)
+        total_distance = np.cumsum(np.where(missing_displacement, 0, displacement))
+        total_distance[missing_displacement] = np.nan
+
+        return displacement, total_distance
@@ -7,20 +7,59 @@ from typing import Dict, List
 import numpy as np
 import pandas as pd
 
-from ..utils import CollectiveBodyBolt
+from ..storage import IntermediateStorage
+from ..utils import CollectiveBodyBolt, COLUMNS, METADATA_KEYS
+
+SENSOR_LOCATIONS = ['head','left','right']
+MOTION_AXES = {"pos": ['x','y','z'], "rot": ['i','j','k','l']}
+KINEMATICS_ORDERS = ["vel", "accel", "jerk"]
+
+# Sensor columns, ordered by sensor, motion type and axis
+SENSOR_COLUMNS = [
+    "_".join((sensor_pos, motion_type, axis))
+    for sensor_pos in SENSOR_LOCATIONS for motion_type, axes in MOTION_AXES.items() for axis in axes
+]
+# Calculated columns and the sensor columns they are calculated from. Derivatives by order, sensor,
+# motion type and axis, with their order index and sensor column, magnitudes by sensor, order and
+# motion type, with their order index and sensor columns
+DERIVATIVE_COLUMNS = {
+    "_".join((sensor_pos, magval + "_" + motion_type, axis)): (order_index, "_".join((sensor_pos, motion_type, axis)))
+    for order_index, magval in enumerate(KINEMATICS_ORDERS) for sensor_pos in SENSOR_LOCATIONS
+    for motion_type, axes in MOTION_AXES.items() for axis in axes
+}
+MAGNITUDE_COLUMNS = {
+    "_".join((sensor_pos, magval, motion_type, "magnitude")): (
+        order_index, ["_".join((sensor_pos, motion_type, axis)) for axis in MOTION_AXES[motion_type]])
+    for sensor_pos in SENSOR_LOCATIONS for order_index, magval in enumerate(KINEMATICS_ORDERS) 
+    for motion_type in MOTION_AXES.keys()
+}
+MOMENT_ARM_COLUMNS = {
+    'left_xzplanar_moment_arm_len': ['head_pos_x', 'head_pos_z', 'left_pos_x', 'left_pos_z'],
+    'right_xzplanar_moment_arm_len': ['head_pos_x', 'head_pos_z', 'right_pos_x', 'right_pos_z'],
+}
+KINEMATICS_COLUMNS = list(DERIVATIVE_COLUMNS) + list(MAGNITUDE_COLUMNS) + list(MOMENT_ARM_COLUMNS)
 
 class FundamentalKinematicsBolt(CollectiveBodyBolt):
 
     MAX_MOMENT_ARM_LEN = (2.5)/2*1.1 # Based on max expected human arm length + margin
+    DERIVATIVE_CLIP_VALUE = 0.9 # Upper bound of derivatives when clipping is enabled
 
-    def __init__(self, output_directory_path: str, use_clipping: bool=False, save_intermediate_output: bool=False) -> None:
-        super().__init__(output_directory_path, save_intermediate_output)
+    stage_inputs = {METADATA_KEYS: ["cleaned_metadata"], COLUMNS: ["timestamp"] + SENSOR_COLUMNS}
+    stage_outputs = {METADATA_KEYS: ["fundamental_kinematics_metadata"], COLUMNS: KINEMATICS_COLUMNS}
+
+    def __init__(
+            self, 
+            output_directory_path: str, 
+            use_clipping: bool=False, 
+            save_intermediate_output: bool=False, 
+            storage: IntermediateStorage=None) -> None:
+        super().__init__(output_directory_path, save_intermediate_output, storage)
 
         self.use_clipping = use_clipping
-        self.sensor_locations = ['head','left','right']
-        self.motion_types = ['pos','rot']
-        self.pos_axes = ['x','y','z']
-        self.rot_axes = ['i','j','k','l']
+        self.sensor_locations = SENSOR_LOCATIONS
+        self.motion_types = list(MOTION_AXES.keys())
+        self.pos_axes = MOTION_AXES["pos"]
+        self.rot_axes = MOTION_AXES["rot"]
 
     def process(
         self, 
@@ -40,6 +79,27 @@ class FundamentalKinematicsBolt(CollectiveBodyBolt):
             
         return self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list
 
+    def get_config(self) -> Dict:
+        return {"use_clipping": self.use_clipping, "requested_columns": self.requested_columns}
+
+    def get_stage_inputs(self) -> Dict[str, List[str]]:
+        # Only the sensor columns of requested columns are read
+        sensor_columns = set()
+        for column in self._get_requested_kinematics_columns():
+            if column in DERIVATIVE_COLUMNS:
+                sensor_columns.add(DERIVATIVE_COLUMNS[column][1])
+            elif column in MAGNITUDE_COLUMNS:
+                sensor_columns.update(MAGNITUDE_COLUMNS[column][1])
+            else:
+                sensor_columns.update(MOMENT_ARM_COLUMNS[column])
+        return {**self.stage_inputs, COLUMNS: ["timestamp"] + [column for column in SENSOR_COLUMNS if column in sensor_columns]}
+
+    def get_stage_outputs(self) -> Dict[str, List[str]]:
+        return {**self.stage_outputs, COLUMNS: self._get_requested_kinematics_columns()}
+
+    def _get_requested_kinematics_columns(self) -> List[str]:
+        return [column for column in KINEMATICS_COLUMNS if self._is_requested(column)]
+
     def _process_all_datasets(self, output_df_list, output_metadata_list):
 
         assert len(output_df_list) == len(output_metadata_list), "Missing matching df and metadata pairs"
@@ -53,7 +113,8 @@ class FundamentalKinematicsBolt(CollectiveBodyBolt):
             output_metadata["fundamental_kinematics_metadata"] = {}
 
             if output_metadata["cleaned_metadata"]["is_valid"]:
-                output_df, output_metadata = self._basic_kinematics(output_df, output_metadata)
+                with self._profile_dataset(output_dataset_id):
+                    output_df, output_metadata = self._basic_kinematics(output_df, output_metadata)
 
             else: 
                 output_metadata["fundamental_kinematics_metadata"] = {
@@ -78,10 +139,7 @@ class FundamentalKinematicsBolt(CollectiveBodyBolt):
         output_metadata = self._add_average_frame_timestep(output_metadata)
 
         # Calculate basic kinematics properties for metrics calculations
-        output_df, output_metadata = self._calculate_velocities(output_df, output_metadata)
-        output_df, output_metadata = self._calculate_accelerations(output_df, output_metadata)
-        output_df, output_metadata = self._calculate_jerk(output_df, output_metadata)
-        output_df, output_metadata = self._calculate_kinematic_magnitudes(output_df, output_metadata)
+        output_df, output_metadata = self._calculate_kinematics_block(output_df, output_metadata)
         output_df, output_metadata = self._calculate_moment_arms(output_df, output_metadata)
         output_df, output_metadata = self._calculate_xzplanar_moment_arm_mag(output_df, output_metadata)
 
@@ -94,134 +152,103 @@ class FundamentalKinematicsBolt(CollectiveBodyBolt):
         output_metadata["fundamental_kinematics_metadata"]["avg_timestep"] = timestep
         return output_metadata
 
-    def _calculate_velocities(self, output_df: pd.DataFrame, output_metadata: Dict):
-        return self._kinematics_derivative(output_df, output_metadata, "", "vel_")
-    
-    def _calculate_accelerations(self, output_df: pd.DataFrame, output_metadata: Dict):
-        return self._kinematics_derivative(output_df, output_metadata, "vel_", "accel_")
-    
-    def _calculate_jerk(self, output_df: pd.DataFrame, output_metadata: Dict):
-        return self._kinematics_derivative(output_df, output_metadata, "accel_", "jerk_")
-    
-    def _kinematics_derivative(
-            self, 
-            output_df: pd.DataFrame,
-            output_metadata: Dict,
-            base_str: str, 
-            new_str: str):
-        timestep = output_metadata["fundamental_kinematics_metadata"]["avg_timestep"]
-
-        # Calculate linear and rotational velocities
-        for sensor_pos in self.sensor_locations:
-            for motion_type in self.motion_types:
-
-                # Separete rotation and position
-                if motion_type == "rot":
-                    motion_axes = self.rot_axes
-                elif motion_type == "pos":
-                    motion_axes = self.pos_axes
-
-                for motion_axis in motion_axes:
-                    base_col_name = "_".join((sensor_pos, base_str+motion_type, motion_axis))
-                    new_col_name = "_".join((sensor_pos, new_str+motion_type, motion_axis))
-                    output_df = self._derivative(output_df, base_col_name, new_col_name, timestep)
-
-                    output_df[new_col_name].fillna(0, inplace=True)
-                    # TODO - add metadata to velocities using custom class to report stats
-
-                    # Smooth derivatives if bolt configured for smoothing
-                    if self.use_clipping:
-                        output_df = self._clip_derivatives(output_df, new_col_name)
-
+    def _calculate_kinematics_block(self, output_df: pd.DataFrame, output_metadata: Dict):
+        """
+        Calculate the requested velocity, acceleration and jerk columns of sensor positions and
+        rotation axes, and their magnitudes, on (axes x frames) arrays of only the sensor axes
+        they need.
+
+        Each derivative order is the difference of the previous order divided by the timestamp
+        difference, with the undefined first frame set to 0. Every sensor axis is only derived up
+        to the highest order its requested columns need. Requested columns are written to one
+        preallocated block, laid out column by column as pandas stores it, and appended to the
+        dataframe in one operation. Results are calculated in float64 and stored in the type of
+        the sensor columns, e.g. float32 with the lean dtype policy.
+        """
+        derivative_columns = [column for column in DERIVATIVE_COLUMNS if self._is_requested(column)]
+        magnitude_columns = [column for column in MAGNITUDE_COLUMNS if self._is_requested(column)]
+        if len(derivative_columns) + len(magnitude_columns) == 0:
+            return output_df, output_metadata
+        num_frames = len(output_df)
+
+        # Highest derivative order needed of every sensor axis
+        axis_orders = {}
+        for column in derivative_columns:
+            order_index, sensor_column = DERIVATIVE_COLUMNS[column]
+            axis_orders[sensor_column] = max(axis_orders.get(sensor_column, 0), order_index + 1)
+        for column in magnitude_columns:
+            order_index, sensor_columns = MAGNITUDE_COLUMNS[column]
+            for sensor_column in sensor_columns:
+                axis_orders[sensor_column] = max(axis_orders.get(sensor_column, 0), order_index + 1)
+
+        # Extract the needed position and rotation axes, ordered by sensor, motion type and axis
+        base_columns = [column for column in SENSOR_COLUMNS if column in axis_orders]
+        sensor_dtype = np.result_type(*output_df[SENSOR_COLUMNS].dtypes)
+        previous_order = np.ascontiguousarray(output_df[base_columns].to_numpy(dtype=np.float64).T)
+        timestamp_diff = np.diff(output_df['timestamp'].to_numpy(dtype=np.float64))
+
+        # Calculate each derivative order from the previous order, for the axes needing the order
+        derivative_rows = {}
+        previous_columns = base_columns
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for order_index in range(max(axis_orders.values())):
+                order_columns = [column for column in previous_columns if axis_orders[column] > order_index]
+                if len(order_columns) < len(previous_columns):
+                    previous_order = previous_order[[previous_columns.index(column) for column in order_columns]]
+
+                derivative = np.empty((len(order_columns), num_frames), dtype=np.float64)
+                derivative[:, :1] = 0
+                np.subtract(previous_order[:, 1:], previous_order[:, :-1], out=derivative[:, 1:])
+                np.divide(derivative[:, 1:], timestamp_diff, out=derivative[:, 1:])
+                
+                # Repeated timestamps without motion are undefined, treat as no motion
+                np.copyto(derivative, 0, where=np.isnan(derivative))
+
+                # Smooth derivatives if bolt configured for smoothing
+                if self.use_clipping:
+                    np.minimum(derivative, self.DERIVATIVE_CLIP_VALUE, out=derivative)
+
+                for row_index, column in enumerate(order_columns):
+                    derivative_rows[(order_index, column)] = derivative[row_index]
+                previous_order, previous_columns = derivative, order_columns
+
+        # Output columns: derivatives by order, sensor, motion type and axis, then magnitudes 
+        # by sensor, order and motion type
+        kinematics_block = np.empty((len(derivative_columns) + len(magnitude_columns), num_frames), dtype=np.float64)
+        for column_index, column in enumerate(derivative_columns):
+            kinematics_block[column_index] = derivative_rows[DERIVATIVE_COLUMNS[column]]
+        for column_index, column in enumerate(magnitude_columns, start=len(derivative_columns)):
+            order_index, sensor_columns = MAGNITUDE_COLUMNS[column]
+            magnitude = kinematics_block[column_index]
+            squared_axes = [derivative_rows[(order_index, sensor_column)]**2 for sensor_column in sensor_columns]
+            np.add(squared_axes[0], squared_axes[1], out=magnitude)
+            for squared_axis in squared_axes[2:]:
+                magnitude += squared_axis
+            np.sqrt(magnitude, out=magnitude)
+
+        kinematics_df = pd.DataFrame(
+            kinematics_block.T.astype(sensor_dtype, copy=False), columns=derivative_columns + magnitude_columns, index=output_df.index, copy=False)
+        output_df = pd.concat([output_df, kinematics_df], axis=1)
 
         return output_df, output_metadata
 
-    def _calculate_kinematic_magnitudes(self, output_df: pd.DataFrame, output_metadata: Dict):
-        kinematics_magnitudes = ["vel", "accel", "jerk"]
-
-        for sensor_pos in self.sensor_locations:
-            for magval in kinematics_magnitudes:
-                for motion_type in self.motion_types:
-                    # Separate rotation and position
-                    if motion_type == "rot":
-                        motion_axes = self.rot_axes
-                    elif motion_type == "pos":
-                        motion_axes = self.pos_axes
-
-                    magnitude_field = "_".join((sensor_pos, magval, motion_type, "magnitude"))
-                    fields = []
-                    for axis in motion_axes:
-                        fields.append("_".join((sensor_pos, magval,motion_type,axis)))
-
-                    output_df = self._magnitude_lambda(output_df, magnitude_field, fields)
-        return output_df, output_metadata
-    
-    def _magnitude_lambda(self, output_df: pd.DataFrame, magnitude_field: str, fields: List[str]):
-
-        # Add first three fields to dataframe
-        output_df[magnitude_field] = output_df[fields[0]]**2 + output_df[fields[1]]**2 + output_df[fields[2]]**2
-
-        if len(fields) == 4:
-            output_df[magnitude_field] += output_df[fields[3]]**2
-
-        # Check for negative values
-        if output_df[magnitude_field].min() <0:
-            print(f"The min and max of the {magnitude_field} is {output_df[magnitude_field].min()} and {output_df[magnitude_field].max()}")
-            assert False
-
-        # Take Square root to get magnitude
-        output_df[magnitude_field] = np.sqrt(output_df[magnitude_field])
-
-        return output_df
-
     def _calculate_moment_arms(self, output_df: pd.DataFrame, output_metadata: Dict):
         # TODO - implement moment arms
         return output_df, output_metadata
     
     def _calculate_xzplanar_moment_arm_mag(self, output_df: pd.DataFrame, output_metadata: Dict):
         
-        # Calculate moment arm length in xz plane
-        output_df['left_xzplanar_moment_arm_len'] = \
-            ((output_df["left_pos_x"]-output_df["head_pos_x"])**2 + \
-                (output_df["left_pos_z"]-output_df["head_pos_z"])**2)**0.5
-        
-        
-        output_df['right_xzplanar_moment_arm_len'] = \
-            ((output_df["right_pos_x"]-output_df["head_pos_x"])**2 + \
-                (output_df["right_pos_z"]-output_df["head_pos_z"])**2)**0.5
+        # Calculate requested moment arm lengths in xz plane
+        for sensor_pos in ['left', 'right']:
+            moment_arm_column = f'{sensor_pos}_xzplanar_moment_arm_len'
+            if not self._is_requested(moment_arm_column):
+                continue
+            output_df[moment_arm_column] = \
+                ((output_df[f"{sensor_pos}_pos_x"]-output_df["head_pos_x"])**2 + \
+                    (output_df[f"{sensor_pos}_pos_z"]-output_df["head_pos_z"])**2)**0.5
         
-        # Clip values to eliminate issues with headset and controller separation (setup, teardown, dropped, etc)
-        if self.use_clipping:
-            output_df['left_xzplanar_moment_arm_len'] = output_df["left_xzplanar_moment_arm_len"].clip(upper=self.MAX_MOMENT_ARM_LEN)
-            output_df['right_xzplanar_moment_arm_len'] = output_df["right_xzplanar_moment_arm_len"].clip(upper=self.MAX_MOMENT_ARM_LEN)
+            # Clip values to eliminate issues with headset and controller separation (setup, teardown, dropped, etc)
+            if self.use_clipping:
+                output_df[moment_arm_column] = output_df[moment_arm_column].clip(upper=self.MAX_MOMENT_ARM_LEN)
         
         return output_df, output_metadata
-
-
-    def _derivative(
-            self, 
-            df:pd.DataFrame, 
-            old_column_name: str, 
-            new_column_name: str, 
-            timestep: float):
-        
-        df[new_column_name] = df[old_column_name].diff() / df['timestamp'].diff()
-
-        return df
-
-    def _clip_derivatives(
-            self,
-            output_df: pd.DataFrame, 
-            new_col_name:str):
-        
-        # Get get maximum value for clipping
-        percentile_to_clip = 0.9
-        upper_bound_val = output_df[new_col_name].quantile(percentile_to_clip)
-
-        # Clip values in the 'values' column to the maximum value equal to the 90th percentile
-        output_df[new_col_name] = output_df[new_col_name].clip(upper=percentile_to_clip)
-
-        
-        return output_df
-
-        
@@ -2,127 +2,48 @@
 # Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
 # Author: Justin Martin (jcm-art)
 
-import copy
 from typing import Dict, List
 import numpy as np
 import pandas as pd
-from ..utils import CollectiveBodyBolt
+from ..storage import IntermediateStorage
+from ..utils import CollectiveBodyBolt, ALL_KEYS, COLUMNS, METADATA_KEYS
+from .derived_kinematics import DERIVED_COLUMNS
+from .fundamental_kinematics import KINEMATICS_COLUMNS
 
 START_CHAPTER = 1 
 END_CHAPTER = 3
+METRIC_COMMANDS = ['mean','max','min','sum','std']
+# Float64 values reduced at once, blocks of 512 KB stay in the cache of a core
+_BLOCK_VALUES = 2**16
+# Derived kinematics columns of the algorithm metrics
+ALGORITHM_NAMES = ["total_cartesian_distance","total_rotational_distance","linear_kinetic_energy","linear_power","rotational_inertia","rotational_kinetic_energy"]
 
-# TODO - make generic class with inheritance
-class MetricCalculator:
+class MetricsBolt(CollectiveBodyBolt):
+
+    # Basic data metrics are calculated for every numeric column, the kinematics bolts calculate the
+    # columns of the algorithm metrics and of the basic data metrics (all kinematics by default)
+    stage_inputs = {METADATA_KEYS: ["cleaned_metadata"], COLUMNS: ["chapitre"] + ALGORITHM_NAMES}
+    stage_outputs = {METADATA_KEYS: ["metrics_metadata", "metrics", "basic_data_metrics", "derived_kinematics_metadata"]}
 
     def __init__(
-            self,algorithm_name: str = None):
-        self.algorithm_name = algorithm_name
-
-        self.jump_dict_pd = {
-            'mean': pd.Series.mean,
-            'max': pd.Series.max,
-            'min': pd.Series.min,
-            'sum': pd.Series.sum,
-            'std': pd.Series.std,
-        }
+            self, 
+            output_directory_path: str, 
+            basic_data_columns: List[str] = None,
+            save_intermediate_output: bool=False, 
+            storage: IntermediateStorage=None) -> None:
+        super().__init__(output_directory_path, save_intermediate_output, storage)
 
-        self.jump_dict_np = {
-            'mean': np.mean,
-            'max': np.max,
-            'min': np.min,
-            'sum': np.sum,
-            'std': np.std,
-        }
+        # Kinematics columns calculated for their basic data metrics, all columns by default or with
+        # ALL_KEYS, an empty list only calculates the columns of the algorithm metrics
+        self.basic_data_columns = list(basic_data_columns) if basic_data_columns is not None else [ALL_KEYS]
+        if ALL_KEYS in self.basic_data_columns:
+            self.basic_data_columns = KINEMATICS_COLUMNS + DERIVED_COLUMNS
 
-        self.metric_dict = {
-            'dataset_id': [],
-            'mean': [],
-            'max': [],
-            'min': [],
-            'sum': [],
-            'std': [],
-        }
+    def get_config(self) -> Dict:
+        return {"basic_data_columns": self.basic_data_columns}
 
-        self.filtered_by_chapter_metric_dict = {
-            1: copy.deepcopy(self.metric_dict),
-            2: copy.deepcopy(self.metric_dict),
-            3: copy.deepcopy(self.metric_dict),
-        }
-
-        self.meta_metric_dict = {
-            'mean': None,
-            'max': None,
-            'min': None,
-            'sum': None,
-            'std': None,
-        }
-
-    def calculate_metrics(
-            self,
-            dataset_id: int,
-            series: pd.Series,
-            command_list: List[str] = [
-                'mean','max','min','sum','std']
-    ):
-        self.metric_dict['dataset_id'].append(dataset_id)
-        for command in command_list:
-            metric_result = self.jump_dict_pd[command](series)
-            self.metric_dict[command].append(metric_result)
-        return self.metric_dict
-
-    def calculate_chapter_metrics(
-            self,
-            dataset_id: int,
-            input_df: pd.DataFrame,
-            command_list: List[str] = [
-                'mean','max','min','sum','std']
-    ):
-        # Iterate through metrics by chapter to calculate filtered metrics
-        for chapter in self.filtered_by_chapter_metric_dict.keys():
-            # Filter data frame by chaper
-            chapter_df = input_df[input_df["chapitre"]==chapter]
-            chapter_df = chapter_df[self.algorithm_name]
-
-            # If cummulative metric, filter dataframe by prior chapter max
-            if chapter >1 and self.algorithm_name.startswith("total_"):
-                prior_chapter_max = input_df[input_df["chapitre"]==chapter-1][self.algorithm_name].max()
-                chapter_df = chapter_df-prior_chapter_max
-                
-            # Calculate metrics filtered by chaper
-            self.filtered_by_chapter_metric_dict[chapter]['dataset_id'].append(dataset_id)
-            for command in command_list:
-                metric_result = self.jump_dict_pd[command](chapter_df)
-                self.filtered_by_chapter_metric_dict[chapter][command].append(metric_result)
-        return self.filtered_by_chapter_metric_dict
-
-    def calculate_meta_metrics(
-            self,
-            np_array: np.array,
-            command_list: List[str] = [
-                'mean','max','min','sum','std']
-    ):
-        for command in command_list:
-            metric_result = self.jump_dict_np[command](np_array)
-            self.meta_metric_dict[command]=metric_result
-        return self.meta_metric_dict
-    
-    def get_metric_dict(self):
-        return self.metric_dict
-    
-    def get_chapter_metric_dict(self, chapter_num: int):
-        return self.filtered_by_chapter_metric_dict[chapter_num]
-    
-    def get_meta_metric_dict(self):
-        return self.meta_metric_dict
-    
-    def get_algorithm_name(self):
-        return self.algorithm_name
-    
-
-class MetricsBolt(CollectiveBodyBolt):
-
-    def __init__(self, output_directory_path: str, save_intermediate_output: bool=False) -> None:
-        super().__init__(output_directory_path, save_intermediate_output)
+    def get_stage_inputs(self) -> Dict[str, List[str]]:
+        return {**self.stage_inputs, COLUMNS: self.stage_inputs[COLUMNS] + self.basic_data_columns}
 
     # TODO - port to parent class as optional method
     def process(
@@ -158,7 +79,8 @@ class MetricsBolt(CollectiveBodyBolt):
             output_metadata["derived_kinematics_metadata"] = {}
 
             if output_metadata["cleaned_metadata"]["is_valid"]:
-                output_df, output_metadata = self._calculate_metrics(output_dataset_id, output_df, output_metadata)
+                with self._profile_dataset(output_dataset_id):
+                    output_df, output_metadata = self._calculate_metrics(output_dataset_id, output_df, output_metadata)
 
             else: 
                 output_metadata["metrics_metadata"] = {
@@ -181,52 +103,166 @@ class MetricsBolt(CollectiveBodyBolt):
         output_metadata["metrics"] = {}
         output_metadata["basic_data_metrics"] = {}
         
-        # Generate metrics for basic data
-        # TODO - replace by aggregated metadata with column list to prevent variation and recalling
-        # TODO - remove hardcoded column names
-        algorithm_names = ["total_cartesian_distance","total_rotational_distance","linear_kinetic_energy","linear_power","rotational_inertia","rotational_kinetic_energy"]
-        algo_set = set(algorithm_names)
-        all_cols_set = set(output_df.columns)
-        basic_columns = list(all_cols_set-algo_set)
-
-        output_metadata = self._basic_data_metrics(output_dataset_id, output_df, output_metadata, basic_columns)
-
-        # Calculate Metrics from algorithms
-        # TODO - move to process all datasets
-        # TODO - rework for autogeneration
-        
-        for algorithm in algorithm_names:
-            total_dist_metric = MetricCalculator(algorithm)
-            total_dist_metric.calculate_metrics(output_dataset_id, output_df[algorithm])        
-            output_metadata["metrics"][total_dist_metric.get_algorithm_name()] = total_dist_metric.get_metric_dict()
+        # Generate metrics for all numeric columns in one pass over the columns
+        algorithm_names = ALGORITHM_NAMES
+        column_metrics = self._reduce_column_metrics(output_dataset_id, output_df)
+        chapter_metrics = self._reduce_chapter_metrics(output_dataset_id, output_df, algorithm_names)
 
-            total_dist_metric.calculate_chapter_metrics(output_dataset_id, output_df[["chapitre", total_dist_metric.get_algorithm_name()]])
+        for column, metric_dict in column_metrics.items():
+            if column not in algorithm_names:
+                output_metadata["basic_data_metrics"][column] = metric_dict
 
-            # TODO - add a metrics by chapter function and separate out in metadata structure
+        # Add algorithm metrics, overall and by chapter
+        for algorithm in algorithm_names:
+            output_metadata["metrics"][algorithm] = column_metrics[algorithm]
             for i in range(START_CHAPTER, END_CHAPTER+1):
-                output_metadata["metrics"][total_dist_metric.get_algorithm_name()+"_chapter_"+str(i)] = total_dist_metric.get_chapter_metric_dict(i)
+                output_metadata["metrics"][algorithm+"_chapter_"+str(i)] = chapter_metrics[algorithm][i]
 
         return output_df, output_metadata
 
-    def _basic_data_metrics(
+    def _reduce_column_metrics(self, output_dataset_id: int, output_df: pd.DataFrame) -> Dict:
+        """
+        Calculate all metric commands for every numeric column, reducing blocks of columns.
+
+        Returns:
+        - Dictionary of column name to a metric dictionary of the dataset id and every metric command,
+        each in a one element list.
+        """
+        # Skip non-numeric columns, e.g. time
+        columns = [column for column, dtype in output_df.dtypes.items() if dtype.kind in "biuf"]
+        column_results = self._reduce_columns(output_df, columns)
+
+        column_metrics = {}
+        for i, column in enumerate(columns):
+            column_metrics[column] = self._get_metric_dict(
+                output_dataset_id, column_results, i, output_df[column].dtype)
+        return column_metrics
+
+    def _reduce_chapter_metrics(self, output_dataset_id: int, output_df: pd.DataFrame, algorithm_names: List[str]) -> Dict:
+        """
+        Calculate all metric commands for every algorithm and chapter, reducing the rows of each
+        chapter once for all algorithms.
+
+        Returns:
+        - Dictionary of algorithm name to a dictionary of chapter number to metric dictionary.
+        """
+        chapter_numbers = output_df["chapitre"].to_numpy()
+        cumulative = np.array([algorithm.startswith("total_") for algorithm in algorithm_names])
+
+        chapter_metrics = {algorithm: {} for algorithm in algorithm_names}
+        prior_chapter_max = None
+        for chapter in range(START_CHAPTER, END_CHAPTER+1):
+            # If cummulative metric, offset by prior chapter max
+            offsets = np.zeros(len(algorithm_names))
+            if chapter > 1:
+                offsets[cumulative] = prior_chapter_max[cumulative]
+
+            chapter_results = self._reduce_columns(
+                output_df, algorithm_names, np.flatnonzero(chapter_numbers == chapter), offsets)
+            prior_chapter_max = chapter_results["unshifted_max"]
+
+            for i, algorithm in enumerate(algorithm_names):
+                chapter_metrics[algorithm][chapter] = self._get_metric_dict(
+                    output_dataset_id, chapter_results, i, np.dtype(np.float64))
+
+        return chapter_metrics
+
+    def _reduce_columns(
             self, 
-            output_dataset_id: int,
             output_df: pd.DataFrame, 
-            output_metadata: Dict, 
-            basic_columns: List[str]
-     ) -> Dict:
-
-        for column in basic_columns:
-
-            # TODO - remove hardcoded fix to skip time (check for numeric)
-            if column!="time":
-                total_dist_metric = MetricCalculator(column)
-                total_dist_metric.calculate_metrics(output_dataset_id, output_df[column])
-
-                # TODO - rework for autogeneration
-                output_metadata["basic_data_metrics"][total_dist_metric.get_algorithm_name()] = total_dist_metric.get_metric_dict()
+            columns: List[str], 
+            row_indices: np.ndarray = None, 
+            offsets: np.ndarray = None) -> Dict[str, np.ndarray]:
+        """
+        Calculate all metric commands of columns over the rows of row_indices (all rows by default),
+        with offsets subtracted from the values of each column. Columns are copied into float64
+        blocks small enough to stay in cache and every block is reduced at once.
+
+        Returns:
+        - Dictionary of every metric command, "count" and "unshifted_max", the max before
+        subtracting the offsets, to an array of one value per column.
+        """
+        num_rows = len(output_df) if row_indices is None else len(row_indices)
+        rows = slice(None)
+        if row_indices is not None:
+            # Chapters are recorded in order, use a view of the rows if they are contiguous
+            rows = row_indices
+            if num_rows > 0 and row_indices[-1] - row_indices[0] + 1 == num_rows:
+                rows = slice(row_indices[0], row_indices[-1] + 1)
+        offsets = np.zeros(len(columns)) if offsets is None else offsets
+
+        # One float64 row per column, reductions along the contiguous rows use pairwise summation as
+        # pandas. The block buffer is reused by all groups of columns
+        group_results = []
+        group_size = max(1, min(_BLOCK_VALUES // max(num_rows, 1), len(columns)))
+        block_buffer = np.empty((group_size, num_rows), dtype=np.float64)
+        for start in range(0, len(columns), group_size):
+            group_columns = columns[start:start + group_size]
+            block = block_buffer[:len(group_columns)]
+            for i, column in enumerate(group_columns):
+                block[i] = output_df[column].to_numpy()[rows]
+
+            # Subtraction keeps the order of values, so the extrema of the offset values are the offset extrema
+            group_offsets = offsets[start:start + group_size]
+            extrema = self._reduce_extrema(block)
+            if np.any(group_offsets != 0):
+                block -= group_offsets[:, np.newaxis]
+            group_results.append({
+                "unshifted_max": extrema["max"],
+                "max": extrema["max"] - group_offsets,
+                "min": extrema["min"] - group_offsets,
+                **self._reduce_moments(block),
+            })
+
+        return {
+            key: np.concatenate([results[key] for results in group_results]) if group_results else np.empty(0)
+            for key in METRIC_COMMANDS + ["count", "unshifted_max"]
+        }
 
-        return output_metadata
+    def _reduce_extrema(self, block: np.ndarray) -> Dict[str, np.ndarray]:
+        """Max and min of every row of a block, skipping missing values."""
+        if block.shape[1] == 0:
+            return {"max": np.full(len(block), np.nan), "min": np.full(len(block), np.nan)}
+        return {"max": np.fmax.reduce(block, axis=1), "min": np.fmin.reduce(block, axis=1)}
+
+    def _reduce_moments(self, block: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Count, sum, mean and std of every row of a block, skipping missing values as the pandas
+        reductions do. The block values are overwritten.
+        """
+        counts = np.full(len(block), block.shape[1])
+        sums = block.sum(axis=1)
+
+        # Missing values are rare (e.g. rows before a time window fills), only mask the rows holding them
+        missing_rows = np.flatnonzero(np.isnan(sums))
+        missing = np.isnan(block[missing_rows])
+        if len(missing_rows) > 0:
+            counts[missing_rows] -= missing.sum(axis=1)
+            sums[missing_rows] = np.where(missing, 0, block[missing_rows]).sum(axis=1)
+
+        # Variance from deviations to the mean, as pandas, to keep precision for large offsets.
+        # The deviations are squared in place of the block values
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / counts, np.nan)
+            squared_deviations = np.subtract(block, means[:, np.newaxis], out=block)
+            np.square(squared_deviations, out=squared_deviations)
+            squared_sums = squared_deviations.sum(axis=1)
+            if len(missing_rows) > 0:
+                squared_sums[missing_rows] = np.where(missing, 0, squared_deviations[missing_rows]).sum(axis=1)
+            stds = np.where(counts > 1, np.sqrt(squared_sums / (counts - 1)), np.nan)
+
+        return {"count": counts, "sum": sums, "mean": means, "std": stds}
+
+    def _get_metric_dict(self, output_dataset_id: int, block_results: Dict[str, np.ndarray], i: int, dtype: np.dtype) -> Dict:
+        # Float results are float64 for float32 columns of the lean dtype policy, integers keep their type
+        metric_dict = {"dataset_id": [output_dataset_id]}
+        for command in METRIC_COMMANDS:
+            metric_dict[command] = [block_results[command][i]]
+        if dtype.kind != "f" and block_results["count"][i] > 0:
+            metric_dict["max"] = [dtype.type(block_results["max"][i])]
+            metric_dict["min"] = [dtype.type(block_results["min"][i])]
+            metric_dict["sum"] = [np.zeros(1, dtype=dtype).sum().dtype.type(block_results["sum"][i])]
+        return metric_dict
 
     def _divide_algorithm_by_chapter(self, output_df: pd.DataFrame, output_metadata: Dict, algorithm_name: str):
             new_algorithm_name = f"{algorithm_name}_by_chapter"
@@ -6,6 +6,13 @@ import pathlib
 
 import streamlit as st
 
+# Readers for the intermediate storage formats written by the data pipeline
+MOVEMENT_FILE_READERS = {
+    ".csv": pd.read_csv,
+    ".parquet": pd.read_parquet,
+    ".feather": pd.read_feather,
+}
+
 
 class MovementDataManager:
 
@@ -17,7 +24,10 @@ class MovementDataManager:
     def load_movement_data_from_upload(_self):
         # Get Uploaded files
         print("Initiaing file uploader")
-        movement_file_list = st.file_uploader("Upload raw data movement file", type=["csv"], accept_multiple_files=True)
+        movement_file_list = st.file_uploader(
+            "Upload raw data movement file", 
+            type=[suffix[1:] for suffix in MOVEMENT_FILE_READERS.keys()], 
+            accept_multiple_files=True)
         _self._load_file_list(movement_file_list)
     
     def load_local_movement_data_from_filepath(_self, _movement_file_directory):
@@ -30,22 +40,22 @@ class MovementDataManager:
 
     def _get_discovered_filepaths(self, directory_root: str):
         input_path = pathlib.Path(directory_root)
-        filepaths_in_directory = self._get_data_paths(input_path, ".csv")
+        filepaths_in_directory = self._get_data_paths(input_path, tuple(MOVEMENT_FILE_READERS.keys()))
 
         return filepaths_in_directory
     
-    def _get_data_paths(self, filepath, filetype):
+    def _get_data_paths(self, filepath, filetypes):
         paths = []
         for root, dirs, files in os.walk(filepath):
             for file in files:
-                if file.lower().endswith(filetype.lower()):
+                if file.lower().endswith(filetypes):
                     paths.append(str(pathlib.PurePath(root, file)))
         
         return paths
 
     def _load_file_list(self, df_file_path_list):
         for file in df_file_path_list:
-            movement_df = pd.read_csv(file)
+            movement_df = self._read_movement_file(file)
             dataset_id = list(movement_df["dataset_id"].unique())[0]
             self.dataset_ids.append(dataset_id)
             #print(dataset_id)
@@ -55,6 +65,12 @@ class MovementDataManager:
         
             #print(self.headset_num_dict[dataset_id])
 
+    def _read_movement_file(self, file):
+        # Files are either local paths or uploaded files, select reader by file suffix
+        file_name = file.name if hasattr(file, "name") else str(file)
+        file_suffix = pathlib.Path(file_name).suffix.lower()
+        return MOVEMENT_FILE_READERS[file_suffix](file)
+
     def get_dataset_IDs(self):
         return self.dataset_ids
 
@@ -0,0 +1,119 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import argparse
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from collective_body_movement.analysis import derived_kinematics
+from collective_body_movement.analysis.derived_kinematics import DerivedKinematicsBolt
+from collective_body_movement.analysis.fundamental_kinematics import FundamentalKinematicsBolt
+from collective_body_movement.benchmarks.utils import print_comparison, time_dataframe_function
+
+
+def make_kinematics_dataframe(num_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build a dataframe with the fundamental kinematics columns of random sensor motion."""
+    rng = np.random.default_rng(seed)
+    kinematics_bolt = FundamentalKinematicsBolt(None)
+    position_df = pd.DataFrame({"timestamp": np.cumsum(rng.integers(10, 30, num_rows))})
+    for sensor_pos in kinematics_bolt.sensor_locations:
+        for axis in kinematics_bolt.pos_axes:
+            position_df[f"{sensor_pos}_pos_{axis}"] = np.cumsum(rng.normal(scale=0.01, size=num_rows))
+        for axis in kinematics_bolt.rot_axes:
+            position_df[f"{sensor_pos}_rot_{axis}"] = rng.uniform(-1, 1, size=num_rows)
+
+    position_df, _ = kinematics_bolt._calculate_kinematics_block(position_df, {})
+    position_df, _ = kinematics_bolt._calculate_xzplanar_moment_arm_mag(position_df, {})
+    return position_df
+
+
+def _six_pass_reference(output_df: pd.DataFrame) -> pd.DataFrame:
+    """Previous implementation, one pass per derived quantity."""
+    torso_legs_head_mass = derived_kinematics.torso_legs_head_mass
+    hand_arm_mass = derived_kinematics.hand_arm_mass
+    hand_mass = derived_kinematics.hand_mass
+    arm_mass = derived_kinematics.arm_mass
+    body_radius = derived_kinematics.body_radius
+
+    output_df['cartesian_displacement'] = np.sqrt(
+        output_df['head_pos_x'].diff()**2 + output_df['head_pos_y'].diff()**2 + output_df['head_pos_z'].diff()**2
+    )
+    output_df.loc[0, 'cartesian_displacement'] = 0
+    output_df['total_cartesian_distance'] = output_df['cartesian_displacement'].cumsum()
+
+    output_df['rotational_displacement'] = np.sqrt(
+        output_df['head_rot_i'].diff()**2 + output_df['head_rot_j'].diff()**2 + output_df['head_rot_k'].diff()**2 + output_df['head_rot_l'].diff()**2
+    )
+    output_df.loc[0, 'rotational_displacement'] = 0
+    output_df['total_rotational_distance'] = output_df['rotational_displacement'].cumsum()
+
+    output_df['linear_kinetic_energy'] = np.sqrt(
+        output_df['head_vel_pos_magnitude']**2 * 1/2 * torso_legs_head_mass + \
+            output_df['left_vel_pos_magnitude']**2 * 1/2 * hand_arm_mass + \
+                output_df['right_vel_pos_magnitude']**2 * 1/2 * hand_arm_mass
+    )
+
+    output_df['linear_power'] = \
+        output_df["head_accel_pos_magnitude"]* output_df["head_vel_pos_magnitude"] * torso_legs_head_mass + \
+        output_df["left_accel_pos_magnitude"]* output_df["left_vel_pos_magnitude"] * hand_arm_mass + \
+        output_df["right_accel_pos_magnitude"]* output_df["right_vel_pos_magnitude"] * hand_arm_mass
+
+    output_df = output_df.assign(
+            rotational_inertia=lambda x: (
+                1/2 * torso_legs_head_mass * body_radius**2 +
+                1/3 * arm_mass * x["left_xzplanar_moment_arm_len"]**2 +
+                1/3 * arm_mass * x["right_xzplanar_moment_arm_len"]**2 +
+                1/1 * hand_mass * x["left_xzplanar_moment_arm_len"]**2 +
+                1/1 * hand_mass * x["right_xzplanar_moment_arm_len"]**2
+            )
+        )
+
+    output_df = output_df.assign(
+            rotational_kinetic_energy=lambda x: (
+                x["head_vel_rot_magnitude"]**2 * 1/2 * 1/2 * torso_legs_head_mass * body_radius**2 +
+                x["left_vel_rot_magnitude"]**2 * 1/2 * (
+                    hand_mass * x["left_xzplanar_moment_arm_len"]**2 + 1/3 * arm_mass * x["left_xzplanar_moment_arm_len"]**2
+                ) +
+                x["right_vel_rot_magnitude"]**2 * 1/2 * (
+                    hand_mass * x["right_xzplanar_moment_arm_len"]**2 + 1/3 * arm_mass * x["right_xzplanar_moment_arm_len"]**2
+                )
+            )
+        )
+
+    return output_df
+
+
+def _fused_derived_kinematics(df: pd.DataFrame) -> pd.DataFrame:
+    output_df, _ = DerivedKinematicsBolt(None)._derived_kinematics(df, {})
+    return output_df
+
+
+def run_benchmark(num_rows: int = 300000, repeats: int = 3) -> Dict:
+    df = make_kinematics_dataframe(num_rows)
+
+    results = {
+        "six_pass_derived_kinematics": time_dataframe_function(_six_pass_reference, df, repeats),
+        "fused_derived_kinematics": time_dataframe_function(_fused_derived_kinematics, df, repeats),
+    }
+
+    # Both implementations must produce the same columns and values
+    pd.testing.assert_frame_equal(
+        results["six_pass_derived_kinematics"]["output"], results["fused_derived_kinematics"]["output"])
+
+    print_comparison(results, num_rows, repeats, "six_pass_derived_kinematics", "fused_derived_kinematics")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='Derived Kinematics Benchmark',
+                    description='Compares the single pass derived kinematics against the previous six pass implementation.')
+    parser.add_argument('--num_rows', type=int, default=300000)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    run_benchmark(num_rows=args.num_rows, repeats=args.repeats)
@@ -0,0 +1,216 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from collective_body_movement.benchmarks.synthetic_sessions import SyntheticSessionGenerator
+from collective_body_movement.pipeline.data_pipeline import CollectiveBodyDataPipeline
+from collective_body_movement.preprocessing.parsers import count_data_lines
+
+# Synthetic corpora by size, every size is generated from the same seed
+CORPUS_SIZES = {
+    "small": {"num_sessions": 2, "num_headsets": 3, "frames_per_file": 3000},
+    "medium": {"num_sessions": 4, "num_headsets": 6, "frames_per_file": 6000},
+    "large": {"num_sessions": 16, "num_headsets": 6, "frames_per_file": 6000},
+}
+
+# Benchmarked bolts, and the full pipeline with and without saving the stage outputs
+BENCHMARK_STAGES = [
+    "DataCleanerBolt", "TimeAverageBolt", "FundamentalKinematicsBolt", "DerivedKinematicsBolt",
+    "MetricsBolt", "AggregatorBolt", "NormalizerBolt",
+]
+PIPELINE_STAGE = "pipeline"
+PIPELINE_WITH_OUTPUT_STAGE = "pipeline_with_output"
+
+DEFAULT_BASELINE_PATH = pathlib.Path(__file__).parent / "pipeline_baseline.json"
+# Slowdowns smaller than this are timing noise of short stages, not regressions
+MIN_REGRESSION_TIME = 0.05
+
+
+def run_corpus_benchmark(corpus_parameters: Dict, repeats: int = 3, num_workers: int = 1, measure_memory: bool = True) -> Dict:
+    """
+    Benchmark every bolt and the full pipeline on a synthetic corpus. Bolts are timed in a run
+    without saved outputs, peak memory is measured in a separate run with tracemalloc.
+    """
+    with tempfile.TemporaryDirectory() as temporary_directory, _working_directory(temporary_directory):
+        # The cleaner reads the data collection from the third part of the relative path
+        data_path = pathlib.Path("bin/data")
+        generator = SyntheticSessionGenerator(**corpus_parameters)
+        written_paths = generator.write_corpus(data_path)
+        corpus = {
+            **corpus_parameters,
+            "num_files": len(written_paths),
+            "num_frames": sum(count_data_lines(path) for path in written_paths),
+        }
+        input_path = str(data_path / generator.data_collection)
+
+        # Best of the repeated runs
+        stage_times = {}
+        for repeat in range(repeats):
+            stage_reports, pipeline_time = _run_pipeline(
+                input_path, f"output_{repeat}", num_workers=num_workers, save_stages=[], memory_probe="none")
+            run_times = {**{report["stage_name"]: report["wall_time"] for report in stage_reports}, PIPELINE_STAGE: pipeline_time}
+            _, run_times[PIPELINE_WITH_OUTPUT_STAGE] = _run_pipeline(
+                input_path, f"output_saved_{repeat}", num_workers=num_workers, memory_probe="none")
+            for stage_name, wall_time in run_times.items():
+                stage_times[stage_name] = min(wall_time, stage_times.get(stage_name, wall_time))
+
+        stage_peaks = {}
+        if measure_memory:
+            stage_reports, _ = _run_pipeline(
+                input_path, "output_memory", num_workers=num_workers, save_stages=[], memory_probe="tracemalloc")
+            stage_peaks = {report["stage_name"]: report["peak_memory_bytes"] for report in stage_reports}
+            stage_peaks[PIPELINE_STAGE] = max(stage_peaks.values())
+
+    stage_results = {}
+    for stage_name in BENCHMARK_STAGES + [PIPELINE_STAGE, PIPELINE_WITH_OUTPUT_STAGE]:
+        wall_time = stage_times[stage_name]
+        stage_results[stage_name] = {
+            "wall_time": wall_time,
+            "frames_per_second": corpus["num_frames"] / wall_time,
+            "files_per_second": corpus["num_files"] / wall_time,
+            "peak_memory_bytes": stage_peaks.get(stage_name),
+        }
+
+    return {"corpus": corpus, "stages": stage_results}
+
+
+def run_benchmark_suite(sizes: List[str], repeats: int = 3, num_workers: int = 1, measure_memory: bool = True) -> Dict:
+    results = {"machine": get_machine_info(), "sizes": {}}
+    for size in sizes:
+        print(f"Benchmarking {size} corpus {CORPUS_SIZES[size]}")
+        results["sizes"][size] = run_corpus_benchmark(CORPUS_SIZES[size], repeats, num_workers, measure_memory)
+        print_corpus_results(size, results["sizes"][size])
+    return results
+
+
+def get_machine_info() -> Dict:
+    """Machine and python version of the benchmark, wall times are only comparable with a baseline of the same."""
+    processor = platform.processor()
+    # The processor name is often empty on Linux
+    if os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo") as cpuinfo_file:
+            model_names = [line.split(":", 1)[1].strip() for line in cpuinfo_file if line.startswith("model name")]
+        processor = model_names[0] if len(model_names) > 0 else processor
+    return {
+        "system": platform.system(),
+        "architecture": platform.machine(),
+        "processor": processor,
+        "cpu_count": os.cpu_count(),
+        "python_version": platform.python_version(),
+    }
+
+
+def find_regressions(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Compare wall times and peak memory with the baseline, stages and sizes missing from either are skipped."""
+    regressions = []
+    for size, size_results in results["sizes"].items():
+        baseline_stages = baseline["sizes"].get(size, {}).get("stages", {})
+        for stage_name, stage_result in size_results["stages"].items():
+            if stage_name not in baseline_stages:
+                continue
+            for measure in ["wall_time", "peak_memory_bytes"]:
+                value, baseline_value = stage_result[measure], baseline_stages[stage_name][measure]
+                if value is None or baseline_value is None:
+                    continue
+                if measure == "wall_time" and value - baseline_value < MIN_REGRESSION_TIME:
+                    continue
+                if value > baseline_value * (1 + threshold):
+                    regressions.append(
+                        f"{size} {stage_name} {measure}: {value:.4g} is {value / baseline_value - 1:.0%} "
+                        f"above the baseline {baseline_value:.4g}")
+    return regressions
+
+
+def print_corpus_results(size: str, corpus_results: Dict):
+    corpus = corpus_results["corpus"]
+    print(f"{size}: {corpus['num_files']} files, {corpus['num_frames']} frames")
+    for stage_name, stage_result in corpus_results["stages"].items():
+        peak_memory = stage_result["peak_memory_bytes"]
+        peak_memory_text = f"{peak_memory / 1e6:.1f} MB" if peak_memory is not None else "not measured"
+        print(f"  {stage_name}: {stage_result['wall_time']:.3f} s, {stage_result['frames_per_second']:.0f} frames/s, "
+              f"{stage_result['files_per_second']:.1f} files/s, peak allocation: {peak_memory_text}")
+
+
+def _run_pipeline(input_path: str, output_directory: str, **pipeline_arguments) -> (List[Dict], float):
+    # Pipeline logs are not printed, the pipeline time includes waiting for background writes
+    with contextlib.redirect_stdout(io.StringIO()):
+        pipeline = CollectiveBodyDataPipeline(output_directory, **pipeline_arguments)
+        pipeline.initialize_input(raw_data_path=input_path)
+        start_time = time.perf_counter()
+        pipeline.run_pipeline()
+        pipeline_time = time.perf_counter() - start_time
+    return pipeline.profiler.stage_reports, pipeline_time
+
+
+@contextlib.contextmanager
+def _working_directory(path):
+    previous_directory = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous_directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='Pipeline Benchmark Suite',
+                    description='Benchmarks every bolt and the full pipeline on synthetic corpora and compares with a '
+                                'baseline of the same machine, saved with --save_baseline.')
+    parser.add_argument('--sizes', type=str, nargs='+', default=["small", "medium"], choices=list(CORPUS_SIZES.keys()))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--skip_memory', action='store_true', default=False)
+    parser.add_argument('--baseline', type=str, default=str(DEFAULT_BASELINE_PATH))
+    parser.add_argument('--save_baseline', action='store_true', default=False)
+    parser.add_argument('--allow_missing_baseline', action='store_true', default=False)
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--output', type=str, default=None)
+    args = parser.parse_args()
+
+    results = run_benchmark_suite(args.sizes, args.repeats, args.num_workers, measure_memory=not args.skip_memory)
+
+    if args.output is not None:
+        with open(args.output, "w") as outfile:
+            outfile.write(json.dumps(results, indent = 6, sort_keys=True))
+
+    baseline_path = pathlib.Path(args.baseline)
+    if args.save_baseline:
+        with open(baseline_path, "w") as outfile:
+            outfile.write(json.dumps(results, indent = 6, sort_keys=True))
+        print(f"Saved baseline to {baseline_path}")
+    else:
+        baseline = None
+        if baseline_path.exists():
+            with open(baseline_path) as json_file:
+                baseline = json.load(json_file)
+
+        if baseline is None:
+            print(f"No baseline found at {baseline_path}, run with --save_baseline to save one")
+        elif baseline.get("machine") != results["machine"]:
+            # Wall times of other machines are not comparable, a baseline is saved per machine
+            print(f"Baseline at {baseline_path} was measured on {baseline.get('machine')}, not on this machine "
+                  f"{results['machine']}, run with --save_baseline to save one for this machine")
+            baseline = None
+        if baseline is None:
+            if not args.allow_missing_baseline:
+                sys.exit(1)
+        else:
+            regressions = find_regressions(results, baseline, args.threshold)
+            for regression in regressions:
+                print(f"Regression: {regression}")
+            if len(regressions) > 0:
+                sys.exit(1)
+            print(f"No stage regressed by more than {args.threshold:.0%} against {baseline_path}")
@@ -0,0 +1,108 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import argparse
+import pathlib
+import tempfile
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from collective_body_movement.benchmarks.tuple_parsing import make_tuple_dataframe, strip_split_columns
+from collective_body_movement.benchmarks.utils import print_comparison, time_file_function
+from collective_body_movement.preprocessing.cleaner import DataCleanerBolt
+from collective_body_movement.preprocessing.parsers import parse_tuple_columns
+from collective_body_movement.preprocessing.raw_reader import RawSessionReader
+
+
+def write_raw_file(path: pathlib.Path, num_rows: int, seed: int = 0):
+    """Write a raw session file of random sensor motion in the semicolon separated raw format."""
+    rng = np.random.default_rng(seed)
+    raw_df = make_tuple_dataframe(num_rows, seed)
+    milliseconds = 11 * 3600000 + np.cumsum(rng.integers(30, 36, num_rows))
+    raw_df["time"] = [
+        f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}::{ms // 1000 % 60:02d}:{ms % 1000:03d}" for ms in milliseconds
+    ]
+    raw_df["chapitre"] = np.repeat(np.arange(1, 5), -(-num_rows // 4))[:num_rows]
+    raw_df["leftballscount"] = rng.integers(0, 10, num_rows)
+    raw_df["rightballscount"] = rng.integers(0, 10, num_rows)
+    raw_df = raw_df[DataCleanerBolt.RAW_COLUMNS]
+    raw_df.to_csv(path, sep=";", index=False, header=["time","head","left","right","hr","lr","rr","chapitre","bb","lb","rb"])
+
+
+def _read_csv_strip_split_reference(path: pathlib.Path) -> pd.DataFrame:
+    """pandas read followed by the per column strip, split and cast of the tuple columns."""
+    cleaner = DataCleanerBolt(None, save_intermediate_output=False, num_workers=1, raw_reader="pandas")
+    df = cleaner._read_csv_to_dataframe(path)
+    for column, dimensions in DataCleanerBolt.TUPLE_COLUMN_DIMENSIONS.items():
+        df = strip_split_columns(df, [column], dimensions)
+    return df
+
+
+def _read_csv_parse_tuple_columns(path: pathlib.Path) -> pd.DataFrame:
+    """pandas read followed by the single pass tuple column parser, used by the cleaner."""
+    cleaner = DataCleanerBolt(None, save_intermediate_output=False, num_workers=1, raw_reader="pandas")
+    df = cleaner._read_csv_to_dataframe(path)
+    return parse_tuple_columns(df, DataCleanerBolt.TUPLE_COLUMN_DIMENSIONS)
+
+
+def check_malformed_values(reader: RawSessionReader, num_rows: int = 10):
+    """Blank tuple and integer fields and non-numeric values must raise a ValueError."""
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        raw_path = pathlib.Path(temporary_directory)/"malformed.csv"
+        write_raw_file(raw_path, num_rows)
+        raw_lines = raw_path.read_text().splitlines()
+        fields = raw_lines[num_rows // 2].split(";")
+        head_values = fields[1].split(",")
+        for malformed_field, field_value in [
+                (1, ",".join([head_values[0], " ", head_values[2]])),
+                (1, ",".join([head_values[0], " abc", head_values[2]])),
+                (7, " ")]:
+            malformed_fields = list(fields)
+            malformed_fields[malformed_field] = field_value
+            raw_path.write_text("\n".join(raw_lines[:num_rows // 2] + [";".join(malformed_fields)] + raw_lines[num_rows // 2 + 1:]))
+            try:
+                reader.read(raw_path)
+            except ValueError:
+                continue
+            raise AssertionError(f"Raw field {field_value} was read without an error")
+
+
+def run_benchmark(num_rows: int = 300000, repeats: int = 3, chunk_bytes: int = 16 * 2**20) -> Dict:
+    reader = RawSessionReader(
+        DataCleanerBolt.RAW_COLUMNS, DataCleanerBolt.TUPLE_COLUMN_DIMENSIONS, integer_columns=DataCleanerBolt.get_integer_columns())
+    check_malformed_values(reader)
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        raw_path = pathlib.Path(temporary_directory)/"log+cb+1+x_2023-26-06-0-11-00-00.csv"
+        write_raw_file(raw_path, num_rows)
+
+        results = {
+            "read_csv_strip_split": time_file_function(_read_csv_strip_split_reference, raw_path, repeats),
+            "read_csv_parse_tuple_columns": time_file_function(_read_csv_parse_tuple_columns, raw_path, repeats),
+            "mmap_reader": time_file_function(reader.read, raw_path, repeats),
+            "mmap_reader_chunked": time_file_function(
+                lambda path: pd.concat(reader.iter_chunks(path, chunk_bytes=chunk_bytes)), raw_path, repeats),
+        }
+
+    # All readers must produce the same columns and values
+    for name in ["read_csv_parse_tuple_columns", "mmap_reader", "mmap_reader_chunked"]:
+        pd.testing.assert_frame_equal(results["read_csv_strip_split"]["output"], results[name]["output"], check_exact=True)
+
+    print_comparison(results, num_rows, repeats, "read_csv_strip_split", "mmap_reader")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='Raw Reader Benchmark',
+                    description='Compares the memory mapped raw reader against pandas read_csv with strip and split of the tuple columns.')
+    parser.add_argument('--num_rows', type=int, default=300000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--chunk_bytes', type=int, default=16 * 2**20)
+    args = parser.parse_args()
+
+    run_benchmark(num_rows=args.num_rows, repeats=args.repeats, chunk_bytes=args.chunk_bytes)
@@ -0,0 +1,53 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import argparse
+import pathlib
+import tempfile
+from typing import Dict
+
+import pandas as pd
+
+from collective_body_movement.benchmarks.time_averaging import make_cleaned_dataframe
+from collective_body_movement.benchmarks.utils import print_comparison, time_dataframe_function
+from collective_body_movement.storage import STORAGE_FORMATS
+
+
+def make_stage_dataframe(num_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build a numeric stage output with the non-default index left by downsampling every 4 frames."""
+    return make_cleaned_dataframe(num_rows * 4, seed).drop(columns=["time"]).iloc[::4]
+
+
+def run_benchmark(num_rows: int = 300000, repeats: int = 3) -> Dict:
+    stage_df = make_stage_dataframe(num_rows)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        for storage_format, storage_class in STORAGE_FORMATS.items():
+            storage = storage_class()
+            path_stem = pathlib.Path(temporary_directory)/storage_format
+
+            def write_and_read(df: pd.DataFrame) -> pd.DataFrame:
+                return storage.read_dataframe(storage.write_dataframe(df, path_stem))
+
+            results[storage_format] = time_dataframe_function(write_and_read, stage_df, repeats)
+
+    # Every storage format must restore the columns, values and index, csv may round floats in the last digit
+    for storage_format, result in results.items():
+        pd.testing.assert_frame_equal(stage_df, result["output"], check_exact=storage_format != "csv")
+
+    print_comparison(results, num_rows, repeats, "csv", "feather")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='Storage Format Benchmark',
+                    description='Compares writing and reading a stage output with every storage format.')
+    parser.add_argument('--num_rows', type=int, default=300000)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    run_benchmark(num_rows=args.num_rows, repeats=args.repeats)
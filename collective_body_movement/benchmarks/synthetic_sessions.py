@@ -0,0 +1,181 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import argparse
+import datetime
+import pathlib
+from typing import List
+
+import numpy as np
+
+# Header line of raw files, skipped by the cleaner
+RAW_HEADER = "time;head;left;right;hr;lr;rr;chapitre;bb;lb;rb"
+
+# Raw line, the time, positions and rotations of the head and hands, the chapter, the big ball
+# position and the ball counts of both hands
+RAW_LINE_FORMAT = ";".join([
+    "%02d:%02d::%02d:%03d",
+    "(%.4f, %.4f, %.4f)", "(%.4f, %.4f, %.4f)", "(%.4f, %.4f, %.4f)",
+    "(%.4f, %.4f, %.4f, %.4f)", "(%.4f, %.4f, %.4f, %.4f)", "(%.4f, %.4f, %.4f, %.4f)",
+    "%d",
+    "(%.4f, %.4f, %.4f)",
+    "%d", "%d",
+])
+
+# Share of the session frames in each of the four chapters
+CHAPTER_FRACTIONS = [0.3, 0.3, 0.3, 0.1]
+
+
+class SyntheticSessionGenerator:
+    """Generator of synthetic raw session recordings in the raw data layout, to benchmark the pipeline without the recorded data."""
+
+    MAX_HEADSETS = 9 # The cleaner reads the headset number from one filename digit
+    FIRST_SESSION_HOUR = 9
+    LAST_SESSION_HOUR = 22
+    MIN_SESSION_SPACING = 600 # Seconds, the cleaner groups recordings starting within 500 s
+    RESTART_FRAMES = 500
+
+    def __init__(
+            self,
+            num_sessions: int = 4,
+            num_headsets: int = 6,
+            frames_per_file: int = 6000,
+            frame_period: float = 33.3,
+            noise_scale: float = 0.002,
+            dropout_rate: float = 0.01,
+            restart_rate: float = 0.0,
+            headset_logs: bool = False,
+            data_collection: str = "DATA.2023.06.26",
+            seed: int = 0) -> None:
+        if not 1 <= num_headsets <= self.MAX_HEADSETS:
+            raise ValueError(f"Number of headsets {num_headsets} must be between 1 and {self.MAX_HEADSETS}")
+        if frames_per_file <= self.RESTART_FRAMES * 2:
+            raise ValueError(f"Files need more than {self.RESTART_FRAMES * 2} frames to be valid sessions")
+        if not 0 <= dropout_rate < 1 or not 0 <= restart_rate <= 1:
+            raise ValueError("Dropout and restart rates must be between 0 and 1")
+        self.num_sessions = num_sessions
+        self.num_headsets = num_headsets
+        self.frames_per_file = frames_per_file
+        self.frame_period = frame_period
+        self.noise_scale = noise_scale
+        self.dropout_rate = dropout_rate
+        self.restart_rate = restart_rate
+        self.headset_logs = headset_logs
+        self.data_collection = data_collection
+        self.seed = seed
+
+        collection_date = datetime.datetime.strptime(data_collection.split(".", 1)[1], "%Y.%m.%d")
+        self.first_session_start = collection_date + datetime.timedelta(hours=self.FIRST_SESSION_HOUR)
+
+    def write_corpus(self, output_directory) -> List[pathlib.Path]:
+        """Write all session recordings under the output directory and return their paths."""
+        collection_path = pathlib.Path(output_directory) / self.data_collection
+        rng = np.random.default_rng(self.seed)
+
+        written_paths = []
+        for session_index in range(self.num_sessions):
+            session_start, day_number = self._get_session_start(session_index)
+            for headset_number in range(1, self.num_headsets + 1):
+                # Headsets are started one after the other
+                file_start = session_start + datetime.timedelta(seconds=int(rng.integers(0, 30)))
+                # Restarted recordings and headset side copies are rejected by the cleaner
+                num_frames = self.frames_per_file
+                if rng.random() < self.restart_rate:
+                    num_frames = int(rng.integers(self.RESTART_FRAMES // 2, self.RESTART_FRAMES))
+
+                raw_text = self._make_session_text(file_start, num_frames, rng)
+                file_name = self._get_file_name(headset_number, file_start)
+                source_folders = ["Server", "Headset"] if self.headset_logs else ["Server"]
+                for source_folder in source_folders:
+                    file_path = collection_path / source_folder / f"day{day_number}" / file_name
+                    file_path.parent.mkdir(parents=True, exist_ok=True)
+                    file_path.write_text(raw_text)
+                    written_paths.append(file_path)
+
+        return written_paths
+
+    def _get_session_start(self, session_index: int) -> (datetime.datetime, int):
+        session_duration = self.frames_per_file * self.frame_period / 1000 + 60
+        session_spacing = max(self.MIN_SESSION_SPACING, int(np.ceil(session_duration / 60)) * 60)
+        sessions_per_day = max(1, (self.LAST_SESSION_HOUR - self.FIRST_SESSION_HOUR) * 3600 // session_spacing)
+        day_index, day_session_index = divmod(session_index, sessions_per_day)
+        session_start = self.first_session_start + datetime.timedelta(
+            days=day_index, seconds=day_session_index * session_spacing)
+        return session_start, day_index + 1
+
+    def _get_file_name(self, headset_number: int, file_start: datetime.datetime) -> str:
+        return (f"log+cb+{headset_number}+x_{file_start.year}-{file_start.day:02d}-{file_start.month:02d}-0-"
+                f"{file_start.hour:02d}-{file_start.minute:02d}-{file_start.second:02d}.csv")
+
+    def _make_session_text(self, file_start: datetime.datetime, num_frames: int, rng: np.random.Generator) -> str:
+        # Frame times jitter around the frame period, dropped frames are left out
+        frame_times = np.cumsum(rng.normal(self.frame_period, self.frame_period * 0.05, num_frames).clip(1))
+        recorded_frames = rng.random(num_frames) >= self.dropout_rate
+        frame_milliseconds = (
+            (file_start.hour * 3600 + file_start.minute * 60 + file_start.second) * 1000 + frame_times.astype(np.int64)
+        )[recorded_frames]
+
+        # People wander around their start position and crouch, hands move around the head
+        frame_seconds = frame_times / 1000
+        start_position = np.array([rng.uniform(-2, 2), 1.6, rng.uniform(-2, 2)])
+        head_position = start_position + self._smooth_motion(frame_seconds, [1.0, 0.1, 1.0], 0.05, rng)
+        left_position = head_position + [-0.3, -0.4, 0.2] + self._smooth_motion(frame_seconds, [0.3, 0.3, 0.3], 1.0, rng)
+        right_position = head_position + [0.3, -0.4, 0.2] + self._smooth_motion(frame_seconds, [0.3, 0.3, 0.3], 1.0, rng)
+        rotations = [self._random_rotation(num_frames, rng) for _ in range(3)]
+        positions = [head_position, left_position, right_position]
+        positions = [position + rng.normal(scale=self.noise_scale, size=position.shape) for position in positions]
+
+        # Chapters follow each other, balls fall and are caught during the first chapter
+        chapter_ends = np.cumsum(np.array(CHAPTER_FRACTIONS) * num_frames).astype(np.int64)
+        chapters = 1 + np.searchsorted(chapter_ends, np.arange(num_frames), side="right").clip(0, 3)
+        bigball_position = np.column_stack([
+            np.sin(np.linspace(0, 4 * np.pi, num_frames)), np.linspace(5, 0, num_frames), np.zeros(num_frames)])
+        caught_balls = (rng.random((num_frames, 2)) < 0.005) & (chapters == 1)[:, np.newaxis]
+        ball_counts = np.cumsum(caught_balls, axis=0)
+
+        frame_values = np.column_stack([*positions, *rotations])[recorded_frames]
+        rows = zip(
+            frame_milliseconds // 3600000, frame_milliseconds // 60000 % 60, frame_milliseconds // 1000 % 60,
+            frame_milliseconds % 1000, *frame_values.T, chapters[recorded_frames], *bigball_position[recorded_frames].T,
+            *ball_counts[recorded_frames].T)
+        return "\n".join([RAW_HEADER] + [RAW_LINE_FORMAT % row for row in rows]) + "\n"
+
+    def _smooth_motion(self, frame_seconds: np.ndarray, amplitudes: List[float], max_frequency: float, rng: np.random.Generator) -> np.ndarray:
+        # Sum of slow oscillations of random frequency and phase along each axis
+        motion = np.zeros((len(frame_seconds), len(amplitudes)))
+        for axis, amplitude in enumerate(amplitudes):
+            frequencies = rng.uniform(max_frequency / 10, max_frequency, 3)
+            phases = rng.uniform(0, 2 * np.pi, 3)
+            motion[:, axis] = amplitude / 3 * np.sin(2 * np.pi * frame_seconds[:, np.newaxis] * frequencies + phases).sum(axis=1)
+        return motion
+
+    def _random_rotation(self, num_frames: int, rng: np.random.Generator) -> np.ndarray:
+        # Turning around the vertical axis, with sensor noise on the unit quaternion
+        yaw = np.cumsum(rng.normal(scale=0.01, size=num_frames))
+        rotation = np.column_stack([np.zeros(num_frames), np.sin(yaw / 2), np.zeros(num_frames), np.cos(yaw / 2)])
+        rotation += rng.normal(scale=self.noise_scale, size=rotation.shape)
+        return rotation / np.linalg.norm(rotation, axis=1, keepdims=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='Synthetic Session Generator',
+                    description='Writes synthetic raw session recordings in the raw data layout.')
+    parser.add_argument('output_directory', type=str)
+    parser.add_argument('--num_sessions', type=int, default=4)
+    parser.add_argument('--num_headsets', type=int, default=6)
+    parser.add_argument('--frames_per_file', type=int, default=6000)
+    parser.add_argument('--noise_scale', type=float, default=0.002)
+    parser.add_argument('--dropout_rate', type=float, default=0.01)
+    parser.add_argument('--restart_rate', type=float, default=0.0)
+    parser.add_argument('--headset_logs', action='store_true', default=False)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = SyntheticSessionGenerator(
+        num_sessions=args.num_sessions, num_headsets=args.num_headsets, frames_per_file=args.frames_per_file,
+        noise_scale=args.noise_scale, dropout_rate=args.dropout_rate, restart_rate=args.restart_rate,
+        headset_logs=args.headset_logs, seed=args.seed)
+    written_paths = generator.write_corpus(args.output_directory)
+    print(f"Wrote {len(written_paths)} raw session files to {args.output_directory}")
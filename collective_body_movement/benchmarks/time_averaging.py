@@ -0,0 +1,75 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import argparse
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from collective_body_movement.benchmarks.utils import print_comparison, time_dataframe_function
+from collective_body_movement.preprocessing.timeaverager import TimeAverageBolt
+
+
+def make_cleaned_dataframe(num_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build a dataframe with the cleaned columns of random sensor motion, in timestamp order."""
+    rng = np.random.default_rng(seed)
+    timestamps = np.cumsum(rng.integers(10, 30, num_rows))
+    cleaned_df = pd.DataFrame({
+        "time": pd.to_datetime(timestamps, unit="ms"),
+        "chapitre": np.repeat(np.arange(1, 4), -(-num_rows // 3))[:num_rows],
+        "leftballscount": rng.integers(0, 10, num_rows),
+        "rightballscount": rng.integers(0, 10, num_rows),
+        "dataset_id": 0,
+        "headset_number": 1,
+        "session_number": 1,
+        "timestamp": timestamps,
+        "elapsed_time": timestamps - timestamps[0],
+    })
+    for column in TimeAverageBolt.COLUMNS_TO_SMOOTH:
+        cleaned_df[column] = np.cumsum(rng.normal(scale=0.01, size=num_rows))
+    return cleaned_df
+
+
+def _rolling_reference(data: pd.DataFrame, window_size: int) -> pd.DataFrame:
+    """Previous implementation, rolling mean over all rows before downsampling."""
+    data = data.sort_values(by='timestamp')
+    smoothed_data = data[TimeAverageBolt.COLUMNS_TO_SMOOTH].rolling(window=window_size).mean()
+    downsampled_data = smoothed_data.iloc[::window_size].reset_index()
+    other_downsample_data = data[TimeAverageBolt.COLUMNS_TO_DOWN_SAMPLE].iloc[::window_size].reset_index()
+    downsampled_data = other_downsample_data.join(downsampled_data, how='left', rsuffix='r')
+    downsampled_data.drop(columns=['indexr'], inplace=True)
+    return downsampled_data
+
+
+def run_benchmark(num_rows: int = 300000, window_size: int = 4, repeats: int = 3) -> Dict:
+    df = make_cleaned_dataframe(num_rows)
+    time_average_bolt = TimeAverageBolt(None, False, window_size=window_size)
+
+    results = {
+        "rolling_time_averaging": time_dataframe_function(
+            lambda data: _rolling_reference(data, window_size), df, repeats),
+        "block_time_averaging": time_dataframe_function(
+            time_average_bolt._smooth_and_downsample_location, df, repeats),
+    }
+
+    # Block means sum in a different order than the rolling sums, compare to rounding
+    pd.testing.assert_frame_equal(
+        results["rolling_time_averaging"]["output"], results["block_time_averaging"]["output"], rtol=1e-12)
+
+    print_comparison(results, num_rows, repeats, "rolling_time_averaging", "block_time_averaging")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='Time Averaging Benchmark',
+                    description='Compares the block mean time averaging against the previous rolling mean implementation.')
+    parser.add_argument('--num_rows', type=int, default=300000)
+    parser.add_argument('--window_size', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    run_benchmark(num_rows=args.num_rows, window_size=args.window_size, repeats=args.repeats)
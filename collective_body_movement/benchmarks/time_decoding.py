@@ -0,0 +1,84 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import argparse
+import datetime
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from collective_body_movement.benchmarks.utils import print_comparison, time_dataframe_function
+from collective_body_movement.preprocessing.parsers import decode_time_strings
+
+PATH_DATETIME = datetime.datetime(2023, 6, 26, 14, 0, 0)
+
+
+def make_time_dataframe(num_rows: int, frame_interval_ms: int = 33) -> pd.DataFrame:
+    """Build a dataframe of raw "%H:%M::%S:%f" time strings matching the raw data format."""
+    milliseconds = 14 * 3600000 + np.arange(num_rows, dtype=np.int64) * frame_interval_ms
+    hours = milliseconds // 3600000
+    minutes = milliseconds // 60000 % 60
+    seconds = milliseconds // 1000 % 60
+    fractions = milliseconds % 1000
+    time_text = [f"{h:02d}:{m:02d}::{s:02d}:{f:03d}" for h, m, s, f in zip(hours, minutes, seconds, fractions)]
+    return pd.DataFrame({"time": pd.Series(time_text, dtype=object)})
+
+
+def _to_datetime_reference(df: pd.DataFrame) -> pd.DataFrame:
+    # Previous DataCleanerBolt._clean_dataframe implementation
+    time_df = pd.DataFrame()
+    time_df['time'] = pd.to_datetime(df['time'], format="%H:%M::%S:%f")
+
+    time_df['year'] = PATH_DATETIME.year
+    time_df['month'] = PATH_DATETIME.month
+    time_df['day'] = PATH_DATETIME.day
+    time_df['hour'] = time_df['time'].dt.hour
+    time_df['minute'] = time_df['time'].dt.minute
+    time_df['second'] = time_df['time'].dt.second
+    time_df['microsecond'] = time_df['time'].dt.microsecond
+    time_df = time_df.drop(['time'], axis=1)
+    time_df = pd.to_datetime(time_df)
+
+    df['time'] = pd.to_datetime(time_df)
+    df['timestamp'] = df['time'].values.astype(np.int64) // 10 ** 6
+    start_time = df['timestamp'].min()
+    df['elapsed_time'] = df['time'].values.astype(np.int64) // 10 ** 6 - start_time
+    return df
+
+
+def _decode_time_strings(df: pd.DataFrame) -> pd.DataFrame:
+    epoch_microseconds = decode_time_strings(df['time'], PATH_DATETIME)
+    df['time'] = (epoch_microseconds * 1000).view('datetime64[ns]')
+    df['timestamp'] = epoch_microseconds // 10 ** 3
+    start_time = df['timestamp'].min()
+    df['elapsed_time'] = df['timestamp'] - start_time
+    return df
+
+
+def run_benchmark(num_rows: int = 300000, repeats: int = 3) -> Dict:
+    df = make_time_dataframe(num_rows)
+
+    results = {
+        "to_datetime": time_dataframe_function(_to_datetime_reference, df, repeats),
+        "decode_time_strings": time_dataframe_function(_decode_time_strings, df, repeats),
+    }
+
+    # Both implementations must produce the same time columns
+    pd.testing.assert_frame_equal(results["to_datetime"]["output"], results["decode_time_strings"]["output"])
+
+    print_comparison(results, num_rows, repeats, "to_datetime", "decode_time_strings")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='Time Decoding Benchmark',
+                    description='Compares the time string decoder against the pandas to_datetime implementation.')
+    parser.add_argument('--num_rows', type=int, default=300000)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    run_benchmark(num_rows=args.num_rows, repeats=args.repeats)
@@ -0,0 +1,94 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import argparse
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from collective_body_movement.preprocessing.cleaner import DataCleanerBolt
+from collective_body_movement.preprocessing.parsers import parse_tuple_columns
+from collective_body_movement.benchmarks.utils import print_comparison, time_dataframe_function
+
+
+def make_tuple_dataframe(num_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build a dataframe of raw "(x, y, z)" / "(i, j, k, l)" text columns matching the raw data format."""
+    rng = np.random.default_rng(seed)
+    tuple_df = pd.DataFrame()
+    for column, dimensions in DataCleanerBolt.TUPLE_COLUMN_DIMENSIONS.items():
+        values = rng.normal(size=(num_rows, len(dimensions))).round(6).astype(str)
+        tuple_text = values[:, 0]
+        for i in range(1, len(dimensions)):
+            tuple_text = np.char.add(np.char.add(tuple_text, ", "), values[:, i])
+        tuple_df[column] = np.char.add(np.char.add("(", tuple_text), ")").astype(object)
+    return tuple_df
+
+
+def strip_split_columns(df: pd.DataFrame, column_list, dimensions, remove_vals=["(",")"," "]) -> pd.DataFrame:
+    """Reference implementation of parse_tuple_columns, the per column strip, split and cast of the cleaner."""
+    for column in column_list:
+        expanded_columns = [column  + "_" + d for d in dimensions]
+        for val in remove_vals:
+            df[column] = df[column].str.replace(val,'')
+        
+        df[expanded_columns] = df[column].str.split(',',expand=True).astype(float)
+        df = df.drop([column], axis=1)
+
+    return df
+
+
+def _strip_split_reference(df: pd.DataFrame) -> pd.DataFrame:
+    df = strip_split_columns(df, 
+                             column_list=['head_pos','left_pos','right_pos','bigball_pos'],
+                             dimensions =['x','y','z'])
+    df = strip_split_columns(df, 
+                             column_list=['head_rot','left_rot','right_rot'],
+                             dimensions =['i','j','k','l'])
+    return df
+
+
+def _parse_tuple_block(df: pd.DataFrame) -> pd.DataFrame:
+    return parse_tuple_columns(df, DataCleanerBolt.TUPLE_COLUMN_DIMENSIONS)
+
+
+def check_malformed_values(num_rows: int = 10):
+    """Blank and non-numeric tuple values must raise a ValueError, as with the strip and split implementation."""
+    for malformed_value in ["(1.0, , 3.0)", "(1.0, abc, 3.0)"]:
+        df = make_tuple_dataframe(num_rows)
+        df.loc[num_rows // 2, "head_pos"] = malformed_value
+        try:
+            _parse_tuple_block(df)
+        except ValueError:
+            continue
+        raise AssertionError(f"Tuple value {malformed_value} was parsed without an error")
+
+
+def run_benchmark(num_rows: int = 300000, repeats: int = 3) -> Dict:
+    check_malformed_values()
+    df = make_tuple_dataframe(num_rows)
+
+    results = {
+        "strip_split_columns": time_dataframe_function(_strip_split_reference, df, repeats),
+        "parse_tuple_columns": time_dataframe_function(_parse_tuple_block, df, repeats),
+    }
+
+    # Both implementations must produce the same columns and values
+    pd.testing.assert_frame_equal(
+        results["strip_split_columns"]["output"], results["parse_tuple_columns"]["output"])
+
+    print_comparison(results, num_rows, repeats, "strip_split_columns", "parse_tuple_columns")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='Tuple Column Parsing Benchmark',
+                    description='Compares the tuple column parser against the strip and split implementation.')
+    parser.add_argument('--num_rows', type=int, default=300000)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    run_benchmark(num_rows=args.num_rows, repeats=args.repeats)
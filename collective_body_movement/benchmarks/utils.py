@@ -0,0 +1,52 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+import pandas as pd
+
+
+def time_dataframe_function(function: Callable, df: pd.DataFrame, repeats: int) -> Dict:
+    """Time a function on copies of the input dataframe and measure its peak allocation."""
+    timings = []
+    for _ in range(repeats):
+        input_df = df.copy()
+        start_time = time.perf_counter()
+        function(input_df)
+        timings.append(time.perf_counter() - start_time)
+
+    # Measure allocations separately, tracemalloc slows down execution
+    input_df = df.copy()
+    tracemalloc.start()
+    output = function(input_df)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"best_time": min(timings), "peak_bytes": peak_bytes, "output": output}
+
+
+def time_file_function(function: Callable, path, repeats: int) -> Dict:
+    """Time a function reading a file and measure its peak allocation."""
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function(path)
+        timings.append(time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    output = function(path)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"best_time": min(timings), "peak_bytes": peak_bytes, "output": output}
+
+
+def print_comparison(results: Dict, num_rows: int, repeats: int, reference: str, candidate: str):
+    for name, result in results.items():
+        print(f"{name}: {num_rows} rows, best of {repeats}: {result['best_time']:.3f} s, "
+              f"peak allocation: {result['peak_bytes'] / 1e6:.1f} MB")
+    speedup = results[reference]["best_time"] / results[candidate]["best_time"]
+    print(f"Speedup: {speedup:.1f}x")
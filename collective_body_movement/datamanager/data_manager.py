@@ -2,6 +2,8 @@ import json
 import pandas as pd
 import pathlib
 
+from ..storage import read_dataframe, resolve_dataframe_path
+
 
 class CollectiveBodyDataManager:
 
@@ -14,8 +16,9 @@ class CollectiveBodyDataManager:
             metrics_directory = database_directory
         self.database_directory = pathlib.Path(database_directory)
         self.metrics_directory = pathlib.Path(metrics_directory)
-        self.raw_movement_database_path = self.database_directory / "raw_movement_database.csv"
-        self.movement_metrics_path= self.metrics_directory / "algorithm_movement_metrics.csv"
+        # Datasets may be stored as csv or in a columnar format, see storage.py
+        self.raw_movement_database_path = resolve_dataframe_path(self.database_directory / "raw_movement_database.csv")
+        self.movement_metrics_path= resolve_dataframe_path(self.metrics_directory / "algorithm_movement_metrics.csv")
         self.alogirthm_metric_summary_path = self.metrics_directory / "algorithm_metric_summary_statistics.json"
 
         # Load datasets and metrics
@@ -76,13 +79,13 @@ class CollectiveBodyDataManager:
 
     def _load_database(self):
         self._log_output(f"Loading database at path {self.raw_movement_database_path}")
-        raw_movement_df = pd.read_csv(self.raw_movement_database_path)
+        raw_movement_df = read_dataframe(self.raw_movement_database_path)
         self._log_output(f"Database load completed with {len(raw_movement_df)} entries")
         return raw_movement_df
 
     def _load_algorithm_metrics(self):
         self._log_output(f"Loading metrics at path {self.movement_metrics_path}")
-        alogirthm_metrics_df = pd.read_csv(self.movement_metrics_path)
+        alogirthm_metrics_df = read_dataframe(self.movement_metrics_path)
         self._log_output(f"Database load completed with {len(alogirthm_metrics_df)} entries")
         return alogirthm_metrics_df
 
@@ -8,13 +8,26 @@ from typing import Dict, List
 
 import pandas as pd
 
-from ..utils import CollectiveBodyLogger, CollectiveBodyBolt
+from ..storage import IntermediateStorage
+from .file_index import RawFileIndex
+from ..utils import CollectiveBodyLogger, CollectiveBodyBolt, AGGREGATE_KEYS
 
 class DirectoryParserBolt(CollectiveBodyBolt):
     # TODO - reimplement as subclassof collective body bolt
 
-    def __init__(self, output_directory_path: str, save_intermediate_output: bool) -> None:
-        super().__init__(output_directory_path, save_intermediate_output)
+    stage_inputs = {AGGREGATE_KEYS: ["input_metadata"]}
+    stage_outputs = {AGGREGATE_KEYS: ["input_metadata", "incremental_metadata"]}
+
+    def __init__(
+            self, 
+            output_directory_path: str, 
+            save_intermediate_output: bool, 
+            storage: IntermediateStorage=None,
+            file_index: RawFileIndex=None) -> None:
+        super().__init__(output_directory_path, save_intermediate_output, storage)
+
+        # Index of previously ingested files, only used for incremental ingest
+        self.file_index = file_index
 
         self.logger = CollectiveBodyLogger(class_name=__class__.__name__)
         self.logger.log("Initialized.")
@@ -42,6 +55,11 @@ class DirectoryParserBolt(CollectiveBodyBolt):
         if  quick_debug_mode and file_ingest_limit is not None:
             discovered_paths = discovered_paths[0:file_ingest_limit]
         
+        # Only pass new or changed files downstream for incremental ingest
+        if self.file_index is not None:
+            output_metadata = self._filter_changed_file_paths(output_metadata, discovered_paths)
+            discovered_paths = output_metadata['input_metadata']['discovered_filepaths']
+
         # Store discovered filepaths
         output_metadata['input_metadata']['discovered_filepaths'] = discovered_paths
 
@@ -52,6 +70,37 @@ class DirectoryParserBolt(CollectiveBodyBolt):
         
         return self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list
 
+    def _filter_changed_file_paths(self, output_metadata: Dict, discovered_paths: List[str]) -> Dict:
+        scan_result = self.file_index.scan(discovered_paths)
+
+        output_metadata['input_metadata']['discovered_filepaths'] = scan_result['changed_filepaths']
+        output_metadata['input_metadata']['discovered_dataset_ids'] = scan_result['changed_dataset_ids']
+
+        # Datasets ingested in earlier runs, merged back in after metrics calculation
+        output_metadata['incremental_metadata'] = {
+            'prior_datasets': [
+                {
+                    'dataset_id': dataset_id,
+                    'data_path': path,
+                    'data_start_abstime': self.file_index.get_entry(path)['data_start_abstime'],
+                }
+                for path, dataset_id in zip(scan_result['unchanged_filepaths'], scan_result['unchanged_dataset_ids'])
+            ],
+            'removed_dataset_ids': scan_result['removed_dataset_ids'],
+        }
+
+        return output_metadata
+
+    def get_checkpoint_inputs(self, aggregate_metadata: Dict) -> Dict:
+        # Raw files are the external input of the pipeline, track their size and modification time
+        discovered_paths = self._find_file_paths(aggregate_metadata['input_metadata']['directory_root_path'])
+        discovered_file_stats = {}
+        for path in discovered_paths:
+            file_stat = os.stat(path)
+            discovered_file_stats[path] = [file_stat.st_size, file_stat.st_mtime_ns]
+
+        return {"discovered_files": discovered_file_stats}
+
     def _find_file_paths(self, directory_root_path: str) -> Dict:
         self.logger.log("Discovering file paths in root directory.")
 
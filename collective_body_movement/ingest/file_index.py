@@ -0,0 +1,119 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import hashlib
+import json
+import os
+import pathlib
+from typing import Dict, List
+
+from ..utils import CollectiveBodyLogger
+
+class RawFileIndex:
+    """Persistent index of ingested raw data files and their stable dataset IDs, used for incremental ingest."""
+
+    def __init__(self, index_path: str) -> None:
+        self.index_path = pathlib.Path(index_path)
+        self.logger = CollectiveBodyLogger(__class__.__name__)
+
+        self.file_entries: Dict[str, Dict] = {}
+        self.next_dataset_id = 0
+        if self.index_path.exists():
+            with open(self.index_path) as json_file:
+                saved_index = json.load(json_file)
+            self.file_entries = saved_index["file_entries"]
+            self.next_dataset_id = saved_index["next_dataset_id"]
+
+        # Entries from the latest scan, applied to the index on commit
+        self._scanned_entries: Dict[str, Dict] = {}
+
+    def scan(self, paths: List[str]) -> Dict:
+        """
+        Compare discovered file paths with the index.
+
+        Returns:
+        - Dictionary with the changed (new or modified) paths and their dataset IDs, the unchanged
+        dataset IDs and the dataset IDs of indexed files that no longer exist.
+        """
+        self._scanned_entries = {}
+        next_dataset_id = self.next_dataset_id
+        scan_result = {
+            "changed_filepaths": [],
+            "changed_dataset_ids": [],
+            "unchanged_filepaths": [],
+            "unchanged_dataset_ids": [],
+            "removed_dataset_ids": [],
+        }
+
+        for path in paths:
+            file_stat = os.stat(path)
+            indexed_entry = self.file_entries.get(path)
+            scanned_entry = {
+                "size": file_stat.st_size,
+                "mtime_ns": file_stat.st_mtime_ns,
+            }
+
+            # Only hash files whose size or modification time changed
+            if indexed_entry is not None and indexed_entry["size"] == scanned_entry["size"] \
+                    and indexed_entry["mtime_ns"] == scanned_entry["mtime_ns"]:
+                scanned_entry["content_hash"] = indexed_entry["content_hash"]
+            else:
+                scanned_entry["content_hash"] = self._hash_file(path)
+
+            if indexed_entry is not None:
+                scanned_entry["dataset_id"] = indexed_entry["dataset_id"]
+                scanned_entry["data_start_abstime"] = indexed_entry.get("data_start_abstime")
+            else:
+                scanned_entry["dataset_id"] = next_dataset_id
+                scanned_entry["data_start_abstime"] = None
+                next_dataset_id += 1
+
+            if indexed_entry is not None and indexed_entry["content_hash"] == scanned_entry["content_hash"]:
+                scan_result["unchanged_filepaths"].append(path)
+                scan_result["unchanged_dataset_ids"].append(scanned_entry["dataset_id"])
+            else:
+                scan_result["changed_filepaths"].append(path)
+                scan_result["changed_dataset_ids"].append(scanned_entry["dataset_id"])
+
+            self._scanned_entries[path] = scanned_entry
+
+        scan_result["removed_dataset_ids"] = [
+            entry["dataset_id"] for path, entry in self.file_entries.items() if path not in self._scanned_entries
+        ]
+
+        self.logger.log(f"Found {len(scan_result['changed_filepaths'])} new or changed files, "
+                        f"{len(scan_result['unchanged_filepaths'])} unchanged files and "
+                        f"{len(scan_result['removed_dataset_ids'])} removed files")
+        return scan_result
+
+    def get_entry(self, path: str) -> Dict:
+        """Return the latest scanned entry for a path, or the indexed entry if it was not scanned."""
+        if path in self._scanned_entries:
+            return self._scanned_entries[path]
+        return self.file_entries[path]
+
+    def commit(self, data_start_abstimes: Dict[int, float]):
+        """Replace the index with the latest scan and save it, recording data start times of ingested files."""
+        for entry in self._scanned_entries.values():
+            # Start time is missing for datasets rejected before their time values were parsed
+            data_start_abstime = data_start_abstimes.get(entry["dataset_id"], entry["data_start_abstime"])
+            entry["data_start_abstime"] = int(data_start_abstime) if data_start_abstime is not None else None
+            self.next_dataset_id = max(self.next_dataset_id, entry["dataset_id"] + 1)
+        self.file_entries = self._scanned_entries
+        self._scanned_entries = {}
+
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.index_path, "w") as outfile:
+            json_object = json.dumps({
+                "file_entries": self.file_entries,
+                "next_dataset_id": self.next_dataset_id,
+            }, indent = 6, sort_keys=True, default=str)
+            outfile.write(json_object)
+
+    def _hash_file(self, path: str, chunk_size: int = 1 << 20) -> str:
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as infile:
+            for chunk in iter(lambda: infile.read(chunk_size), b""):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
@@ -0,0 +1,46 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import threading
+from typing import Callable, List
+
+class AsyncOutputWriter:
+    """Background writer of bolt outputs, so the next pipeline stage computes while the previous outputs are written."""
+
+    def __init__(self, num_threads: int = 2, max_pending_writes: int = 16) -> None:
+        if num_threads < 1 or max_pending_writes < 1:
+            raise ValueError("The output writer needs at least one thread and one pending write")
+        self.executor = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="output_writer")
+        # Bounds the memory held by queued output snapshots
+        self.pending_write_slots = threading.BoundedSemaphore(max_pending_writes)
+        self.pending_writes: List[Future] = []
+        self.pending_writes_lock = threading.Lock()
+        self.write_errors: List[str] = []
+        self.write_errors_lock = threading.Lock()
+
+    def submit(self, description: str, write_function: Callable, *args):
+        """Queue a write, waiting while the queue is full."""
+        self.pending_write_slots.acquire()
+        with self.pending_writes_lock:
+            self.pending_writes = [future for future in self.pending_writes if not future.done()]
+            self.pending_writes.append(self.executor.submit(self._run_write, description, write_function, *args))
+
+    def flush(self) -> List[str]:
+        """Wait for all queued writes and return the errors of failed writes since the last flush."""
+        with self.pending_writes_lock:
+            pending_writes, self.pending_writes = self.pending_writes, []
+        wait(pending_writes)
+        with self.write_errors_lock:
+            write_errors, self.write_errors = self.write_errors, []
+        return write_errors
+
+    def _run_write(self, description: str, write_function: Callable, *args):
+        try:
+            write_function(*args)
+        except Exception as error:
+            with self.write_errors_lock:
+                self.write_errors.append(f"{description}: {error!r}")
+        finally:
+            self.pending_write_slots.release()
@@ -0,0 +1,163 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import ast
+import hashlib
+import importlib.util
+import inspect
+import json
+import pathlib
+import pickle
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from collective_body_movement.utils import CollectiveBodyBolt, CollectiveBodyLogger
+
+class StageCheckpointManager:
+    """Saves the output of every pipeline stage with a manifest of its inputs, to resume after the last unchanged stage."""
+
+    MANIFEST_VERSION = 2
+    PACKAGE_NAME = "collective_body_movement"
+
+    def __init__(self, checkpoint_directory: str) -> None:
+        self.checkpoint_directory = pathlib.Path(checkpoint_directory)
+        self.checkpoint_directory.mkdir(parents=True, exist_ok=True)
+
+        self.logger = CollectiveBodyLogger(__class__.__name__)
+
+    def build_stage_manifests(self, pipeline: List[CollectiveBodyBolt], initial_aggregate_metadata: Dict) -> List[Dict]:
+        """Build the input manifest of every stage from the pipeline definition and its initial input."""
+        upstream_key = self._hash_object(initial_aggregate_metadata["input_metadata"])
+
+        stage_manifests = []
+        for stage_index, pipeline_stage in enumerate(pipeline):
+            stage_manifest = {
+                "manifest_version": self.MANIFEST_VERSION,
+                "stage_index": stage_index,
+                "stage_name": pipeline_stage.__class__.__name__,
+                "upstream_key": upstream_key,
+                "config": pipeline_stage.get_config(),
+                "source_hash": self._hash_source(pipeline_stage),
+                "inputs": pipeline_stage.get_checkpoint_inputs(initial_aggregate_metadata),
+            }
+            stage_manifest["stage_key"] = self._hash_object(stage_manifest)
+            stage_manifests.append(stage_manifest)
+            upstream_key = stage_manifest["stage_key"]
+
+        return stage_manifests
+
+    def find_resume_index(self, stage_manifests: List[Dict]) -> int:
+        """Return the index of the last stage with a valid checkpoint, or -1 if no stage can be reused."""
+        resume_index = -1
+        for stage_manifest in stage_manifests:
+            if not self._is_valid_checkpoint(stage_manifest):
+                break
+            resume_index = stage_manifest["stage_index"]
+        return resume_index
+
+    def save_checkpoint(
+            self,
+            stage_manifest: Dict,
+            output_df_list: List[pd.DataFrame],
+            output_aggregate_metadata: Dict,
+            output_metadata_list: List[Dict]):
+        checkpoint_path = self._get_checkpoint_path(stage_manifest)
+        checkpoint_path.mkdir(parents=True, exist_ok=True)
+
+        # Save stage state, pickled to keep metadata types (datetimes, paths, integer keys) intact
+        state_path = checkpoint_path / "state.pkl"
+        with open(state_path, "wb") as outfile:
+            pickle.dump(
+                (output_df_list, output_aggregate_metadata, output_metadata_list),
+                outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Save manifest last, a checkpoint is only valid once its manifest is written
+        output_manifest = dict(stage_manifest)
+        output_manifest["outputs"] = {
+            "state_file": state_path.name,
+            "state_bytes": state_path.stat().st_size,
+            "state_hash": self._hash_file(state_path),
+            "num_datasets": len(output_df_list),
+            "dataset_ids": [list(metadata.keys())[0] for metadata in output_metadata_list],
+            "aggregate_metadata_keys": sorted(output_aggregate_metadata.keys()),
+            "created_time": time.time(),
+        }
+        with open(checkpoint_path / "manifest.json", "w") as outfile:
+            json_object = json.dumps(output_manifest, indent = 6, sort_keys=True, default=str)
+            outfile.write(json_object)
+
+        self.logger.log(f"Saved checkpoint for stage {stage_manifest['stage_index']} {stage_manifest['stage_name']}")
+
+    def load_checkpoint(self, stage_manifest: Dict) -> Tuple[List[pd.DataFrame], Dict, List[Dict]]:
+        self.logger.log(f"Loading checkpoint for stage {stage_manifest['stage_index']} {stage_manifest['stage_name']}")
+        with open(self._get_checkpoint_path(stage_manifest) / "state.pkl", "rb") as infile:
+            output_df_list, output_aggregate_metadata, output_metadata_list = pickle.load(infile)
+        return output_df_list, output_aggregate_metadata, output_metadata_list
+
+    def _is_valid_checkpoint(self, stage_manifest: Dict) -> bool:
+        checkpoint_path = self._get_checkpoint_path(stage_manifest)
+        manifest_path = checkpoint_path / "manifest.json"
+        if not manifest_path.exists():
+            return False
+
+        with open(manifest_path) as json_file:
+            saved_manifest = json.load(json_file)
+
+        # Stage inputs must be unchanged and the saved state complete
+        if saved_manifest.get("stage_key") != stage_manifest["stage_key"]:
+            return False
+        state_path = checkpoint_path / saved_manifest["outputs"]["state_file"]
+        return state_path.exists() and state_path.stat().st_size == saved_manifest["outputs"]["state_bytes"] \
+            and self._hash_file(state_path) == saved_manifest["outputs"]["state_hash"]
+
+    def _get_checkpoint_path(self, stage_manifest: Dict) -> pathlib.Path:
+        return self.checkpoint_directory / f"{stage_manifest['stage_index']}_{stage_manifest['stage_name']}"
+
+    def _hash_source(self, pipeline_stage: CollectiveBodyBolt) -> str:
+        # Code changes to a bolt or a package module it uses, e.g. a tweaked metric or parser,
+        # invalidate its checkpoint
+        source_hash = hashlib.sha256()
+        for module_name in sorted(self._get_package_modules(pipeline_stage.__class__.__module__)):
+            source_hash.update(module_name.encode())
+            source_hash.update(pathlib.Path(inspect.getfile(sys.modules[module_name])).read_bytes())
+        return source_hash.hexdigest()
+
+    def _get_package_modules(self, module_name: str) -> set:
+        # Package modules imported by the module, directly or through other package modules
+        package_modules = set()
+        modules_to_visit = [module_name]
+        while len(modules_to_visit) > 0:
+            module_name = modules_to_visit.pop()
+            if module_name in package_modules:
+                continue
+            package_modules.add(module_name)
+            module = sys.modules[module_name]
+            module_package = module.__package__ or module_name.rpartition(".")[0]
+            for node in ast.walk(ast.parse(pathlib.Path(inspect.getfile(module)).read_text())):
+                if isinstance(node, ast.Import):
+                    imported_names = [alias.name for alias in node.names]
+                elif isinstance(node, ast.ImportFrom):
+                    imported_module = importlib.util.resolve_name("." * node.level + (node.module or ""), module_package)
+                    imported_names = [imported_module] + [f"{imported_module}.{alias.name}" for alias in node.names]
+                else:
+                    continue
+                modules_to_visit += [
+                    imported_name for imported_name in imported_names
+                    if imported_name.split(".")[0] == self.PACKAGE_NAME and imported_name in sys.modules
+                ]
+        return package_modules
+
+    def _hash_file(self, file_path: pathlib.Path) -> str:
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as infile:
+            for block in iter(lambda: infile.read(2**20), b""):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def _hash_object(self, object_to_hash) -> str:
+        json_object = json.dumps(object_to_hash, sort_keys=True, default=str)
+        return hashlib.sha256(json_object.encode()).hexdigest()
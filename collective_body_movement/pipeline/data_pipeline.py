@@ -3,13 +3,16 @@
 # Author: Justin Martin (jcm-art)
 
 import argparse
+import json
 import pathlib
+import shutil
 from typing import Dict, List
 
 import pandas as pd
 
 from collective_body_movement.ingest.directory_ingest import DirectoryParserBolt
 from collective_body_movement.preprocessing.cleaner import DataCleanerBolt
+from collective_body_movement.preprocessing.dtype_policy import DTYPE_POLICIES, get_dtype_policy
 from collective_body_movement.preprocessing.timeaverager import TimeAverageBolt
 from collective_body_movement.analysis.fundamental_kinematics import FundamentalKinematicsBolt
 from collective_body_movement.analysis.derived_kinematics import DerivedKinematicsBolt
@@ -17,30 +20,94 @@ from collective_body_movement.analysis.metrics import MetricsBolt
 from collective_body_movement.postprocessing.aggregation import AggregatorBolt
 from collective_body_movement.postprocessing.normalization import NormalizerBolt
 from collective_body_movement.postprocessing.reports import ReportBolt
-from collective_body_movement.utils import CollectiveBodyBolt
+from collective_body_movement.postprocessing.dataset_store import DatasetStoreBolt
+from collective_body_movement.ingest.file_index import RawFileIndex
+from collective_body_movement.pipeline.checkpoint import StageCheckpointManager
+from collective_body_movement.pipeline.scheduler import StageScheduler
+from collective_body_movement.output_writer import AsyncOutputWriter
+from collective_body_movement.profiling import StageProfiler
+from collective_body_movement.storage import get_intermediate_storage, StageSavePolicy, STORAGE_FORMATS
+from collective_body_movement.utils import CollectiveBodyBolt, COLUMNS
 
 class CollectiveBodyDataPipeline:
 
-    def __init__(self, output_directory: str) -> None:
+    def __init__(
+            self, 
+            output_directory: str, 
+            num_workers: int = None, 
+            storage_format: str = "csv", 
+            storage_compression: str = None,
+            use_checkpoints: bool = False,
+            incremental: bool = False,
+            batch_size: int = None,
+            normalization_method: str = "min_max",
+            normalization_mode: str = "fit",
+            filter_type: str = "time_averaging",
+            resample_period: int = 50,
+            gap_handling: str = "interpolate",
+            dtype_policy: str = "compact",
+            raw_reader: str = "mmap",
+            async_writes: bool = True,
+            num_writer_threads: int = 2,
+            save_stages: List[str] = None,
+            save_policies: Dict[str, Dict] = None,
+            memory_probe: str = "rss",
+            target_stages: List[str] = None,
+            max_concurrent_stages: int = 2,
+            basic_data_columns: List[str] = None) -> None:
 
         # Set paths
         self.final_output_directory = pathlib.Path(output_directory)
 
-        # TODO - make saving intermediate steps optional
+        # Run per-dataset stages on batches of files to bound memory use by batch size
+        self.batch_size = batch_size
+        if batch_size is not None and (use_checkpoints or incremental):
+            raise ValueError("Batched execution does not support checkpoints or incremental ingest")
+
+        # Set storage format for intermediate bolt outputs
+        self.storage = get_intermediate_storage(storage_format, storage_compression)
+
+        # Save the outputs of all stages, or of the selected stages by bolt name. Save policies by
+        # bolt name set whether, in which format and which columns a stage saves
+        self.save_stages = save_stages
+        self.save_policies = {
+            stage_name: StageSavePolicy.from_config(policy_config)
+            for stage_name, policy_config in (save_policies if save_policies is not None else {}).items()
+        }
         self._initialize_filesystem()
 
-        # Initialize Preprocessing Flow 
-        # TODO - add configuration, manage with pipeline instead of manual stages
-        self.directory_parser = DirectoryParserBolt(self.input_file_info, save_intermediate_output=True)
-        self.data_cleaner = DataCleanerBolt(self.cleaned_data_path, save_intermediate_output=True)
-        self.data_filter = TimeAverageBolt(self.filtered_data_path, save_intermediate_output=True, window_size=4)
+        # Write stage outputs in the background while the next stage computes
+        self.output_writer = AsyncOutputWriter(num_threads=num_writer_threads) if async_writes else None
+
+        # Time and memory of every stage and dataset, saved as the run report
+        self.profiler = StageProfiler(memory_probe)
+
+        # Index of ingested raw files, only new or changed files are processed in incremental mode
+        self.incremental = incremental
+        self.file_index = RawFileIndex(self.file_index_path) if incremental else None
+
+        # Initialize Preprocessing Flow, stages are listed in pipeline order and scheduled by the data they use
+        self.directory_parser = DirectoryParserBolt(
+            self.input_file_info, file_index=self.file_index, **self._get_stage_save_arguments(DirectoryParserBolt))
+        self.data_cleaner = DataCleanerBolt(
+            self.cleaned_data_path, num_workers=num_workers, dtype_policy=get_dtype_policy(dtype_policy), 
+            raw_reader=raw_reader, **self._get_stage_save_arguments(DataCleanerBolt))
+        self.data_filter = TimeAverageBolt(
+            self.filtered_data_path, window_size=4, filter_type=filter_type, resample_period=resample_period, 
+            gap_handling=gap_handling, **self._get_stage_save_arguments(TimeAverageBolt))
         self.fundamental_kinematics_generator = FundamentalKinematicsBolt(
-            self.temporary_fundamental_kinematics_path, use_clipping=True, save_intermediate_output=True)
-        self.derived_kinematics_generator = DerivedKinematicsBolt(self.temporary_derived_kinematics_path, save_intermediate_output=True)
-        self.metrics_generator = MetricsBolt(self.algorithm_metrics_path, save_intermediate_output=True)
-        self.aggregator_bolt = AggregatorBolt(self.aggregated_output_path, save_intermediate_output=True)
-        self.normalized_bolt = NormalizerBolt(self.normalized_output_path, save_intermediate_output=True)
-        self.report_bolt = ReportBolt(self.report_path, save_intermediate_output=True)
+            self.temporary_fundamental_kinematics_path, use_clipping=True, 
+            **self._get_stage_save_arguments(FundamentalKinematicsBolt))
+        self.derived_kinematics_generator = DerivedKinematicsBolt(
+            self.temporary_derived_kinematics_path, **self._get_stage_save_arguments(DerivedKinematicsBolt))
+        self.metrics_generator = MetricsBolt(
+            self.algorithm_metrics_path, basic_data_columns=basic_data_columns, **self._get_stage_save_arguments(MetricsBolt))
+        self.aggregator_bolt = AggregatorBolt(
+            self.aggregated_output_path, **self._get_stage_save_arguments(AggregatorBolt))
+        self.normalized_bolt = NormalizerBolt(
+            self.normalized_output_path, normalization_method=normalization_method, normalization_mode=normalization_mode, 
+            model_directory_path=self.normalization_model_path, **self._get_stage_save_arguments(NormalizerBolt))
+        self.report_bolt = ReportBolt(self.report_path, **self._get_stage_save_arguments(ReportBolt))
         
         self._pipeline: List[CollectiveBodyBolt] = [
             self.directory_parser, self.data_cleaner, self.data_filter,
@@ -48,10 +115,48 @@ class CollectiveBodyDataPipeline:
             self.metrics_generator, self.aggregator_bolt, self.normalized_bolt, self.report_bolt
         ]
 
+        # Merge new per-dataset results with stored results before aggregation
+        if incremental:
+            self.dataset_store_bolt = DatasetStoreBolt(self.dataset_store_path, self.file_index)
+            self._pipeline.insert(self._pipeline.index(self.aggregator_bolt), self.dataset_store_bolt)
+
+        # Saved stages must be stages of this pipeline, all stages share the background writer
+        stage_names = [pipeline_stage.__class__.__name__ for pipeline_stage in self._pipeline]
+        unknown_stages = [
+            stage_name for stage_name in list(save_stages or []) + list(self.save_policies.keys())
+            if stage_name not in stage_names
+        ]
+        if len(unknown_stages) > 0:
+            raise ValueError(f"Save stages {unknown_stages} are not pipeline stages {stage_names}")
+        for pipeline_stage in self._pipeline:
+            pipeline_stage.output_writer = self.output_writer
+            pipeline_stage.profiler = self.profiler
+            pipeline_stage.save_policy = self._get_save_policy(type(pipeline_stage))
+
+        # Only run the target stages and the stages they depend on, independent stages run concurrently.
+        # Traced allocation peaks are reset for the whole process, so traced stages run one at a time
+        if memory_probe == "tracemalloc" and max_concurrent_stages > 1:
+            self._log_output("Running one stage at a time to trace the peak allocations of every stage")
+            max_concurrent_stages = 1
+        self.scheduler = StageScheduler(self._pipeline, max_concurrent_stages=max_concurrent_stages)
+        self._scheduled_stages = self.scheduler.get_needed_stages(target_stages)
+        skipped_stages = [
+            pipeline_stage.__class__.__name__ for pipeline_stage in self._pipeline 
+            if pipeline_stage not in self._scheduled_stages
+        ]
+        if len(skipped_stages) > 0:
+            self._log_output(f"Skipping stages {skipped_stages} not needed by target stages {target_stages}")
+        # Kinematics stages only calculate the columns read by later stages
+        self.scheduler.request_columns(self._scheduled_stages, target_stages)
+
+        # Checkpoint every stage output so reruns resume from the last unchanged stage
+        self.use_checkpoints = use_checkpoints
+        if use_checkpoints:
+            self.checkpoint_manager = StageCheckpointManager(self.checkpoint_path)
+
 
     def initialize_input(self, raw_data_path, file_ingest_limit: int = None, quick_debug: bool = False):
         # TODO - enable starting from different inputs, not just raw file system data
-        # TODO - enable batching of data
 
         # Initialize datastructures for bolt processing pipeline
         # TODO - reimplement as class or struct
@@ -68,24 +173,203 @@ class CollectiveBodyDataPipeline:
         return self.initial_df_list, self.initial_aggregate_metadata, self.initial_metadata_list
 
     def run_pipeline(self):
-        
-        # TODO - investigate updating with jump table to remove excessive logic
-        # TODO - enable skipping pipeline steps
-        # TODO - move pipeline to batch based argument with pre-step for 
-        # getting file paths and batches
+        self.profiler.start()
+        try:
+            if self.batch_size is not None:
+                pipeline_output = self._run_batched_pipeline()
+            else:
+                pipeline_output = self._run_stages()
+        finally:
+            # Wait for background writes, also when a stage failed
+            write_errors = self.output_writer.flush() if self.output_writer is not None else []
+            self._save_write_report()
+            self.profiler.stop()
+            self.profiler.save_report(self.report_path)
+
+        if len(write_errors) > 0:
+            for write_error in write_errors:
+                self._log_output(f"Failed to write {write_error}")
+            raise Exception(f"{len(write_errors)} stage outputs failed to write")
 
+        return pipeline_output
+
+    def _run_stages(self):
         output_df_list, output_aggregate_metadata, output_metadata_list = \
             self.initial_df_list, self.initial_aggregate_metadata, self.initial_metadata_list
 
-        # Data ingest and cleaning stage
-        for pipeline_stage in self._pipeline:
-            print(f"Beginning pipeline stage {pipeline_stage.__class__.__name__}")
-            output_df_list, output_aggregate_metadata, output_metadata_list = \
-                pipeline_stage.process(output_df_list, output_aggregate_metadata, output_metadata_list)
+        # Resume from the last stage whose inputs are unchanged
+        start_stage_index = 0
+        if self.use_checkpoints:
+            stage_manifests = self.checkpoint_manager.build_stage_manifests(
+                self._scheduled_stages, self.initial_aggregate_metadata)
+            resume_index = self.checkpoint_manager.find_resume_index(stage_manifests)
+            if resume_index >= 0:
+                self._log_output(f"Resuming pipeline after stage {stage_manifests[resume_index]['stage_name']}")
+                output_df_list, output_aggregate_metadata, output_metadata_list = \
+                    self.checkpoint_manager.load_checkpoint(stage_manifests[resume_index])
+                start_stage_index = resume_index + 1
+
+        # Checkpoints hold the pipeline state after every stage, checkpointed stages run one at a time
+        remaining_stages = self._scheduled_stages[start_stage_index:]
+        if self.use_checkpoints:
+            stage_waves = [[pipeline_stage] for pipeline_stage in remaining_stages]
+        else:
+            stage_waves = self.scheduler.get_stage_waves(remaining_stages)
+
+        for stage_wave in stage_waves:
+            output_df_list, output_aggregate_metadata, output_metadata_list = self.scheduler.run_wave(
+                stage_wave, self._run_stage, output_df_list, output_aggregate_metadata, output_metadata_list)
+
+            if self.use_checkpoints:
+                self.checkpoint_manager.save_checkpoint(
+                    stage_manifests[self._scheduled_stages.index(stage_wave[0])], 
+                    output_df_list, output_aggregate_metadata, output_metadata_list)
 
         # Return df and metadata
         return output_df_list, output_aggregate_metadata, output_metadata_list
 
+    def _run_stage(
+            self, 
+            pipeline_stage: CollectiveBodyBolt, 
+            input_dataframe_list: List[pd.DataFrame], 
+            aggregate_metadata: Dict, 
+            input_metadata_list: List[Dict]) -> (List[pd.DataFrame], Dict, List[Dict]):
+        print(f"Beginning pipeline stage {pipeline_stage.__class__.__name__}")
+        return self.profiler.profile_stage(
+            pipeline_stage.__class__.__name__, pipeline_stage.process, 
+            input_dataframe_list, aggregate_metadata, input_metadata_list)
+
+    def _run_batched_pipeline(self):
+        '''Run the pipeline on batches of files. Per-dataset stages process one batch at a time and
+        spill their output datasets to disk. Cross-dataset stages are then fit on the metadata of all
+        datasets and transform the spilled datasets batch by batch, stages using only metadata (e.g.
+        the report) are only fit. Datasets are saved by each stage and not returned, aggregate
+        metadata is saved once per stage after all batches.'''
+        output_df_list, output_aggregate_metadata, output_metadata_list = \
+            self.initial_df_list, self.initial_aggregate_metadata, self.initial_metadata_list
+
+        # Discover all input files
+        pipeline_stage = self._scheduled_stages[0]
+        print(f"Beginning pipeline stage {pipeline_stage.__class__.__name__}")
+        output_df_list, output_aggregate_metadata, output_metadata_list = self.profiler.profile_stage(
+            pipeline_stage.__class__.__name__, pipeline_stage.process, 
+            output_df_list, output_aggregate_metadata, output_metadata_list)
+
+        per_dataset_stages = [stage for stage in self._scheduled_stages[1:] if not stage.cross_dataset]
+        cross_dataset_stages = [stage for stage in self._scheduled_stages[1:] if stage.cross_dataset]
+        transform_stages = [
+            stage for stage in cross_dataset_stages 
+            if len(stage.get_stage_inputs().get(COLUMNS, [])) > 0 or len(stage.get_stage_outputs().get(COLUMNS, [])) > 0
+        ]
+
+        # Process per-dataset stages one batch of files at a time, each batch on a copy of the 
+        # aggregate metadata listing only its files
+        input_metadata = output_aggregate_metadata['input_metadata']
+        discovered_filepaths = input_metadata['discovered_filepaths']
+        discovered_dataset_ids = input_metadata.get('discovered_dataset_ids', list(range(len(discovered_filepaths))))
+        self.batch_spill_path.mkdir(parents=True, exist_ok=True)
+        for pipeline_stage in per_dataset_stages + cross_dataset_stages:
+            pipeline_stage.defer_aggregate_output = True
+
+        for batch_start in range(0, len(discovered_filepaths), self.batch_size):
+            batch_end = batch_start + self.batch_size
+            self._log_output(f"Processing files {batch_start} to {min(batch_end, len(discovered_filepaths))} "
+                             f"of {len(discovered_filepaths)}")
+            batch_aggregate_metadata = {
+                **output_aggregate_metadata,
+                'input_metadata': {
+                    **input_metadata,
+                    'discovered_filepaths': discovered_filepaths[batch_start:batch_end],
+                    'discovered_dataset_ids': discovered_dataset_ids[batch_start:batch_end],
+                },
+            }
+
+            batch_df_list, batch_metadata_list = [], []
+            for pipeline_stage in per_dataset_stages:
+                batch_df_list, batch_aggregate_metadata, batch_metadata_list = self.profiler.profile_stage(
+                    pipeline_stage.__class__.__name__, pipeline_stage.process, 
+                    batch_df_list, batch_aggregate_metadata, batch_metadata_list)
+
+            # Keep only the metadata in memory, and the aggregate keys added by the stages
+            for df, metadata in zip(batch_df_list, batch_metadata_list):
+                pd.to_pickle(df, self._get_batch_spill_file(list(metadata.keys())[0]))
+            output_metadata_list += batch_metadata_list
+            output_aggregate_metadata.update({
+                key: value for key, value in batch_aggregate_metadata.items() if key != 'input_metadata'
+            })
+
+        self._save_aggregate_outputs(per_dataset_stages, output_aggregate_metadata)
+
+        # Fit cross-dataset stages on the metadata of all datasets
+        for pipeline_stage in cross_dataset_stages:
+            print(f"Fitting pipeline stage {pipeline_stage.__class__.__name__}")
+            _, output_aggregate_metadata, output_metadata_list = self.profiler.profile_stage(
+                f"{pipeline_stage.__class__.__name__}.fit", 
+                lambda df_list, aggregate_metadata, metadata_list: (df_list, *pipeline_stage.fit(aggregate_metadata, metadata_list)),
+                [], output_aggregate_metadata, output_metadata_list)
+
+        # Transform and save the remaining datasets one batch at a time
+        for batch_start in range(0, len(output_metadata_list), self.batch_size):
+            batch_metadata_list = output_metadata_list[batch_start:batch_start + self.batch_size]
+            batch_df_list = [
+                pd.read_pickle(self._get_batch_spill_file(list(metadata.keys())[0])) 
+                for metadata in batch_metadata_list
+            ]
+            for pipeline_stage in transform_stages:
+                batch_df_list, output_aggregate_metadata, batch_metadata_list = self.profiler.profile_stage(
+                    f"{pipeline_stage.__class__.__name__}.transform", pipeline_stage.transform, 
+                    batch_df_list, output_aggregate_metadata, batch_metadata_list)
+
+                if pipeline_stage.save_intermediate_output:
+                    pipeline_stage.output_df_list = batch_df_list
+                    pipeline_stage.aggregate_metadata_output = output_aggregate_metadata
+                    pipeline_stage.output_metadata_list = batch_metadata_list
+                    pipeline_stage.save_output()
+
+        self._save_aggregate_outputs(cross_dataset_stages, output_aggregate_metadata)
+        shutil.rmtree(self.batch_spill_path)
+
+        # Return metadata, datasets are available from the saved stage outputs
+        return [], output_aggregate_metadata, output_metadata_list
+
+    def _save_aggregate_outputs(self, pipeline_stages: List[CollectiveBodyBolt], aggregate_metadata: Dict):
+        # Aggregate metadata of all batches, saved once per stage
+        for pipeline_stage in pipeline_stages:
+            pipeline_stage.defer_aggregate_output = False
+            if pipeline_stage.save_intermediate_output:
+                pipeline_stage.aggregate_metadata_output = aggregate_metadata
+                pipeline_stage.save_aggregate_output()
+
+    def _get_save_policy(self, bolt_class: type) -> StageSavePolicy:
+        if bolt_class.__name__ in self.save_policies:
+            return self.save_policies[bolt_class.__name__]
+        return StageSavePolicy(save=self.save_stages is None or bolt_class.__name__ in self.save_stages)
+
+    def _get_stage_save_arguments(self, bolt_class: type) -> Dict:
+        save_policy = self._get_save_policy(bolt_class)
+        return {"save_intermediate_output": save_policy.save, "storage": save_policy.get_storage(self.storage)}
+
+    def _save_write_report(self):
+        # Disk bytes and write time of every stage, once all writes are done
+        write_report = {
+            pipeline_stage.__class__.__name__: {
+                "save_policy": pipeline_stage.save_policy.get_config(),
+                "storage_format": pipeline_stage.storage.file_suffix.lstrip("."),
+                **pipeline_stage.get_write_statistics(),
+            }
+            for pipeline_stage in self._pipeline
+        }
+        for stage_name, stage_report in write_report.items():
+            if stage_report["files_written"] > 0:
+                self._log_output(f"{stage_name} wrote {stage_report['files_written']} files, "
+                                 f"{stage_report['bytes_written'] / 1e6:.1f} MB in {stage_report['write_time']:.2f} s")
+        with open(self.report_path / "write_report.json", "w") as outfile:
+            json_object = json.dumps(write_report, indent = 6, sort_keys=True, default=str)
+            outfile.write(json_object)
+
+    def _get_batch_spill_file(self, dataset_id) -> pathlib.Path:
+        return self.batch_spill_path / f"dataset_{dataset_id}.pkl"
+
     def _initialize_filesystem(self):
         # Define directory structure
         self.input_file_info = self.final_output_directory / "0_input_info/"
@@ -94,9 +378,14 @@ class CollectiveBodyDataPipeline:
         self.temporary_fundamental_kinematics_path = self.final_output_directory / "3_tmp_fundamental_kinematics_database/"
         self.temporary_derived_kinematics_path = self.final_output_directory / "4_tmp_derived_kinematics_database/"
         self.algorithm_metrics_path = self.final_output_directory / "5_algorithm_database/"
+        self.dataset_store_path = self.final_output_directory / "5_dataset_store/"
+        self.file_index_path = self.dataset_store_path / "file_index.json"
         self.aggregated_output_path = self.final_output_directory / "6_aggregated_output/"
         self.normalized_output_path = self.final_output_directory / "7_normalized_output/"
         self.report_path = self.final_output_directory / "reports/"
+        self.checkpoint_path = self.final_output_directory / "checkpoints/"
+        self.normalization_model_path = self.final_output_directory / "normalization_model/"
+        self.batch_spill_path = self.final_output_directory / "tmp_batch_spill/"
 
         # Make directories if they don't exist
         self.input_file_info.mkdir(parents=True, exist_ok=True)
@@ -121,18 +410,86 @@ if __name__=="__main__":
     # Add arguments to pipeline execution
     # TODO - redo arguments
     parser.add_argument('--skip_raw_data_ingest',action='store_true', default=False) 
+    parser.add_argument('--resume',action='store_true', default=False) 
+    parser.add_argument('--incremental',action='store_true', default=False) 
+    parser.add_argument('--batch_size', type=int, default=None) 
+    parser.add_argument('--normalization_method', type=str, default="min_max", choices=NormalizerBolt.NORMALIZATION_METHODS) 
+    parser.add_argument('--normalization_mode', type=str, default="fit", choices=NormalizerBolt.NORMALIZATION_MODES) 
+    parser.add_argument('--filter_type', type=str, default="time_averaging", choices=TimeAverageBolt.FILTER_TYPES) 
+    parser.add_argument('--resample_period', type=int, default=50) 
+    parser.add_argument('--gap_handling', type=str, default="interpolate", choices=TimeAverageBolt.GAP_HANDLING) 
+    parser.add_argument('--dtype_policy', type=str, default="compact", choices=list(DTYPE_POLICIES.keys())) 
+    parser.add_argument('--raw_reader', type=str, default="mmap", choices=DataCleanerBolt.RAW_READERS) 
     parser.add_argument('--quick_run',action='store_true', default=False) 
+    parser.add_argument('--num_workers', type=int, default=None) 
+    parser.add_argument('--storage_format', choices=list(STORAGE_FORMATS.keys()), default="csv") 
+    parser.add_argument('--storage_compression', type=str, default=None) 
+    parser.add_argument('--sync_writes',action='store_true', default=False) 
+    parser.add_argument('--num_writer_threads', type=int, default=2) 
+    parser.add_argument('--save_stages', type=str, nargs='+', default=None) 
+    parser.add_argument('--save_policies', type=str, default=None) 
+    parser.add_argument('--memory_probe', type=str, default="rss", choices=StageProfiler.MEMORY_PROBES) 
+    parser.add_argument('--target_stages', type=str, nargs='+', default=None) 
+    parser.add_argument('--max_concurrent_stages', type=int, default=2) 
+    parser.add_argument('--basic_data_columns', type=str, nargs='*', default=None) 
 
     # Get arguments from command
     # TODO - redo arguments
     aaa = parser.parse_args()
     skip_ingest_arg = aaa.skip_raw_data_ingest
+    # Skipping the raw data ingest reuses the checkpointed ingest output
+    resume = aaa.resume or skip_ingest_arg
     quick_run = aaa.quick_run
+    num_workers = aaa.num_workers
+    incremental = aaa.incremental
+    batch_size = aaa.batch_size
+    normalization_method = aaa.normalization_method
+    normalization_mode = aaa.normalization_mode
+    filter_type = aaa.filter_type
+    resample_period = aaa.resample_period
+    gap_handling = aaa.gap_handling
+    dtype_policy = aaa.dtype_policy
+    raw_reader = aaa.raw_reader
+    storage_format = aaa.storage_format
+    storage_compression = aaa.storage_compression
+    async_writes = not aaa.sync_writes
+    num_writer_threads = aaa.num_writer_threads
+    save_stages = aaa.save_stages
+    memory_probe = aaa.memory_probe
+    target_stages = aaa.target_stages
+    max_concurrent_stages = aaa.max_concurrent_stages
+    basic_data_columns = aaa.basic_data_columns
+    # Save policies are read from a json file of policies by bolt name
+    save_policies = None
+    if aaa.save_policies is not None:
+        with open(aaa.save_policies) as json_file:
+            save_policies = json.load(json_file)
 
     # Initialize the pipeline
     # TODO - create options to specify path or use default locations specified in config file
     cbdp = CollectiveBodyDataPipeline(
         output_directory="data/new_pipeline/",
+        num_workers=num_workers,
+        storage_format=storage_format,
+        storage_compression=storage_compression,
+        use_checkpoints=resume,
+        incremental=incremental,
+        batch_size=batch_size,
+        normalization_method=normalization_method,
+        normalization_mode=normalization_mode,
+        filter_type=filter_type,
+        resample_period=resample_period,
+        gap_handling=gap_handling,
+        dtype_policy=dtype_policy,
+        raw_reader=raw_reader,
+        async_writes=async_writes,
+        num_writer_threads=num_writer_threads,
+        save_stages=save_stages,
+        save_policies=save_policies,
+        memory_probe=memory_probe,
+        target_stages=target_stages,
+        max_concurrent_stages=max_concurrent_stages,
+        basic_data_columns=basic_data_columns,
     )
 
     # Run the pipeline with provided arguments
@@ -0,0 +1,178 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Set
+
+import pandas as pd
+
+from collective_body_movement.utils import CollectiveBodyBolt, AGGREGATE_KEYS, ALL_KEYS, COLUMNS, METADATA_KEYS
+
+class StageScheduler:
+    """Runs pipeline stages in waves of stages that do not depend on each other, from the data every bolt reads and adds."""
+
+    def __init__(self, pipeline: List[CollectiveBodyBolt], max_concurrent_stages: int = 2) -> None:
+        if max_concurrent_stages < 1:
+            raise ValueError("The scheduler needs to run at least one stage at a time")
+        self.pipeline = pipeline
+        self.max_concurrent_stages = max_concurrent_stages
+
+        # Dependencies of every stage, by index in the pipeline
+        self.stage_dependencies: List[Set[int]] = [
+            set(
+                upstream_index for upstream_index in range(stage_index)
+                if self._is_dependent(pipeline[upstream_index], pipeline[stage_index])
+            )
+            for stage_index in range(len(pipeline))
+        ]
+
+    def get_stage_names(self) -> List[str]:
+        return [pipeline_stage.__class__.__name__ for pipeline_stage in self.pipeline]
+
+    def get_needed_stages(self, target_stages: List[str] = None) -> List[CollectiveBodyBolt]:
+        """Return the target stages and the stages adding the data they need, in pipeline order, all stages without targets."""
+        if target_stages is None:
+            return list(self.pipeline)
+
+        stage_names = self.get_stage_names()
+        unknown_stages = [stage_name for stage_name in target_stages if stage_name not in stage_names]
+        if len(unknown_stages) > 0:
+            raise ValueError(f"Target stages {unknown_stages} are not pipeline stages {stage_names}")
+
+        needed_indexes = set()
+        stage_indexes_to_visit = [stage_names.index(stage_name) for stage_name in target_stages]
+        while len(stage_indexes_to_visit) > 0:
+            stage_index = stage_indexes_to_visit.pop()
+            if stage_index in needed_indexes:
+                continue
+            needed_indexes.add(stage_index)
+            stage_inputs = self.pipeline[stage_index].get_stage_inputs()
+            stage_indexes_to_visit += [
+                upstream_index for upstream_index in range(stage_index)
+                if self._has_shared_keys(self.pipeline[upstream_index].get_stage_outputs(), stage_inputs)
+            ]
+
+        return [self.pipeline[stage_index] for stage_index in sorted(needed_indexes)]
+
+    def request_columns(self, stages: List[CollectiveBodyBolt], target_stages: List[str] = None):
+        """
+        Request from every stage the columns read by the stages after it, and all columns from
+        target stages. Columns of a stage save policy are requested from the stage itself. Stages
+        reading every column use the columns calculated for other stages.
+        """
+        requested_columns = set()
+        for pipeline_stage in reversed(stages):
+            stage_name = pipeline_stage.__class__.__name__
+            if target_stages is not None and stage_name in target_stages:
+                pipeline_stage.set_requested_columns(None)
+            else:
+                pipeline_stage.set_requested_columns(requested_columns | set(pipeline_stage.save_policy.columns or []))
+            requested_columns.update(
+                column for column in pipeline_stage.get_stage_inputs().get(COLUMNS, []) if column != ALL_KEYS)
+
+    def get_stage_waves(self, stages: List[CollectiveBodyBolt]) -> List[List[CollectiveBodyBolt]]:
+        """Group stages into waves of stages whose dependencies among the stages run in earlier waves."""
+        stage_indexes = [self.pipeline.index(pipeline_stage) for pipeline_stage in stages]
+        finished_indexes = set()
+        stage_waves = []
+        while len(finished_indexes) < len(stage_indexes):
+            ready_indexes = [
+                stage_index for stage_index in stage_indexes
+                if stage_index not in finished_indexes
+                and all(
+                    upstream_index in finished_indexes or upstream_index not in stage_indexes
+                    for upstream_index in self.stage_dependencies[stage_index]
+                )
+            ][:self.max_concurrent_stages]
+            stage_waves.append([self.pipeline[stage_index] for stage_index in ready_indexes])
+            finished_indexes.update(ready_indexes)
+        return stage_waves
+
+    def run_wave(
+            self,
+            stage_wave: List[CollectiveBodyBolt],
+            run_stage: Callable,
+            input_dataframe_list: List[pd.DataFrame],
+            aggregate_metadata: Dict,
+            input_metadata_list: List[Dict]) -> (List[pd.DataFrame], Dict, List[Dict]):
+        """Run the stages of a wave with run_stage(stage, df_list, aggregate_metadata, metadata_list) and merge their outputs."""
+        stage_views = [
+            self._get_stage_view(pipeline_stage, input_dataframe_list, aggregate_metadata, input_metadata_list)
+            for pipeline_stage in stage_wave
+        ]
+        if len(stage_wave) == 1:
+            stage_outputs = [run_stage(stage_wave[0], *stage_views[0])]
+        else:
+            # Stages save to their own directories through the shared output writer, which accepts writes from several threads
+            with ThreadPoolExecutor(max_workers=len(stage_wave), thread_name_prefix="pipeline_stage") as executor:
+                stage_futures = [
+                    executor.submit(run_stage, pipeline_stage, *stage_view)
+                    for pipeline_stage, stage_view in zip(stage_wave, stage_views)
+                ]
+                stage_outputs = [stage_future.result() for stage_future in stage_futures]
+
+        # Keep aggregate keys added or replaced by a stage, and the datasets of the stage modifying them
+        output_dataframe_list, output_metadata_list = input_dataframe_list, input_metadata_list
+        output_aggregate_metadata = dict(aggregate_metadata)
+        for pipeline_stage, (stage_df_list, stage_aggregate_metadata, stage_metadata_list) in zip(stage_wave, stage_outputs):
+            output_aggregate_metadata.update({
+                key: value for key, value in stage_aggregate_metadata.items()
+                if key not in aggregate_metadata or value is not aggregate_metadata[key]
+            })
+            stage_outputs_by_kind = pipeline_stage.get_stage_outputs()
+            if len(stage_outputs_by_kind.get(COLUMNS, [])) > 0:
+                output_dataframe_list = stage_df_list
+            if self._uses_dataset_keys(stage_outputs_by_kind):
+                output_metadata_list = stage_metadata_list
+
+        return output_dataframe_list, output_aggregate_metadata, output_metadata_list
+
+    def _get_stage_view(
+            self,
+            pipeline_stage: CollectiveBodyBolt,
+            input_dataframe_list: List[pd.DataFrame],
+            aggregate_metadata: Dict,
+            input_metadata_list: List[Dict]) -> (List[pd.DataFrame], Dict, List[Dict]):
+        # Stages add datasets and aggregate keys to their own lists and metadata, stages modifying
+        # datasets get them even if no columns were requested from them
+        stage_inputs, stage_outputs = pipeline_stage.get_stage_inputs(), pipeline_stage.get_stage_outputs()
+        uses_columns = len(stage_inputs.get(COLUMNS, [])) > 0 or self._uses_dataset_keys(stage_outputs)
+        uses_metadata = self._uses_dataset_keys(stage_inputs) or self._uses_dataset_keys(stage_outputs)
+        return (
+            list(input_dataframe_list) if uses_columns else [],
+            dict(aggregate_metadata),
+            list(input_metadata_list) if uses_metadata else [],
+        )
+
+    def _is_dependent(self, upstream_stage: CollectiveBodyBolt, stage: CollectiveBodyBolt) -> bool:
+        upstream_inputs, upstream_outputs = upstream_stage.get_stage_inputs(), upstream_stage.get_stage_outputs()
+        stage_inputs, stage_outputs = stage.get_stage_inputs(), stage.get_stage_outputs()
+
+        # Aggregate keys modified by one stage and used by the other
+        for outputs, inputs in [(upstream_outputs, stage_inputs), (upstream_outputs, stage_outputs), (stage_outputs, upstream_inputs)]:
+            if self._has_shared_keys({AGGREGATE_KEYS: outputs.get(AGGREGATE_KEYS, [])}, inputs):
+                return True
+
+        # Datasets modified by one stage and used by the other, only one stage modifies datasets at a time
+        if self._uses_dataset_keys(upstream_outputs) and self._uses_dataset_keys(stage_outputs):
+            return True
+        for kind in [METADATA_KEYS, COLUMNS]:
+            upstream_uses_kind = len(upstream_inputs.get(kind, [])) > 0 or len(upstream_outputs.get(kind, [])) > 0
+            stage_uses_kind = len(stage_inputs.get(kind, [])) > 0 or len(stage_outputs.get(kind, [])) > 0
+            if (len(upstream_outputs.get(kind, [])) > 0 and stage_uses_kind) or \
+                    (len(stage_outputs.get(kind, [])) > 0 and upstream_uses_kind):
+                return True
+        return False
+
+    def _has_shared_keys(self, stage_outputs: Dict[str, List[str]], stage_inputs: Dict[str, List[str]]) -> bool:
+        for kind, output_keys in stage_outputs.items():
+            input_keys = stage_inputs.get(kind, [])
+            if len(output_keys) == 0 or len(input_keys) == 0:
+                continue
+            if ALL_KEYS in output_keys or ALL_KEYS in input_keys or len(set(output_keys) & set(input_keys)) > 0:
+                return True
+        return False
+
+    def _uses_dataset_keys(self, stage_keys: Dict[str, List[str]]) -> bool:
+        return len(stage_keys.get(METADATA_KEYS, [])) > 0 or len(stage_keys.get(COLUMNS, [])) > 0
@@ -2,19 +2,31 @@
 # Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
 # Author: Justin Martin (jcm-art)
 
-import json
 from typing import Dict, List
 
-
-import numpy as np
 import pandas as pd
-from ..utils import CollectiveBodyBolt
-from collective_body_movement.analysis.metrics import MetricCalculator
+from ..storage import IntermediateStorage
+from ..utils import CollectiveBodyBolt, AGGREGATE_KEYS, ALL_KEYS, COLUMNS, METADATA_KEYS
+from .metric_table import MetricTable
 
 class AggregatorBolt(CollectiveBodyBolt):
 
-    def __init__(self, output_directory_path: str, save_intermediate_output: bool=False) -> None:
-        super().__init__(output_directory_path, save_intermediate_output)
+    cross_dataset = True
+
+    # Drops invalid datasets and intermediate columns
+    stage_inputs = {METADATA_KEYS: ["cleaned_metadata", "metrics", "basic_data_metrics"]}
+    stage_outputs = {
+        AGGREGATE_KEYS: ["final_aggregation_metadata", "metric_table", "metrics_summaries", "basic_data_metrics_summaries"],
+        METADATA_KEYS: [ALL_KEYS],
+        COLUMNS: [ALL_KEYS],
+    }
+
+    def __init__(
+            self, 
+            output_directory_path: str, 
+            save_intermediate_output: bool=False, 
+            storage: IntermediateStorage=None) -> None:
+        super().__init__(output_directory_path, save_intermediate_output, storage)
         self.metrics_categories = ["metrics", "basic_data_metrics"]
 
     def process(
@@ -28,28 +40,51 @@ class AggregatorBolt(CollectiveBodyBolt):
         self.aggregate_metadata_output = aggregate_metadata
         self.output_metadata_list = input_metadata_list
 
-        self.aggregate_metadata_output["final_aggregation_metadata"] = {}
+        # Drop invalid dataframes alongside their metadata before fitting on the metadata
+        self.output_df_list = [
+            df for df, metadata in zip(self.output_df_list, self.output_metadata_list) 
+            if metadata[list(metadata.keys())[0]]["cleaned_metadata"]["is_valid"]
+        ]
+
+        self.aggregate_metadata_output, self.output_metadata_list = self.fit(
+            self.aggregate_metadata_output, self.output_metadata_list)
 
-        self.aggregate_metadata_output, self.aggregate_metadata_output, self.output_metadata_list = self._purge_invalid_datasets(
+        self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list = self.transform(
             self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list)
 
+        if self.save_intermediate_output:
+            self.save_output()
+            
+        return self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list
+
+    def fit(self, aggregate_metadata: Dict, input_metadata_list: List[Dict]) -> (Dict, List[Dict]):
+        output_aggregate_metadata = aggregate_metadata
+        output_aggregate_metadata["final_aggregation_metadata"] = {}
 
-        self.aggregate_metadata_output, self.output_metadata_list = self._merge_metadata(
-            self.aggregate_metadata_output, self.output_metadata_list)
+        _, output_aggregate_metadata, output_metadata_list = self._purge_invalid_datasets(
+            None, output_aggregate_metadata, input_metadata_list)
+
+        output_aggregate_metadata, output_metadata_list = self._merge_metadata(
+            output_aggregate_metadata, output_metadata_list)
         
         # Get summary metrics for dervied metrics and for basic data
-        self.aggregate_metadata_output = self._metric_metadata_summaries(self.aggregate_metadata_output)
+        output_aggregate_metadata = self._metric_metadata_summaries(output_aggregate_metadata)
         
-        # self.aggregate_metadata_output, self.output_metadata_list = self._purge_metadata(
-        #    self.aggregate_metadata_output, self.output_metadata_list)
+        # output_aggregate_metadata, output_metadata_list = self._purge_metadata(
+        #    output_aggregate_metadata, output_metadata_list)
 
-        self.output_df_list, self.aggregate_metadata_output = self._purge_intermediate_columns(
-            self.output_df_list, self.aggregate_metadata_output)
+        return output_aggregate_metadata, output_metadata_list
 
-        if self.save_intermediate_output:
-            self.save_output()
-            
-        return self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list
+    def transform(
+        self, 
+        input_dataframe_list: List[pd.DataFrame], 
+        aggregate_metadata: Dict,
+        input_metadata_list: List[Dict]
+     ) -> (List[pd.DataFrame], Dict, List[Dict]):
+        output_df_list, output_aggregate_metadata = self._purge_intermediate_columns(
+            input_dataframe_list, aggregate_metadata)
+
+        return output_df_list, output_aggregate_metadata, input_metadata_list
 
     def _purge_invalid_datasets(
         self, 
@@ -70,9 +105,10 @@ class AggregatorBolt(CollectiveBodyBolt):
                 indexes_to_purge.append(i)
 
         indexes_to_purge.sort(reverse=True)
-        # Delete invalid datasets
+        # Delete invalid datasets, dataframes are optional when only purging metadata
         for index in indexes_to_purge:
-            del input_dataframe_list[index]
+            if input_dataframe_list is not None:
+                del input_dataframe_list[index]
             del input_metadata_list[index]
 
         aggregate_metadata["final_aggregation_metadata"]["purged_datasets"] = dataset_ids_to_purge
@@ -88,69 +124,21 @@ class AggregatorBolt(CollectiveBodyBolt):
         output_aggregate_metadata = aggregate_metadata
         output_metadata_list = input_metadata_list
 
-        output_aggregate_metadata["all_metrics"] = {}
-        output_aggregate_metadata["all_basic_data_metrics"] = {}
-
-        # Merge metadata for all calculated metrics
-        for i in range(len(output_metadata_list)):
-            metadata = output_metadata_list[i]
-            dataset_id = list(metadata.keys())[0]
-
-            # TODO fix hard coding
-            for metric_category in self.metrics_categories:
-                metrics_metadata = metadata[dataset_id][metric_category]
-
-                #print(json.dumps(metrics_metadata, indent=4))
-
-                for algorithm_key in metrics_metadata.keys():
-                    # Create dictionary for algorithm if not available
-                    if algorithm_key not in output_aggregate_metadata[f"all_{metric_category}"]:
-                        output_aggregate_metadata[f"all_{metric_category}"][algorithm_key]={}
-
-                    for metric_type in metrics_metadata[algorithm_key].keys():
-                        # Check if metric type already in aggregate data
-                        if metric_type not in output_aggregate_metadata[f"all_{metric_category}"][algorithm_key]:
-                            output_aggregate_metadata[f"all_{metric_category}"][algorithm_key][metric_type] = []
-                        
-                        # Append metric to aggregate data
-                        metric_data = metrics_metadata[algorithm_key][metric_type]
-                        output_aggregate_metadata[f"all_{metric_category}"][algorithm_key][metric_type]+= metric_data
-                        
-                        # print(f"Check: sum of data for alg: {algorithm_key}, met: {metric_type} is {np.sum(metric_data)}")
-
-
-                        # Todo - if appending more than 
+        # Merge metadata for all calculated metrics into one table, saved as all_metrics and 
+        # all_basic_data_metrics
+        output_aggregate_metadata["metric_table"] = MetricTable.from_metadata_list(
+            output_metadata_list, self.metrics_categories)
 
         return output_aggregate_metadata, output_metadata_list
 
     # TODO - move to separaete bolt to enable multiple aggregators
     def _metric_metadata_summaries(self, aggregate_metadata: Dict) -> Dict:
         output_aggregate_metadata = aggregate_metadata
+        metric_table = output_aggregate_metadata["metric_table"]
 
+        # Get summary statistics for algoritms
         for metric_type in self.metrics_categories:
-            output_aggregate_metadata[f"{metric_type}_summaries"] = {}
-
-            # Get all algorithms in metrics
-            algorithm_list = list(output_aggregate_metadata[f"all_{metric_type}"].keys())
-
-            #print("Aggregate Metadata is \n\n")
-            #print(json.dumps(output_aggregate_metadata, indent=4))
-
-
-            # Get summary statistics for algoritms
-            for algorithm in algorithm_list:
-                output_aggregate_metadata[f"{metric_type}_summaries"][algorithm] = {}
-                metric_options = list(output_aggregate_metadata[f"all_{metric_type}"][algorithm].keys())
-
-                for metric in metric_options[1:]:
-                    metric_data = output_aggregate_metadata[f"all_{metric_type}"][algorithm][metric]
-
-                    #print(f"Check: sum of data for alg: {algorithm}, met: {metric} is {np.sum(metric_data)}")
-
-                    total_dist_metric = MetricCalculator()
-                    meta_metric_dict = total_dist_metric.calculate_meta_metrics(metric_data)
-                    output_aggregate_metadata[f"{metric_type}_summaries"][algorithm][metric] = meta_metric_dict
-
+            output_aggregate_metadata[f"{metric_type}_summaries"] = metric_table.summarize(metric_type)
 
         return output_aggregate_metadata
         
@@ -182,6 +170,8 @@ class AggregatorBolt(CollectiveBodyBolt):
                            'head_rot_l','left_rot_i','left_rot_j','left_rot_k','left_rot_l',
                            'right_rot_i','right_rot_j','right_rot_k','right_rot_l','timestamp',
                            'elapsed_time']
+        if len(output_df_list) == 0:
+            return output_df_list, output_aggregate_metadata
         dropped_columns = output_df_list[0].columns.difference(columns_to_keep)
 
 
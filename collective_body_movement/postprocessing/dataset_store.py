@@ -0,0 +1,107 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import pathlib
+import pickle
+from typing import Dict, List
+
+import pandas as pd
+
+from ..ingest.file_index import RawFileIndex
+from ..storage import IntermediateStorage
+from ..utils import CollectiveBodyBolt, CollectiveBodyLogger, AGGREGATE_KEYS, ALL_KEYS, COLUMNS, METADATA_KEYS
+
+class DatasetStoreBolt(CollectiveBodyBolt):
+    """
+    Stores per-dataset results for incremental ingest and merges them with the results of
+    earlier runs, so the cross-dataset bolts (aggregation, normalization) see every dataset
+    while only new or changed files are processed.
+    """
+
+    cross_dataset = True
+
+    # Stores whole datasets and adds the stored datasets of earlier runs
+    stage_inputs = {AGGREGATE_KEYS: ["incremental_metadata"], METADATA_KEYS: [ALL_KEYS], COLUMNS: [ALL_KEYS]}
+    stage_outputs = {METADATA_KEYS: [ALL_KEYS], COLUMNS: [ALL_KEYS]}
+
+    def __init__(
+            self,
+            output_directory_path: str,
+            file_index: RawFileIndex,
+            save_intermediate_output: bool=False,
+            storage: IntermediateStorage=None) -> None:
+        super().__init__(output_directory_path, save_intermediate_output, storage)
+
+        self.file_index = file_index
+        self.store_path = pathlib.Path(output_directory_path)
+        self.store_path.mkdir(parents=True, exist_ok=True)
+
+        self.logger = CollectiveBodyLogger(__class__.__name__)
+
+    def process(
+        self,
+        input_dataframe_list: List[pd.DataFrame],
+        aggregate_metadata: Dict,
+        input_metadata_list: List[Dict]
+     ) -> (List[pd.DataFrame], List[Dict]):
+
+        self.output_df_list = input_dataframe_list
+        self.aggregate_metadata_output = aggregate_metadata
+        self.output_metadata_list = input_metadata_list
+
+        incremental_metadata = self.aggregate_metadata_output["incremental_metadata"]
+
+        # Store results of datasets processed in this run
+        data_start_abstimes = {}
+        for df, metadata in zip(self.output_df_list, self.output_metadata_list):
+            dataset_id = list(metadata.keys())[0]
+            self._save_dataset(dataset_id, df, metadata)
+            data_start_abstimes[dataset_id] = metadata[dataset_id]["cleaned_metadata"]["data_start_abstime"]
+
+        # Remove datasets of deleted files
+        for dataset_id in incremental_metadata["removed_dataset_ids"]:
+            self._get_dataset_path(dataset_id).unlink(missing_ok=True)
+
+        # Merge in stored datasets from earlier runs, ordered by dataset ID
+        for prior_dataset in incremental_metadata["prior_datasets"]:
+            df, metadata = self._load_dataset(prior_dataset["dataset_id"])
+            self.output_df_list.append(df)
+            self.output_metadata_list.append(metadata)
+
+        merged_order = sorted(
+            range(len(self.output_metadata_list)), key=lambda i: list(self.output_metadata_list[i].keys())[0])
+        self.output_df_list = [self.output_df_list[i] for i in merged_order]
+        self.output_metadata_list = [self.output_metadata_list[i] for i in merged_order]
+
+        self.logger.log(f"Merged {len(data_start_abstimes)} new datasets with "
+                        f"{len(incremental_metadata['prior_datasets'])} stored datasets")
+
+        # Files are only marked as ingested once their results are stored
+        self.file_index.commit(data_start_abstimes)
+
+        if self.save_intermediate_output:
+            self.save_output()
+
+        return self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list
+
+    def _save_dataset(self, dataset_id: int, df: pd.DataFrame, metadata: Dict):
+        # Invalid datasets are purged during aggregation, only their metadata is needed
+        if metadata[dataset_id]["cleaned_metadata"]["is_valid"] == False:
+            df = df.iloc[0:0]
+
+        with open(self._get_dataset_path(dataset_id), "wb") as outfile:
+            pickle.dump((df, metadata), outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _load_dataset(self, dataset_id: int):
+        dataset_path = self._get_dataset_path(dataset_id)
+        if not dataset_path.exists():
+            raise Exception(f"Stored dataset {dataset_id} is missing from {self.store_path}, "
+                            f"remove the file index to ingest all files again")
+
+        with open(dataset_path, "rb") as infile:
+            df, metadata = pickle.load(infile)
+        return df, metadata
+
+    def _get_dataset_path(self, dataset_id: int) -> pathlib.Path:
+        return self.store_path / f"dataset_{dataset_id}.pkl"
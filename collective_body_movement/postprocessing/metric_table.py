@@ -0,0 +1,116 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+class MetricTable:
+    """Table of the metrics of all datasets, one float64 row per dataset ID and one column per (metric category, algorithm, metric type)."""
+
+    def __init__(
+            self, 
+            dataset_ids: List[int], 
+            feature_keys: List[Tuple[str, str, str]], 
+            metrics_categories: List[str],
+            layout_keys: Dict[str, str] = None) -> None:
+        self.metrics_categories = list(metrics_categories)
+        # Aggregate metadata key of every category in the saved layout, all_{category} by default
+        self.layout_keys = layout_keys if layout_keys is not None else {
+            metric_category: f"all_{metric_category}" for metric_category in self.metrics_categories
+        }
+        self.dataset_ids = np.asarray(dataset_ids, dtype=np.int64)
+        self.feature_keys = list(feature_keys)
+        self.feature_index = {feature_key: i for i, feature_key in enumerate(self.feature_keys)}
+
+        # Features missing from a dataset remain NaN
+        self.values = np.full((len(self.dataset_ids), len(self.feature_keys)), np.nan, dtype=np.float64)
+
+    @classmethod
+    def from_metadata_list(cls, input_metadata_list: List[Dict], metrics_categories: List[str]) -> "MetricTable":
+        """Build the table from the per-dataset metric dictionaries of every dataset."""
+        dataset_ids = [list(metadata.keys())[0] for metadata in input_metadata_list]
+
+        # Collect features in order of first appearance before allocating the table
+        feature_keys = {}
+        for dataset_id, metadata in zip(dataset_ids, input_metadata_list):
+            for metric_category in metrics_categories:
+                for algorithm_key, metric_dict in metadata[dataset_id][metric_category].items():
+                    for metric_type in metric_dict.keys():
+                        if metric_type != "dataset_id":
+                            feature_keys[(metric_category, algorithm_key, metric_type)] = None
+
+        metric_table = cls(dataset_ids, list(feature_keys.keys()), metrics_categories)
+        for row, (dataset_id, metadata) in enumerate(zip(dataset_ids, input_metadata_list)):
+            metric_table.set_dataset_metrics(row, metadata[dataset_id], metrics_categories)
+
+        return metric_table
+
+    def set_dataset_metrics(self, row: int, dataset_metadata: Dict, metrics_categories: List[str]):
+        """Fill a table row from the metric dictionaries of a single dataset."""
+        for metric_category in metrics_categories:
+            for algorithm_key, metric_dict in dataset_metadata[metric_category].items():
+                for metric_type, metric_data in metric_dict.items():
+                    if metric_type != "dataset_id":
+                        self.values[row, self.feature_index[(metric_category, algorithm_key, metric_type)]] = metric_data[0]
+
+    def with_values(self, values: np.ndarray, layout_keys: Dict[str, str] = None) -> "MetricTable":
+        """Return a table with the same datasets and features holding other values, e.g. normalized metrics."""
+        assert values.shape == self.values.shape, "Values must match the table shape"
+        metric_table = MetricTable(self.dataset_ids, self.feature_keys, self.metrics_categories, layout_keys)
+        metric_table.values = values
+        return metric_table
+
+    def get_category_columns(self, metric_category: str) -> List[int]:
+        return [i for i, feature_key in enumerate(self.feature_keys) if feature_key[0] == metric_category]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Return the table as a dataframe with (category, algorithm, metric) columns, without copying."""
+        return pd.DataFrame(
+            self.values,
+            index=pd.Index(self.dataset_ids, name="dataset_id"),
+            columns=pd.MultiIndex.from_tuples(self.feature_keys, names=["category", "algorithm", "metric"]),
+            copy=False)
+
+    def summarize(self, metric_category: str) -> Dict:
+        """Summary statistics across datasets for every feature of a category, in one call per statistic."""
+        category_columns = self.get_category_columns(metric_category)
+        category_values = self.values[:, category_columns]
+
+        summaries = {}
+        if len(self.dataset_ids) == 0:
+            return summaries
+
+        summary_statistics = {
+            'mean': np.mean(category_values, axis=0),
+            'max': np.max(category_values, axis=0),
+            'min': np.min(category_values, axis=0),
+            'sum': np.sum(category_values, axis=0),
+            'std': np.std(category_values, axis=0),
+        }
+        for i, column in enumerate(category_columns):
+            _, algorithm_key, metric_type = self.feature_keys[column]
+            summaries.setdefault(algorithm_key, {})[metric_type] = {
+                statistic: statistic_values[i] for statistic, statistic_values in summary_statistics.items()
+            }
+        return summaries
+
+    def to_category_dict(self, metric_category: str) -> Dict:
+        """Return a category in the nested layout, algorithm to dataset IDs and metric value lists."""
+        dataset_id_list = self.dataset_ids.tolist()
+        category_dict = {}
+        for column in self.get_category_columns(metric_category):
+            _, algorithm_key, metric_type = self.feature_keys[column]
+            if algorithm_key not in category_dict:
+                category_dict[algorithm_key] = {"dataset_id": list(dataset_id_list)}
+            category_dict[algorithm_key][metric_type] = self.values[:, column].tolist()
+        return category_dict
+
+    def to_metadata_layout(self) -> Dict:
+        """Nested layout saved in the aggregate metadata json, e.g. {"all_metrics": {...}}, only derived when saving."""
+        return {
+            self.layout_keys[metric_category]: self.to_category_dict(metric_category)
+            for metric_category in self.metrics_categories
+        }
@@ -2,156 +2,266 @@
 # Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
 # Author: Justin Martin (jcm-art)
 
-from typing import Dict, List
+import pathlib
+from typing import Dict, List, Tuple
 import numpy as np
 import pandas as pd
-from ..utils import CollectiveBodyBolt
+from ..storage import IntermediateStorage
+from ..utils import CollectiveBodyBolt, CollectiveBodyLogger, AGGREGATE_KEYS, COLUMNS
+from .metric_table import MetricTable
+from .normalization_model import NormalizationModelStore
 
 class NormalizerBolt(CollectiveBodyBolt):
 
-    def __init__(self, output_directory_path: str, save_intermediate_output: bool=False) -> None:
-        super().__init__(output_directory_path, save_intermediate_output)
+    cross_dataset = True
+
+    NORMALIZATION_METHODS = ["min_max", "z_score", "robust"]
+    # fit: fit on all datasets every run, transform: apply the latest saved model (fitted once if 
+    # none exists), refit: fit on all datasets and save a new model version
+    NORMALIZATION_MODES = ["fit", "transform", "refit"]
+    MIN_SCALE = 1e-4 # Features with a smaller spread are only offset, not scaled
+    NORMALIZED_LAYOUT_KEYS = {
+        "basic_data_metrics": "normalized_basic_metrics",
+        "metrics": "normalized_algorithm_metrics",
+    }
+    POSITION_COLUMNS = [f"{sensor_location}_pos_{dim}" for sensor_location in ['head','left','right'] for dim in ['x','y','z']]
+
+    # Normalizes the dataset positions in place
+    stage_inputs = {AGGREGATE_KEYS: ["metric_table", "incremental_metadata"], COLUMNS: POSITION_COLUMNS}
+    stage_outputs = {AGGREGATE_KEYS: ["normalization_output", "normalized_metric_table"], COLUMNS: POSITION_COLUMNS}
+
+    def __init__(
+            self,
+            output_directory_path: str,
+            normalization_method: str = "min_max",
+            normalization_mode: str = "fit",
+            model_directory_path: str = None,
+            save_intermediate_output: bool=False,
+            storage: IntermediateStorage=None) -> None:
+        super().__init__(output_directory_path, save_intermediate_output, storage)
+
+        if normalization_method not in self.NORMALIZATION_METHODS:
+            raise ValueError(f"Normalization method {normalization_method} is not one of {self.NORMALIZATION_METHODS}")
+        if normalization_mode not in self.NORMALIZATION_MODES:
+            raise ValueError(f"Normalization mode {normalization_mode} is not one of {self.NORMALIZATION_MODES}")
+        if normalization_mode != "fit" and model_directory_path is None:
+            raise ValueError(f"Normalization mode {normalization_mode} requires a model directory")
+        self.normalization_method = normalization_method
+        self.normalization_mode = normalization_mode
+        self.model_store = NormalizationModelStore(model_directory_path) if normalization_mode != "fit" else None
+        self.normalization_model: Dict = None
+        # Datasets whose saved output is kept in transform-only runs
+        self.unsaved_dataset_ids = set()
+        self.logger = CollectiveBodyLogger(__class__.__name__)
+        self.sensor_locations = ['head', 'left','right']
+        self.pos_axes = ['x','y','z']
 
     def process(
-        self, 
-        input_dataframe_list: List[pd.DataFrame], 
+        self,
+        input_dataframe_list: List[pd.DataFrame],
         aggregate_metadata: Dict,
         input_metadata_list: List[Dict]
      ) -> (List[pd.DataFrame], List[Dict]):
-        
+
         self.output_df_list = input_dataframe_list
         self.aggregate_metadata_output = aggregate_metadata
         self.output_metadata_list = input_metadata_list
 
-        self.aggregate_metadata_output["normalization_output"] = {}
-
-
-        self.aggregate_metadata_output, self.output_metadata_list = self._normalize_metrics(
+        self.aggregate_metadata_output, self.output_metadata_list = self.fit(
             self.aggregate_metadata_output, self.output_metadata_list)
-        
-        self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list = self._normalize_datasets(
+
+        self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list = self.transform(
             self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list)
-        
+
 
         if self.save_intermediate_output:
             self.save_output()
-            
+
         return self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list
-    
 
-    def _normalize_datasets(
-        self, 
-        input_dataframe_list: List[pd.DataFrame], 
+    def get_config(self) -> Dict:
+        return {"normalization_method": self.normalization_method, "normalization_mode": self.normalization_mode}
+
+    def get_checkpoint_inputs(self, aggregate_metadata: Dict) -> Dict:
+        # Saved models are an input of transform-only runs
+        if self.model_store is None:
+            return {}
+        return {"model_version": self.model_store.get_latest_version()}
+
+    def fit(self, aggregate_metadata: Dict, input_metadata_list: List[Dict]) -> (Dict, List[Dict]):
+        output_aggregate_metadata = aggregate_metadata
+        metric_table = output_aggregate_metadata["metric_table"]
+
+        if self.normalization_mode == "transform" and self.model_store.get_latest_version() is not None:
+            self.normalization_model = self.model_store.load()
+            self.logger.log(f"Normalizing with saved model version {self.normalization_model['model_version']}")
+        else:
+            self.normalization_model = {
+                "fitted_dataset_ids": metric_table.dataset_ids.tolist(),
+                "metric_parameters": self._fit_metric_parameters(metric_table),
+                "position_min_max": self._fit_position_normalization(metric_table),
+            }
+            if self.model_store is not None:
+                self.normalization_model = self.model_store.save(self.normalization_model)
+
+        # Store fitted parameters, datasets and metrics can be normalized from these alone
+        output_aggregate_metadata["normalization_output"] = {
+            "model_version": self.normalization_model.get("model_version"),
+            "metric_parameters": self.normalization_model["metric_parameters"],
+            "position_min_max": self.normalization_model["position_min_max"],
+        }
+
+        output_aggregate_metadata = self._normalize_metrics(output_aggregate_metadata)
+
+        return output_aggregate_metadata, input_metadata_list
+
+    def transform(
+        self,
+        input_dataframe_list: List[pd.DataFrame],
         aggregate_metadata: Dict,
         input_metadata_list: List[Dict]
-     ) -> (List[pd.DataFrame], List[Dict]):
-        
-        ouput_aggregate_metadata = aggregate_metadata
-        output_metadata_list = input_metadata_list
-        prior_basic_metrics = ouput_aggregate_metadata["all_basic_data_metrics"]
-
-        min_max_dict = {
-            'x':{},
-            'y':{},
-            'z':{},
+     ) -> (List[pd.DataFrame], Dict, List[Dict]):
+        # All datasets are normalized and returned, unchanged datasets are not saved again
+        if self.normalization_mode == "transform":
+            self.unsaved_dataset_ids = self._get_unsaved_dataset_ids(aggregate_metadata, input_metadata_list)
+
+        output_df_list, output_aggregate_metadata, output_metadata_list = self._normalize_datasets(
+            input_dataframe_list, aggregate_metadata, input_metadata_list)
+
+        if self.model_store is not None:
+            self.model_store.add_normalized_datasets(
+                self.normalization_model, [list(metadata.keys())[0] for metadata in output_metadata_list])
+
+        return output_df_list, output_aggregate_metadata, output_metadata_list
+
+    def _get_saved_datasets(self) -> List[Tuple[Dict, pd.DataFrame]]:
+        return [
+            (metadata, df) for metadata, df in super()._get_saved_datasets() 
+            if list(metadata.keys())[0] not in self.unsaved_dataset_ids
+        ]
+
+    def _get_unsaved_dataset_ids(self, aggregate_metadata: Dict, input_metadata_list: List[Dict]) -> set:
+        # Unchanged datasets already saved with the current model keep their saved output
+        if not self.save_intermediate_output:
+            return set()
+        normalized_dataset_ids = set(self.normalization_model["normalized_dataset_ids"])
+        unchanged_dataset_ids = set(
+            prior_dataset["dataset_id"] 
+            for prior_dataset in aggregate_metadata.get("incremental_metadata", {}).get("prior_datasets", [])
+        )
+
+        unsaved_dataset_ids = set()
+        for metadata in input_metadata_list:
+            dataset_id = list(metadata.keys())[0]
+            saved_output_path = pathlib.Path(
+                f"{self.output_path/f'CollectiveBodyBolt_{dataset_id}'}{self.storage.file_suffix}")
+            if dataset_id in normalized_dataset_ids and dataset_id in unchanged_dataset_ids and saved_output_path.exists():
+                unsaved_dataset_ids.add(dataset_id)
+
+        self.logger.log(f"Keeping the saved output of {len(unsaved_dataset_ids)} datasets normalized "
+                        f"with model version {self.normalization_model['model_version']}")
+        return unsaved_dataset_ids
+
+    def _fit_metric_parameters(self, metric_table: MetricTable) -> Dict:
+        """Fit the center and scale of every metric feature over all datasets."""
+        values = metric_table.values
+
+        if values.shape[0] == 0:
+            center = np.zeros(values.shape[1])
+            spread = np.ones(values.shape[1])
+        elif self.normalization_method == "min_max":
+            center = np.min(values, axis=0)
+            spread = np.max(values, axis=0) - center
+        elif self.normalization_method == "z_score":
+            center = np.mean(values, axis=0)
+            spread = np.std(values, axis=0)
+        elif self.normalization_method == "robust":
+            lower_quartile, center, upper_quartile = np.percentile(values, [25, 50, 75], axis=0)
+            spread = upper_quartile - lower_quartile
+
+        scale = np.where(spread > self.MIN_SCALE, spread, 1)
+
+        return {
+            "method": self.normalization_method,
+            "feature_keys": [list(feature_key) for feature_key in metric_table.feature_keys],
+            "center": center.tolist(),
+            "scale": scale.tolist(),
         }
 
-        for dim in min_max_dict.keys():
+    def _fit_position_normalization(self, metric_table: MetricTable) -> Dict:
+        # Position axes share min and max over all sensors and datasets
+        min_max_dict = {}
+        for dim in self.pos_axes:
+            max_columns = [
+                metric_table.feature_index[("basic_data_metrics", f"{sensor_location}_pos_{dim}", "max")]
+                for sensor_location in self.sensor_locations
+            ]
+            min_columns = [
+                metric_table.feature_index[("basic_data_metrics", f"{sensor_location}_pos_{dim}", "min")]
+                for sensor_location in self.sensor_locations
+            ]
+            dim_max = np.max(metric_table.values[:, max_columns])
+            dim_min = np.min(metric_table.values[:, min_columns])
+            min_max_dict[dim] = {
+                'max': dim_max,
+                'min': dim_min,
+                'denom_value': dim_max - dim_min if dim_max - dim_min > self.MIN_SCALE else 1,
+            }
+            print(f"min {dim_min} max {dim_max} and size of combined = {len(max_columns)*len(metric_table.dataset_ids)}")
+
+        return min_max_dict
+
+    def _normalize_metrics(self, aggregate_metadata: Dict) -> Dict:
+        ouput_aggregate_metadata = aggregate_metadata
+        metric_table = ouput_aggregate_metadata["metric_table"]
+        metric_parameters = ouput_aggregate_metadata["normalization_output"]["metric_parameters"]
+
+        # Normalize all metrics of all datasets in one transform, saved as normalized_basic_metrics
+        # and normalized_algorithm_metrics
+        center, scale = self._align_metric_parameters(metric_table, metric_parameters)
+        normalized_values = (metric_table.values - center) / scale
+        ouput_aggregate_metadata["normalized_metric_table"] = metric_table.with_values(
+            normalized_values, self.NORMALIZED_LAYOUT_KEYS)
+
+        return ouput_aggregate_metadata
+
+    def _align_metric_parameters(self, metric_table: MetricTable, metric_parameters: Dict) -> (np.ndarray, np.ndarray):
+        """Order fitted centers and scales by the table features, features unknown to a saved model are NaN."""
+        fitted_feature_index = {
+            tuple(feature_key): i for i, feature_key in enumerate(metric_parameters["feature_keys"])
+        }
+        fitted_columns = np.array([fitted_feature_index.get(feature_key, -1) for feature_key in metric_table.feature_keys], dtype=np.int64)
+        if np.any(fitted_columns < 0):
+            self.logger.log(f"{np.sum(fitted_columns < 0)} metrics are missing from the normalization model, "
+                            f"refit the model to normalize them")
 
-            # Get max and min values for norm
-            combined_maxes = [] 
-            combined_mins = [] 
+        center = np.append(np.asarray(metric_parameters["center"], dtype=np.float64), np.nan)[fitted_columns]
+        scale = np.append(np.asarray(metric_parameters["scale"], dtype=np.float64), np.nan)[fitted_columns]
+        return center, scale
 
-            for sensor_location in ['head', 'left','right']:
-                    combined_maxes = combined_maxes+prior_basic_metrics[f"{sensor_location}_pos_{dim}"]["max"]
-                    combined_mins = combined_mins+prior_basic_metrics[f"{sensor_location}_pos_{dim}"]["min"]
+    def _normalize_datasets(
+        self,
+        input_dataframe_list: List[pd.DataFrame],
+        aggregate_metadata: Dict,
+        input_metadata_list: List[Dict]
+     ) -> (List[pd.DataFrame], List[Dict]):
 
-            min_max_dict[dim]['max'] = np.max(combined_maxes)
-            min_max_dict[dim]['min'] = np.min(combined_mins)
-            print(f"min {min_max_dict[dim]['min']} max {min_max_dict[dim]['max']} and size of combined = {len(combined_maxes)}")
-            min_max_dict[dim]['denom_value'] = min_max_dict[dim]['max'] - min_max_dict[dim]['min'] \
-                if min_max_dict[dim]['max']-min_max_dict[dim]['min'] > 1e-4 else 1
+        min_max_dict = aggregate_metadata["normalization_output"]["position_min_max"]
+        position_columns = [
+            f"{sensor_location}_pos_{dim}" for sensor_location in self.sensor_locations for dim in self.pos_axes
+        ]
+        position_mins = np.array([min_max_dict[dim]['min'] for _ in self.sensor_locations for dim in self.pos_axes])
+        position_denoms = np.array([min_max_dict[dim]['denom_value'] for _ in self.sensor_locations for dim in self.pos_axes])
 
-        # Normalize position data
+        # Normalize position data as one block per dataset, keeping float32 positions as float32
         for i in range(len(input_dataframe_list)):
             df = input_dataframe_list[i]
-            for dim in ['x','y','z']:
-
-                # Update sensors w/ normalized dimension
-                for sensor_location in ['head', 'left','right']:
-                    df[f"{sensor_location}_pos_{dim}"] = \
-                        (df[f"{sensor_location}_pos_{dim}"] - \
-                         min_max_dict[dim]['min'])/(min_max_dict[dim]['denom_value'])
+            position_dtype = np.result_type(*df[position_columns].dtypes)
+            position_block = df[position_columns].to_numpy(dtype=position_dtype, copy=True)
+            np.subtract(position_block, position_mins.astype(position_dtype), out=position_block)
+            np.divide(position_block, position_denoms.astype(position_dtype), out=position_block)
+            df[position_columns] = position_block
 
             input_dataframe_list[i] = df
 
-
         return input_dataframe_list, aggregate_metadata, input_metadata_list
-
-
-    def _normalize_metrics(
-            self, 
-        aggregate_metadata: Dict,
-        input_metadata_list: List[Dict],
-     ) -> (List[pd.DataFrame], List[Dict]):
-        
-        ouput_aggregate_metadata = aggregate_metadata
-        output_metadata_list = input_metadata_list
-
-        # Get un-normalized metrics
-        prior_basic_metrics = ouput_aggregate_metadata["all_basic_data_metrics"]
-        prior_algorithm_metrics = ouput_aggregate_metadata["all_metrics"]
-
-        ouput_aggregate_metadata["normalized_basic_metrics"] = {}
-        ouput_aggregate_metadata["normalized_algorithm_metrics"] = {}
-
-        # Normalize basic metrics
-        for algorithm_type in prior_basic_metrics.keys():
-
-            norm_metric_dict = {}
-
-            for metric_type in prior_basic_metrics[algorithm_type].keys():
-
-                metric_arr = np.array(prior_basic_metrics[algorithm_type][metric_type])
-
-                # Normalize each metric list                               
-                if metric_type !="dataset_id": # Skip normalizing dataset ids 
-                    # Get values for normalization
-                    min_val = np.min(metric_arr)
-                    max_val = np.max(metric_arr)
-                    norm_denom = max_val - min_val if max_val - min_val > 1e-4 else 1
-
-                    # Normalize and store new metric
-                    metric_arr = (metric_arr - min_val)/norm_denom
-
-                norm_metric_dict[metric_type] = metric_arr.tolist()
-
-            ouput_aggregate_metadata["normalized_basic_metrics"][algorithm_type] = norm_metric_dict
-
-        # Normalize algorithm metrics
-        for algorithm_type in prior_algorithm_metrics.keys():
-
-            norm_metric_dict = {}
-
-            for metric_type in prior_algorithm_metrics[algorithm_type].keys():
-
-                metric_list = prior_algorithm_metrics[algorithm_type][metric_type]
-                metric_arr = np.array(metric_list)
-                
-                # Normalize each metric list                               
-                if metric_type !="dataset_id": # Skip normalizing dataset ids 
-                    # Get values for normalization
-                    min_val = np.min(metric_arr)
-                    max_val = np.max(metric_arr)
-                    norm_denom = max_val - min_val if max_val - min_val > 1e-4 else 1
-
-                    # Normalize and store new metric
-                    metric_arr = (metric_arr - min_val)/norm_denom
-
-                #print(f"keys: {algorithm_type}, {metric_type}, \n\n {metric_arr}")
-                norm_metric_dict[metric_type] = metric_arr.tolist()
-                #print(f"exception due to arr issue: {ouput_aggregate_metadata['normalized_algorithm_metrics']}")
-
-            ouput_aggregate_metadata["normalized_algorithm_metrics"][algorithm_type] = norm_metric_dict
-
-        return ouput_aggregate_metadata, output_metadata_list
\ No newline at end of file
@@ -0,0 +1,80 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import json
+import pathlib
+import re
+import time
+from typing import Dict, List
+
+from ..utils import CollectiveBodyLogger
+
+class NormalizationModelStore:
+    """Versioned store of fitted normalization models and the datasets normalized with each version."""
+
+    FORMAT_VERSION = 1
+    MODEL_FILE_PATTERN = re.compile(r"normalization_model_v(\d+)\.json")
+
+    def __init__(self, model_directory_path: str) -> None:
+        self.model_directory_path = pathlib.Path(model_directory_path)
+        self.model_directory_path.mkdir(parents=True, exist_ok=True)
+
+        self.logger = CollectiveBodyLogger(__class__.__name__)
+
+    def get_latest_version(self) -> int:
+        """Return the latest saved model version, or None if no model was saved."""
+        versions = [
+            int(match.group(1)) for match in
+            (self.MODEL_FILE_PATTERN.fullmatch(path.name) for path in self.model_directory_path.iterdir())
+            if match is not None
+        ]
+        return max(versions) if len(versions) > 0 else None
+
+    def load(self, model_version: int = None) -> Dict:
+        """Load a model version, the latest version by default."""
+        if model_version is None:
+            model_version = self.get_latest_version()
+        if model_version is None:
+            raise Exception(f"No normalization model found in {self.model_directory_path}, "
+                            f"run with normalization mode refit to fit one")
+
+        with open(self._get_model_path(model_version)) as json_file:
+            normalization_model = json.load(json_file)
+
+        if normalization_model["format_version"] != self.FORMAT_VERSION:
+            raise Exception(f"Normalization model version {model_version} has format version "
+                            f"{normalization_model['format_version']}, expected {self.FORMAT_VERSION}, "
+                            f"run with normalization mode refit to fit a new model")
+        return normalization_model
+
+    def save(self, normalization_model: Dict) -> Dict:
+        """Save a newly fitted model as the next version and return it with its version set."""
+        latest_version = self.get_latest_version()
+        normalization_model = dict(normalization_model)
+        normalization_model["format_version"] = self.FORMAT_VERSION
+        normalization_model["model_version"] = latest_version + 1 if latest_version is not None else 1
+        normalization_model["created_time"] = time.time()
+        normalization_model["normalized_dataset_ids"] = []
+
+        self._write(normalization_model)
+        self.logger.log(f"Saved normalization model version {normalization_model['model_version']}")
+        return normalization_model
+
+    def add_normalized_datasets(self, normalization_model: Dict, dataset_ids: List[int]):
+        """Record datasets normalized with the model."""
+        normalized_dataset_ids = set(normalization_model["normalized_dataset_ids"]) | set(int(i) for i in dataset_ids)
+        normalization_model["normalized_dataset_ids"] = sorted(normalized_dataset_ids)
+        self._write(normalization_model)
+
+    def _write(self, normalization_model: Dict):
+        # Write to a temporary file first, a crash never leaves a partial model behind
+        model_path = self._get_model_path(normalization_model["model_version"])
+        temporary_path = model_path.with_suffix(".tmp")
+        with open(temporary_path, "w") as outfile:
+            json_object = json.dumps(normalization_model, indent = 6, sort_keys=True, default=str)
+            outfile.write(json_object)
+        temporary_path.replace(model_path)
+
+    def _get_model_path(self, model_version: int) -> pathlib.Path:
+        return self.model_directory_path / f"normalization_model_v{model_version}.json"
@@ -4,12 +4,24 @@
 
 from typing import Dict, List
 import pandas as pd
-from ..utils import CollectiveBodyBolt
+from ..storage import IntermediateStorage
+from ..utils import CollectiveBodyBolt, CollectiveBodyLogger, AGGREGATE_KEYS, METADATA_KEYS
 
 class ReportBolt(CollectiveBodyBolt):
 
-    def __init__(self, output_directory_path: str, save_intermediate_output: bool=False) -> None:
-        super().__init__(output_directory_path, save_intermediate_output)
+    cross_dataset = True
+
+    # Reports only use metadata, datasets are not passed to the bolt
+    stage_inputs = {METADATA_KEYS: ["cleaned_metadata"]}
+    stage_outputs = {AGGREGATE_KEYS: ["memory_report"]}
+
+    def __init__(
+            self, 
+            output_directory_path: str, 
+            save_intermediate_output: bool=False, 
+            storage: IntermediateStorage=None) -> None:
+        super().__init__(output_directory_path, save_intermediate_output, storage)
+        self.logger = CollectiveBodyLogger(__class__.__name__)
 
     def process(
         self, 
@@ -22,8 +34,33 @@ class ReportBolt(CollectiveBodyBolt):
         self.aggregate_metadata_output = aggregate_metadata
         self.output_metadata_list = input_metadata_list
 
+        self.aggregate_metadata_output, self.output_metadata_list = self.fit(
+            self.aggregate_metadata_output, self.output_metadata_list)
 
         if self.save_intermediate_output:
             self.save_output()
             
         return self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list
+
+    def fit(self, aggregate_metadata: Dict, input_metadata_list: List[Dict]) -> (Dict, List[Dict]):
+        output_aggregate_metadata = aggregate_metadata
+        output_aggregate_metadata["memory_report"] = self._memory_report(input_metadata_list)
+        return output_aggregate_metadata, input_metadata_list
+
+    def _memory_report(self, input_metadata_list: List[Dict]) -> Dict:
+        """Cleaned dataframe sizes of every dataset with parsed column types and with the dtype policy."""
+        memory_report = {"dataset_id": [], "parsed_memory_bytes": [], "memory_bytes": []}
+        for metadata in input_metadata_list:
+            cleaned_metadata = metadata[list(metadata.keys())[0]]["cleaned_metadata"]
+            # Datasets ingested before sizes were recorded have no sizes
+            if cleaned_metadata.get("memory_bytes") is None:
+                continue
+            memory_report["dataset_id"].append(cleaned_metadata["dataset_id"])
+            memory_report["parsed_memory_bytes"].append(cleaned_metadata["parsed_memory_bytes"])
+            memory_report["memory_bytes"].append(cleaned_metadata["memory_bytes"])
+
+        memory_report["total_parsed_memory_bytes"] = sum(memory_report["parsed_memory_bytes"])
+        memory_report["total_memory_bytes"] = sum(memory_report["memory_bytes"])
+        self.logger.log(f"Cleaned datasets use {memory_report['total_memory_bytes'] / 1e6:.1f} MB, "
+                        f"{memory_report['total_parsed_memory_bytes'] / 1e6:.1f} MB with parsed column types")
+        return memory_report
@@ -2,14 +2,21 @@
 # Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
 # Author: Justin Martin (jcm-art)
 
+from concurrent.futures import ProcessPoolExecutor
+import copy
 import datetime
 import os
 import numpy as np
 import pathlib
 import pandas as pd
+import time
 from typing import Dict, List
 
-from ..utils import CollectiveBodyLogger, CollectiveBodyBolt
+from ..storage import IntermediateStorage
+from ..utils import CollectiveBodyLogger, CollectiveBodyBolt, AGGREGATE_KEYS, ALL_KEYS, COLUMNS, METADATA_KEYS
+from .dtype_policy import DtypePolicy, get_dataframe_bytes
+from .parsers import count_data_lines, decode_time_strings, parse_tuple_columns
+from .raw_reader import RawSessionReader
 
 class DataSummary:
 
@@ -34,6 +41,8 @@ class DataSummary:
             'data_collection': None, # Upload time / data collection event
             'data_source': None, # Server or headset
             'data_path': data_path, # Path to data file
+            'parsed_memory_bytes': None, # Cleaned dataframe size with parsed column types
+            'memory_bytes': None, # Cleaned dataframe size with dtype policy column types
         }
 
     def set_data_parameter(self, field, new_value):
@@ -56,17 +65,57 @@ class DataSummary:
 
 class DataCleanerBolt(CollectiveBodyBolt):
 
+    # Fields of the semicolon separated raw files, after a header line
+    RAW_COLUMNS = [
+        "time","head_pos","left_pos","right_pos","head_rot","left_rot","right_rot","chapitre","bigball_pos","leftballscount","rightballscount"
+    ]
+
+    # Text tuple columns in the raw data and the dimensions they expand to
+    TUPLE_COLUMN_DIMENSIONS = {
+        'head_pos': ['x','y','z'],
+        'left_pos': ['x','y','z'],
+        'right_pos': ['x','y','z'],
+        'bigball_pos': ['x','y','z'],
+        'head_rot': ['i','j','k','l'],
+        'left_rot': ['i','j','k','l'],
+        'right_rot': ['i','j','k','l'],
+    }
+
+    # pandas: read_csv and tuple column parsing, mmap: memory mapped reader parsing all fields at once
+    RAW_READERS = ["pandas", "mmap"]
+
+    # Adds a dataset with its cleaned metadata for every discovered file
+    stage_inputs = {AGGREGATE_KEYS: ["input_metadata", "incremental_metadata"]}
+    stage_outputs = {METADATA_KEYS: [ALL_KEYS], COLUMNS: [ALL_KEYS]}
+
     def __init__(
             self, 
             output_directory_path: str, 
             save_intermediate_output: bool, 
             fast_debug: bool=False, 
-            fast_debug_limit: int=10) -> None:
+            fast_debug_limit: int=10,
+            num_workers: int=None,
+            dtype_policy: DtypePolicy=None,
+            raw_reader: str="mmap",
+            storage: IntermediateStorage=None) -> None:
         # Initialize template class
-        super().__init__(output_directory_path, save_intermediate_output)
+        super().__init__(output_directory_path, save_intermediate_output, storage)
         self.fast_debug = fast_debug
         self.fast_debug_limit = fast_debug_limit
 
+        # Column types of cleaned dataframes, parsed types are kept without a policy
+        self.dtype_policy = dtype_policy
+
+        if raw_reader not in self.RAW_READERS:
+            raise ValueError(f"Raw reader {raw_reader} is not one of {self.RAW_READERS}")
+        self.raw_reader = raw_reader
+        # Raw columns with integer types in the dtype policy are read as integers in every chunk
+        self.raw_session_reader = RawSessionReader(
+            self.RAW_COLUMNS, self.TUPLE_COLUMN_DIMENSIONS, integer_columns=self.get_integer_columns())
+
+        # Number of processes used for file ingest, defaults to all available cores
+        self.num_workers = num_workers if num_workers is not None else os.cpu_count()
+
         # Initialize logger
         self.logger = CollectiveBodyLogger(__class__.__name__)
 
@@ -94,8 +143,12 @@ class DataCleanerBolt(CollectiveBodyBolt):
         quick_debug_mode = self.aggregate_metadata_output['input_metadata']['quick_debug_mode']
         ingest_limit = self.aggregate_metadata_output['input_metadata']['file_ingest_limit']
 
+        # Stable dataset IDs and previously ingested datasets are provided for incremental ingest
+        discovered_dataset_ids = self.aggregate_metadata_output['input_metadata'].get('discovered_dataset_ids')
+        prior_dataset_list = self.aggregate_metadata_output.get('incremental_metadata', {}).get('prior_datasets')
+
         df_list, metadata_list = self._load_data_from_file_paths(
-            discovered_filepaths, quick_debug_mode, ingest_limit
+            discovered_filepaths, quick_debug_mode, ingest_limit, discovered_dataset_ids, prior_dataset_list
         )
 
         # TODO - add cleaning information to aggregate metadata
@@ -115,46 +168,145 @@ class DataCleanerBolt(CollectiveBodyBolt):
 
         return self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list
 
+    def get_config(self) -> Dict:
+        return {
+            "dtype_policy": self.dtype_policy.get_config() if self.dtype_policy is not None else None,
+            "raw_reader": self.raw_reader,
+        }
+
+    @classmethod
+    def get_integer_columns(cls) -> List[str]:
+        """Raw numeric columns with an integer type in the dtype policy."""
+        return [column for column in cls.RAW_COLUMNS if column in DtypePolicy.INTEGER_COLUMN_DTYPES]
+
     def _load_data_from_file_paths(
             self, 
             paths: List[pathlib.Path], 
             fast_debug: bool=False, 
-            fast_debug_limit: int=10
+            fast_debug_limit: int=10,
+            dataset_ids: List[int]=None,
+            prior_dataset_list: List[Dict]=None
     ):
-        dataset_id = 0
-        data_frame_list = []
-        metadata_list = []
+        # Dataset IDs follow the path order unless stable IDs are provided
+        if dataset_ids is None:
+            dataset_ids = list(range(len(paths)))
+
+        # Quick debugging ingests the files up to the limit, plus one length validated file
+        if fast_debug:
+            paths = paths[0:fast_debug_limit+2]
+
+        ingest_args = [
+            (pathname, dataset_id, fast_debug and file_count > fast_debug_limit)
+            for file_count, (pathname, dataset_id) in enumerate(zip(paths, dataset_ids))
+        ]
+
+        # Read, validate and clean every file, in parallel if more than one worker is available
+        if self.num_workers is not None and self.num_workers > 1 and len(ingest_args) > 1:
+            self._log_output(f"Ingesting {len(ingest_args)} files with {self.num_workers} workers")
+            with ProcessPoolExecutor(
+                    max_workers=self.num_workers, initializer=_initialize_ingest_worker, 
+                    initargs=(self.dtype_policy, self.raw_reader)) as executor:
+                # Map returns results in submission order, preserving dataset_id order
+                ingest_results = list(executor.map(_timed_ingest_single_file, *zip(*ingest_args)))
+        else:
+            ingest_results = [self._timed_ingest_single_file(*args) for args in ingest_args]
 
-        for pathname in paths:
-            path = pathlib.Path(pathname)
+        data_summary_list = [data_summary for data_summary, _, _ in ingest_results]
+        data_frame_list = [data_df for _, data_df, _ in ingest_results]
 
-            # Initialize Data Summary class
-            data_summary = DataSummary(dataset_id,path)
+        # Ingest times are measured by the process ingesting the file
+        if self.profiler is not None:
+            for (_, dataset_id, _), (_, _, (wall_time, cpu_time)) in zip(ingest_args, ingest_results):
+                self.profiler.record_dataset(self.__class__.__name__, dataset_id, wall_time, cpu_time)
 
-            # Generate Metadata from path
-            data_summary = self._append_path_name_metadata(path, data_summary)
+        # Resolve session numbers in dataset_id order once all files are ingested
+        data_summary_list, data_frame_list = self._assign_session_numbers(
+            data_summary_list, data_frame_list, prior_dataset_list)
 
-            # Read CSV file 
-            data_df = self._read_csv_to_dataframe(path)
+        # Add data summary to list 
+        # TODO - leave as data summary class
+        metadata_list = [data_summary.get_data_path_dict() for data_summary in data_summary_list]
 
-            # Skip full data ingest if fast debug in usage
-            if fast_debug and dataset_id > fast_debug_limit:
-                # For Quick Debugging, run only quick validation to check file length
-                data_summary, data_df = self._length_validation(data_summary, data_df)
-            else:
-                data_summary, data_df = self._import_movement_data(path, data_df, data_summary)
+        return data_frame_list, metadata_list
 
-            # Add data summary to list 
-            # TODO - leave as data summary class
-            metadata_list.append(data_summary.get_data_path_dict())
-            data_frame_list.append(data_df)
+    def _timed_ingest_single_file(self, pathname, dataset_id: int, length_validation_only: bool=False):
+        start_wall_time, start_cpu_time = time.perf_counter(), time.thread_time()
+        data_summary, data_df = self._ingest_single_file(pathname, dataset_id, length_validation_only)
+        return data_summary, data_df, (time.perf_counter() - start_wall_time, time.thread_time() - start_cpu_time)
 
-            dataset_id += 1
+    def _ingest_single_file(self, pathname, dataset_id: int, length_validation_only: bool=False):
+        path = pathlib.Path(pathname)
 
-            if fast_debug and dataset_id > fast_debug_limit:
-                return data_frame_list, metadata_list
+        # Initialize Data Summary class
+        data_summary = DataSummary(dataset_id,path)
 
-        return data_frame_list, metadata_list
+        # Generate Metadata from path
+        data_summary = self._append_path_name_metadata(path, data_summary)
+
+        # Reject invalid files from their path and line count, without reading them
+        if not length_validation_only:
+            data_summary = self._pre_screen_file(path, data_summary)
+            if data_summary.get_data_parameter("is_valid") == False:
+                self._log_output(f"Skipping {path}, rejected before reading: {data_summary.get_data_parameter('error_codes')}")
+                return data_summary, self._add_dataset_id(pd.DataFrame(columns=self.RAW_COLUMNS), data_summary)
+
+        # Read CSV file 
+        data_df = self._read_csv_to_dataframe(path)
+
+        # Skip full data ingest if fast debug in usage
+        if length_validation_only:
+            # For Quick Debugging, run only quick validation to check file length
+            data_summary = self._length_validation(data_summary, data_df)
+        else:
+            data_summary, data_df = self._import_movement_data(path, data_df, data_summary)
+
+        return data_summary, data_df
+
+    def _assign_session_numbers(
+            self, 
+            data_summary_list: List[DataSummary], 
+            data_frame_list: List[pd.DataFrame], 
+            prior_dataset_list: List[Dict]=None):
+        '''Method to assign path and data session numbers to every ingested dataset. Session numbering
+        depends on the datasets seen before, so it is run sequentially in dataset_id order after
+        the per-file ingest is complete. Datasets ingested in earlier runs are numbered alongside, 
+        without being updated, so their session numbers stay stable. Numbers follow dataset_id
+        order, which is the ingest order, so incremental session numbers only match a full ingest
+        if recordings are added in the order a full ingest reads them.'''
+        session_inputs = [
+            (data_summary.get_data_parameter('dataset_id'), data_summary.get_data_parameter('path_datetime'),
+             data_summary.get_data_parameter('data_start_abstime'), data_summary, data_df)
+            for data_summary, data_df in zip(data_summary_list, data_frame_list)
+        ]
+        for prior_dataset in (prior_dataset_list or []):
+            path = pathlib.Path(prior_dataset['data_path'])
+            prior_summary = self._append_path_name_metadata(path, DataSummary(prior_dataset['dataset_id'], path))
+            session_inputs.append(
+                (prior_dataset['dataset_id'], prior_summary.get_data_parameter('path_datetime'),
+                 prior_dataset['data_start_abstime'], None, None))
+        session_inputs.sort(key=lambda session_input: session_input[0])
+
+        for _, path_datetime, data_start_abstime, data_summary, data_df in session_inputs:
+            path_session_number = self._get_path_session_number(path_datetime)
+
+            # Data session number is only available for datasets with extracted datafile metadata
+            data_session_number = None
+            if data_start_abstime is not None:
+                data_session_number = self._get_data_session_number(data_start_abstime)
+
+            # Only datasets ingested in this run are updated
+            if data_summary is None:
+                continue
+
+            data_summary.set_data_parameter('session_number_path', path_session_number)
+            if data_session_number is not None:
+                data_summary.set_data_parameter('session_number_data', data_session_number)
+
+            # Cleaned dataframes carry the session number as a column, in the dtype policy type
+            if 'session_number' in data_df.columns:
+                data_df['session_number'] = data_df['session_number'].dtype.type(path_session_number)
+
+        return data_summary_list, data_frame_list
 
     # TODO - remove
     def load_data_from_file_paths(self, filepath_metadata: Dict, fast_debug: bool=False, fast_debug_limit: int=10):
@@ -217,19 +369,19 @@ class DataCleanerBolt(CollectiveBodyBolt):
         data_summary.set_data_parameter('data_collection', data_collection_name)
 
         # Update data summary class data headset number
+        # Session number is assigned after ingest, see _assign_session_numbers
         data_summary.set_data_parameter('headset_number', headset_number)
 
-        # Determine session number based on path datetime
-        session_number = self._get_path_session_number(path_datetime)
-        data_summary.set_data_parameter('session_number_path', session_number)
-
         return data_summary 
 
     def _append_datafile_metadata(self, path, data_df, data_summary) -> DataSummary:
         # TODO - implement metadata extraction from data file
 
-        # Get datetime from path name
-        dt_start_time = data_df['time'].min()
+        # Get datetime from path name, from the timestamp if the dtype policy dropped the time column
+        if 'time' in data_df.columns:
+            dt_start_time = data_df['time'].min()
+        else:
+            dt_start_time = pd.Timestamp(data_df['timestamp'].min(), unit='ms')
         abs_start_time = data_df['timestamp'].min()
         abs_end_time = data_df['timestamp'].max()
         abs_elapsed_time = abs_end_time - abs_start_time
@@ -269,10 +421,6 @@ class DataCleanerBolt(CollectiveBodyBolt):
             data_summary.set_data_parameter('is_valid', False)
             data_summary.set_data_parameter('error_codes', "Too many chapters")
 
-        # Get session number from data file
-        session_number = self._get_data_session_number(abs_start_time)
-        data_summary.set_data_parameter('session_number_data', session_number)
-
         return data_summary 
 
 
@@ -308,17 +456,32 @@ class DataCleanerBolt(CollectiveBodyBolt):
         return data_summary, data_df
 
     def _read_csv_to_dataframe(self, path):
+        # Read dataframe with expanded tuple columns with the memory mapped reader, files it can 
+        # not tokenize (e.g. missing values) are read with pandas
+        if self.raw_reader == "mmap":
+            try:
+                return self.raw_session_reader.read(path)
+            except ValueError as error:
+                self._log_output(f"Reading {path} with pandas, {error}")
+
         # Read dataframe from csv path
-        single_df = pd.read_csv(path, skiprows=1, delimiter=";",names=[
-            "time","head_pos","left_pos","right_pos","head_rot","left_rot","right_rot","chapitre","bigball_pos","leftballscount","rightballscount"
-        ])
+        single_df = pd.read_csv(path, skiprows=1, delimiter=";",names=self.RAW_COLUMNS)
 
         return single_df
 
 
+    def _pre_screen_file(self, path, data_summary):
+        # Same checks as the pre-validation of the dataframe, from the path metadata and a line count.
+        # Files passing are validated again once read, only rejections are recorded
+        screened_summary = self._validate_source_and_length(copy.deepcopy(data_summary), count_data_lines(path))
+        if screened_summary.get_data_parameter("is_valid") == False:
+            return screened_summary
+        return data_summary
+
     def _length_validation(self, data_summary, data_df):
-        num_lines = len(data_df)
+        return self._validate_num_lines(data_summary, len(data_df))
 
+    def _validate_num_lines(self, data_summary, num_lines):
         # Check size of dataframe
         if num_lines <= 2:
             data_summary.set_data_parameter('is_valid', False)
@@ -337,7 +500,10 @@ class DataCleanerBolt(CollectiveBodyBolt):
 
     def _pre_validate_dataframe(self, data_df, data_summary):
         # TODO - other pre-validation checks
-        data_summary = self._length_validation(data_summary, data_df)
+        return self._validate_source_and_length(data_summary, len(data_df))
+
+    def _validate_source_and_length(self, data_summary, num_lines):
+        data_summary = self._validate_num_lines(data_summary, num_lines)
 
         # Flag headset data as invalid
         if data_summary.get_data_parameter('data_source') == "headset":
@@ -371,42 +537,34 @@ class DataCleanerBolt(CollectiveBodyBolt):
     def _clean_dataframe(self, df, data_summary):
         # Remove incorrect header rows and missing data
         df['headset_number'] = data_summary.get_data_parameter('headset_number')
-        df['session_number'] = data_summary.get_data_parameter('session_number_path')
+        df['session_number'] = -1 # Session number is assigned after ingest, see _assign_session_numbers
         df = df.dropna()
         df = df.reset_index(drop=True)
 
-        # Expand text columns - tranlation
-        df = self._strip_split_columns(df, 
-                                       column_list=['head_pos','left_pos','right_pos','bigball_pos'],
-                                       dimensions =['x','y','z'],
-                                       remove_vals=["(",")"," "])
-        
-        # Expand text columns - rotation
-        df = self._strip_split_columns(df, 
-                                       column_list=['head_rot','left_rot','right_rot'],
-                                       dimensions =['i','j','k','l'],
-                                       remove_vals=["(",")"," "])
+        # Expand text columns - translation and rotation, unless expanded by the memory mapped reader
+        expanded_columns = self.raw_session_reader.expanded_columns
+        if all(column in df.columns for column in self.TUPLE_COLUMN_DIMENSIONS):
+            df = parse_tuple_columns(df, self.TUPLE_COLUMN_DIMENSIONS)
+        else:
+            df = df[[column for column in df.columns if column not in expanded_columns] + expanded_columns]
         
-        # Convert time to datetime
+        # Convert time to datetime and set time values including elapsed time
         path_datetime = data_summary.get_data_parameter("path_datetime")
-        time_df = pd.DataFrame()
-        time_df['time'] = pd.to_datetime(df['time'], format="%H:%M::%S:%f")
-
-        time_df['year'] = path_datetime.year
-        time_df['month'] = path_datetime.month
-        time_df['day'] = path_datetime.day
-        time_df['hour'] = time_df['time'].dt.hour
-        time_df['minute'] = time_df['time'].dt.minute
-        time_df['second'] = time_df['time'].dt.second
-        time_df['microsecond'] = time_df['time'].dt.microsecond
-        time_df = time_df.drop(['time'], axis=1)
-        time_df = pd.to_datetime(time_df)
-        
-        # Set time values including elapsed time
-        df['time'] = pd.to_datetime(time_df)
-        df['timestamp'] = df['time'].values.astype(np.int64) // 10 ** 6 # Get time in miliseconds
+        epoch_microseconds = decode_time_strings(df['time'], path_datetime)
+        df['time'] = (epoch_microseconds * 1000).view('datetime64[ns]')
+        df['timestamp'] = epoch_microseconds // 10 ** 3 # Get time in miliseconds
         start_time = df['timestamp'].min()
-        df['elapsed_time'] = df['time'].values.astype(np.int64) // 10 ** 6 - start_time
+        df['elapsed_time'] = df['timestamp'] - start_time
+
+        # Narrow column types, later bolts keep the types of the cleaned dataframe
+        data_summary.set_data_parameter('parsed_memory_bytes', get_dataframe_bytes(df))
+        if self.dtype_policy is not None:
+            sensor_columns = [
+                f"{column}_{dimension}" 
+                for column, dimensions in self.TUPLE_COLUMN_DIMENSIONS.items() for dimension in dimensions
+            ]
+            df = self.dtype_policy.apply(df, sensor_columns)
+        data_summary.set_data_parameter('memory_bytes', get_dataframe_bytes(df))
 
         return df
 
@@ -451,18 +609,6 @@ class DataCleanerBolt(CollectiveBodyBolt):
                 return self.data_session_counter-1
 
 
-    def _strip_split_columns(self, df,column_list, dimensions, remove_vals=["(",")"," "]):
-
-        for column in column_list:
-            column_list = [column  + "_" + d for d in dimensions]
-            for val in remove_vals:
-                df[column] = df[column].str.replace(val,'')
-            
-            df[column_list] = df[column].str.split(',',expand=True).astype(float)
-            df = df.drop([column], axis=1)
-
-        return df
-
     def _inspect_dataframe(self, dataframe):
             self._log_output(f"Data frame head:\n{dataframe.head()}")
             self._log_output(f"Data frame description:\n{dataframe.describe()}")
@@ -473,6 +619,18 @@ class DataCleanerBolt(CollectiveBodyBolt):
         print(f"{__class__.__name__}: {output}")
 
 
+# Bolt used by each ingest worker process, created once per process
+_worker_cleaner_bolt: DataCleanerBolt = None
+
+def _initialize_ingest_worker(dtype_policy: DtypePolicy=None, raw_reader: str="mmap"):
+    global _worker_cleaner_bolt
+    _worker_cleaner_bolt = DataCleanerBolt(
+        None, save_intermediate_output=False, num_workers=1, dtype_policy=dtype_policy, raw_reader=raw_reader)
+
+def _timed_ingest_single_file(pathname, dataset_id: int, length_validation_only: bool=False):
+    return _worker_cleaner_bolt._timed_ingest_single_file(pathname, dataset_id, length_validation_only)
+
+
 
 if __name__ == "__main__":
     print("Running data cleaning and import for headset and server data.")
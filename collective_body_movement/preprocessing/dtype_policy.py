@@ -0,0 +1,86 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+class DtypePolicy:
+    """
+    Column types of cleaned datasets, applied once after cleaning and kept by later bolts.
+
+    Ids, chapters and ball counts are stored as small integers, sensor channels optionally as
+    float32, and the datetime time column can be dropped as it duplicates the timestamp.
+    """
+
+    # Smallest integer types for the expected range of every column, wider values keep their type
+    INTEGER_COLUMN_DTYPES = {
+        "chapitre": np.int8,
+        "leftballscount": np.int16,
+        "rightballscount": np.int16,
+        "headset_number": np.int8,
+        "session_number": np.int16,
+        "dataset_id": np.int32,
+    }
+    # Time columns derived from the timestamp
+    REDUNDANT_TIME_COLUMNS = ["time"]
+
+    def __init__(
+            self,
+            compact_integers: bool = True,
+            float32_sensors: bool = False,
+            drop_redundant_time: bool = False) -> None:
+        self.compact_integers = compact_integers
+        self.float32_sensors = float32_sensors
+        self.drop_redundant_time = drop_redundant_time
+
+    def apply(self, df: pd.DataFrame, sensor_columns: List[str]) -> pd.DataFrame:
+        """Return the dataframe with the policy column types, sensor columns are the parsed channels."""
+        if self.compact_integers:
+            for column, dtype in self.INTEGER_COLUMN_DTYPES.items():
+                if column in df.columns and self._fits_integer_dtype(df[column].to_numpy(), dtype):
+                    df[column] = df[column].to_numpy().astype(dtype)
+
+        if self.float32_sensors:
+            df[sensor_columns] = df[sensor_columns].astype(np.float32)
+
+        if self.drop_redundant_time:
+            df = df.drop(columns=[column for column in self.REDUNDANT_TIME_COLUMNS if column in df.columns])
+
+        return df
+
+    def get_config(self) -> Dict:
+        return {
+            "compact_integers": self.compact_integers,
+            "float32_sensors": self.float32_sensors,
+            "drop_redundant_time": self.drop_redundant_time,
+        }
+
+    def _fits_integer_dtype(self, values: np.ndarray, dtype: type) -> bool:
+        if values.dtype.kind not in "iuf" or len(values) == 0:
+            return False
+        # Float columns only hold whole numbers when parsed from text with missing values
+        if values.dtype.kind == "f" and not np.all(np.isfinite(values) & (values == np.round(values))):
+            return False
+        dtype_info = np.iinfo(dtype)
+        return dtype_info.min <= values.min() and values.max() <= dtype_info.max
+
+
+# Policies by name, full keeps the parsed types
+DTYPE_POLICIES = {
+    "full": DtypePolicy(compact_integers=False),
+    "compact": DtypePolicy(compact_integers=True),
+    "lean": DtypePolicy(compact_integers=True, float32_sensors=True, drop_redundant_time=True),
+}
+
+def get_dtype_policy(dtype_policy_name: str) -> DtypePolicy:
+    if dtype_policy_name not in DTYPE_POLICIES:
+        raise ValueError(f"Dtype policy {dtype_policy_name} is not one of {list(DTYPE_POLICIES.keys())}")
+    return DTYPE_POLICIES[dtype_policy_name]
+
+
+def get_dataframe_bytes(df: pd.DataFrame) -> int:
+    """Memory used by the dataframe, including the contents of text columns."""
+    return int(df.memory_usage(index=True, deep=True).sum())
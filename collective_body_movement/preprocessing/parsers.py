@@ -0,0 +1,206 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import datetime
+import mmap
+import os
+from typing import Dict, List
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Parentheses are dropped and rows separated by commas, so the tuple text becomes a flat comma
+# separated list of floats
+_ROW_SEPARATOR = ";"
+_TUPLE_TRANSLATION = str.maketrans("()" + _ROW_SEPARATOR, "  ,")
+
+
+def parse_tuple_columns(df: pd.DataFrame, column_dimensions: Dict[str, List[str]]) -> pd.DataFrame:
+    """
+    Expand text tuple columns such as "(x, y, z)" into one float64 column per dimension.
+
+    All tuple columns are tokenized in a single pass into a preallocated block, which replaces
+    the per column strip, split and cast of the text fields. Every field must hold one number per
+    dimension, a ValueError is raised for missing, blank or non-numeric values.
+
+    Parameters:
+    - df: pandas DataFrame with the raw text tuple columns
+    - column_dimensions: Mapping of tuple column name to its dimension suffixes, e.g.
+    {'head_pos': ['x','y','z']}, producing columns head_pos_x, head_pos_y and head_pos_z.
+
+    Returns:
+    - DataFrame with the tuple columns replaced by the expanded float columns, appended in
+    the order of column_dimensions.
+    """
+    num_rows = len(df)
+    column_list = list(column_dimensions.keys())
+    expanded_columns = [f"{column}_{d}" for column in column_list for d in column_dimensions[column]]
+
+    # Join every tuple field of the file into one buffer, column by column
+    values = np.empty(0, dtype=np.float64)
+    if num_rows > 0:
+        column_texts = []
+        for column in column_list:
+            column_text = _ROW_SEPARATOR.join(df[column].to_numpy(dtype=object))
+            _check_tuple_fields(column, column_text, num_rows, len(column_dimensions[column]))
+            column_texts.append(column_text)
+        tuple_text = ",".join(column_texts)
+        values = parse_separated_values(tuple_text.translate(_TUPLE_TRANSLATION))
+
+    if values.size != num_rows * len(expanded_columns):
+        raise ValueError(f"Unable to parse tuple columns {column_list}: expected "
+                         f"{num_rows * len(expanded_columns)} values, found {values.size}")
+
+    # Scatter each column's values into the preallocated output block
+    block = np.empty((num_rows, len(expanded_columns)), dtype=np.float64)
+    value_offset = 0
+    block_offset = 0
+    for column in column_list:
+        num_dimensions = len(column_dimensions[column])
+        column_values = values[value_offset:value_offset + num_rows * num_dimensions]
+        block[:, block_offset:block_offset + num_dimensions] = column_values.reshape(num_rows, num_dimensions)
+        value_offset += num_rows * num_dimensions
+        block_offset += num_dimensions
+
+    expanded_df = pd.DataFrame(block, columns=expanded_columns, index=df.index)
+    return pd.concat([df.drop(column_list, axis=1), expanded_df], axis=1)
+
+
+def parse_separated_values(text) -> np.ndarray:
+    """
+    Parse comma separated numbers, given as str or a uint8 array of characters, into a float64
+    array. Values must not be blank, as the tokenizer reads a blank value as -1, and a
+    ValueError is raised for blank or non-numeric values.
+    """
+    text_bytes = np.frombuffer(text.encode(), dtype=np.uint8) if isinstance(text, str) else text
+    if _has_blank_values(text_bytes):
+        raise ValueError("Unable to parse values, blank values found")
+    with warnings.catch_warnings():
+        # The tokenizer warns on text it can not parse instead of raising
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            return np.fromstring(text_bytes, dtype=np.float64, sep=",")
+        except DeprecationWarning:
+            raise ValueError("Unable to parse values, non-numeric values found") from None
+
+
+def _has_blank_values(text_bytes: np.ndarray) -> bool:
+    # Spaces, tabs and parentheses sort before the separator, digits and letters, a value without
+    # any later character leaves two separators next to each other, or one at either end
+    kept_separators = text_bytes[text_bytes > ord(")")] == ord(",")
+    return (len(kept_separators) == 0 or kept_separators[0] or kept_separators[-1]
+            or bool(np.any(kept_separators[1:] & kept_separators[:-1])))
+
+
+def _check_tuple_fields(column: str, column_text: str, num_rows: int, num_dimensions: int):
+    # Every field must hold all of its values, a missing value would shift all following fields
+    text_bytes = np.frombuffer(column_text.encode(), dtype=np.uint8)
+    row_ends = np.append(np.flatnonzero(text_bytes == ord(_ROW_SEPARATOR)), len(text_bytes))
+    value_separators = np.flatnonzero(text_bytes == ord(","))
+    separators_per_row = np.diff(np.searchsorted(value_separators, row_ends), prepend=0)
+    if len(row_ends) != num_rows or np.any(separators_per_row != num_dimensions - 1):
+        raise ValueError(f"Unable to parse tuple column {column}: fields with missing or extra values")
+
+
+# Layout of the raw "%H:%M::%S:%f" time field split on ":" (the empty field sits between "::")
+_TIME_FIELD_COUNT = 5
+_HOUR, _MINUTE, _EMPTY, _SECOND, _FRACTION = range(_TIME_FIELD_COUNT)
+_MICROSECONDS_PER_DAY = 24 * 60 * 60 * 1000000
+_MAX_FRACTION_DIGITS = 9
+
+
+def decode_time_strings(time_values, path_datetime: datetime.datetime) -> np.ndarray:
+    """
+    Decode raw "%H:%M::%S:%f" time strings into int64 epoch microseconds.
+
+    The time of day is combined with the date of the path datetime. Times that jump back by
+    more than half a day are treated as a recording running past midnight and moved to the
+    following day.
+
+    Parameters:
+    - time_values: Sequence of raw time strings, e.g. "14:03::22:123"
+    - path_datetime: Datetime extracted from the data file path, only the date is used
+
+    Returns:
+    - int64 numpy array of microseconds since the epoch.
+    """
+    time_text = np.asarray(time_values, dtype=object).astype(np.bytes_)
+    num_rows = len(time_text)
+    if num_rows == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # View the fixed width byte strings as a (rows x characters) matrix
+    chars = time_text.view(np.uint8).reshape(num_rows, time_text.dtype.itemsize)
+    is_digit = (chars >= ord("0")) & (chars <= ord("9"))
+    is_colon = chars == ord(":")
+    if not np.all(is_digit | is_colon | (chars == 0)):
+        raise ValueError("Unable to decode time values, unexpected characters found")
+    if not np.all(is_colon.sum(axis=1) == _TIME_FIELD_COUNT - 1):
+        raise ValueError("Unable to decode time values, expected format %H:%M::%S:%f")
+
+    # Accumulate the digits of each field, one character position at a time
+    field_index = np.cumsum(is_colon, axis=1, dtype=np.int8)
+    field_values = np.zeros((num_rows, _TIME_FIELD_COUNT), dtype=np.int64)
+    field_digits = np.zeros((num_rows, _TIME_FIELD_COUNT), dtype=np.int8)
+    for position in range(chars.shape[1]):
+        digit_rows = np.flatnonzero(is_digit[:, position])
+        digit_fields = field_index[digit_rows, position]
+        field_values[digit_rows, digit_fields] = \
+            field_values[digit_rows, digit_fields] * 10 + (chars[digit_rows, position] - ord("0"))
+        field_digits[digit_rows, digit_fields] += 1
+
+    hours = field_values[:, _HOUR]
+    minutes = field_values[:, _MINUTE]
+    seconds = field_values[:, _SECOND]
+    if (np.any(field_digits[:, [_HOUR, _MINUTE, _SECOND]] == 0) or np.any(field_digits[:, _EMPTY] != 0)
+            or np.any(field_digits[:, _FRACTION] == 0) or np.any(field_digits[:, _FRACTION] > _MAX_FRACTION_DIGITS)
+            or np.any(hours > 23) or np.any(minutes > 59) or np.any(seconds > 59)):
+        raise ValueError("Unable to decode time values, expected format %H:%M::%S:%f")
+
+    # Fractional digits are right padded as with %f, e.g. "12" is 120000 microseconds
+    fraction_scale = 10**(_MAX_FRACTION_DIGITS - field_digits[:, _FRACTION].astype(np.int64))
+    fraction_nanoseconds = field_values[:, _FRACTION] * fraction_scale
+    time_of_day = ((hours * 60 + minutes) * 60 + seconds) * 1000000 + fraction_nanoseconds // 1000
+
+    # Move samples recorded after midnight to the next day
+    midnight_rollovers = np.diff(time_of_day) < -_MICROSECONDS_PER_DAY // 2
+    day_offsets = np.concatenate(([0], np.cumsum(midnight_rollovers)))
+
+    path_date = np.datetime64(path_datetime.date(), "D").astype("datetime64[us]").astype(np.int64)
+    return path_date + day_offsets * _MICROSECONDS_PER_DAY + time_of_day
+
+
+def count_data_lines(path, header_lines: int = 1) -> int:
+    """
+    Count the rows read_csv would read from a raw file, the non-empty lines after the header
+    lines, from a memory map of the file without parsing it. Lines of only spaces are counted,
+    so the count is an upper bound of the rows read.
+
+    Parameters:
+    - path: Path of the raw csv file
+    - header_lines: Number of leading lines skipped by the reader
+
+    Returns:
+    - Number of data lines.
+    """
+    with open(path, "rb") as raw_file:
+        if os.fstat(raw_file.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(raw_file.fileno(), 0, access=mmap.ACCESS_READ) as raw_map:
+            raw_bytes = np.frombuffer(raw_map, dtype=np.uint8)
+            num_bytes = len(raw_bytes)
+            line_ends = np.flatnonzero(raw_bytes == ord("\n"))
+            # A last line without a newline ends at the end of the file
+            if len(line_ends) == 0 or line_ends[-1] != num_bytes - 1:
+                line_ends = np.append(line_ends, num_bytes)
+            line_starts = np.append(0, line_ends[:-1] + 1)
+            # Windows line endings leave a carriage return as the last character
+            carriage_returns = np.zeros(len(line_ends), dtype=bool)
+            non_empty = line_ends > line_starts
+            carriage_returns[non_empty] = raw_bytes[line_ends[non_empty] - 1] == ord("\r")
+            del raw_bytes
+
+    content_lengths = line_ends - line_starts - carriage_returns
+    return int(np.count_nonzero(content_lengths[header_lines:] > 0))
@@ -0,0 +1,176 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import mmap
+import os
+from typing import Dict, Iterator, List
+
+import numpy as np
+import pandas as pd
+
+from .parsers import parse_separated_values
+
+_NEWLINE = ord("\n")
+_FIELD_SEPARATOR = ord(";")
+_VALUE_SEPARATOR = ord(",")
+_SPACE = ord(" ")
+
+# Tuple parentheses and carriage returns are blanked, fields and lines become value separators
+_TRANSLATION_TABLE = bytes.maketrans(b"()\r;\n", b"   ,,")
+
+
+class RawSessionReader:
+    """
+    Reader of semicolon separated raw session files, which memory maps the file and tokenizes all
+    fields directly into arrays, with the output of reading with pandas and splitting the tuple columns.
+    """
+
+    def __init__(
+            self, 
+            raw_columns: List[str], 
+            column_dimensions: Dict[str, List[str]], 
+            header_lines: int = 1, 
+            integer_columns: List[str] = None) -> None:
+        self.raw_columns = list(raw_columns)
+        self.column_dimensions = column_dimensions
+        self.header_lines = header_lines
+        # Integer columns are int64 and other numeric fields float64 in every chunk, whatever their values
+        self.integer_columns = list(integer_columns) if integer_columns is not None else []
+
+        # Number of values of every field after the text field, and their position in a line
+        self.field_sizes = [len(column_dimensions.get(column, [None])) for column in self.raw_columns[1:]]
+        self.values_per_line = sum(self.field_sizes)
+        field_offsets = np.cumsum([0] + self.field_sizes)
+        self.field_positions = {
+            column: np.arange(field_offsets[i], field_offsets[i + 1])
+            for i, column in enumerate(self.raw_columns[1:])
+        }
+        self.scalar_columns = [column for column in self.raw_columns[1:] if column not in column_dimensions]
+        self.expanded_columns = [f"{column}_{d}" for column in column_dimensions for d in column_dimensions[column]]
+        self.expanded_positions = np.concatenate([self.field_positions[column] for column in column_dimensions])
+
+    def read(self, path) -> pd.DataFrame:
+        """Read the whole file into one dataframe."""
+        chunks = list(self.iter_chunks(path, chunk_bytes=None))
+        if len(chunks) == 1:
+            return chunks[0]
+        return pd.concat(chunks)
+
+    def iter_chunks(self, path, chunk_bytes: int = 64 * 2**20) -> Iterator[pd.DataFrame]:
+        """
+        Read the file in chunks of whole lines of about chunk_bytes, the whole file at once if
+        chunk_bytes is None. Chunks are indexed by their line number in the data, as if the
+        file was read at once.
+        """
+        with open(path, "rb") as raw_file:
+            file_size = os.fstat(raw_file.fileno()).st_size
+            if file_size == 0:
+                yield self._to_dataframe(np.empty(0, dtype=object), np.empty((0, self.values_per_line)), 0)
+                return
+
+            with mmap.mmap(raw_file.fileno(), 0, access=mmap.ACCESS_READ) as raw_map:
+                chunk_start = 0
+                first_row = 0
+                skip_lines = self.header_lines
+                while chunk_start < file_size:
+                    # Chunks end after a newline, or at the end of the file
+                    chunk_end = file_size
+                    if chunk_bytes is not None and chunk_start + chunk_bytes < file_size:
+                        newline_position = raw_map.find(b"\n", chunk_start + chunk_bytes - 1)
+                        chunk_end = newline_position + 1 if newline_position >= 0 else file_size
+
+                    raw_bytes = np.frombuffer(raw_map, dtype=np.uint8, count=chunk_end - chunk_start, offset=chunk_start)
+                    # The translated buffer ends with a space, the value tokenizer needs a character after the last value
+                    translated = bytearray(raw_map[chunk_start:chunk_end].translate(_TRANSLATION_TABLE))
+                    translated.append(_SPACE)
+                    try:
+                        time_values, values = self._tokenize(raw_bytes, np.frombuffer(translated, dtype=np.uint8), skip_lines)
+                        chunk_df = self._to_dataframe(time_values, values, first_row)
+                        parse_error = None
+                    except ValueError as error:
+                        # Raised once the mapped buffer is released, the map can not be closed before
+                        parse_error = str(error)
+                    del raw_bytes
+                    if parse_error is not None:
+                        raise ValueError(f"{path}: {parse_error}")
+
+                    yield chunk_df
+                    first_row += len(time_values)
+                    chunk_start = chunk_end
+                    skip_lines = 0
+
+    def _tokenize(self, raw_bytes: np.ndarray, translated: np.ndarray, skip_lines: int) -> (np.ndarray, np.ndarray):
+        """
+        Split the lines of a buffer into the text field and a (lines x values) float block, from
+        the raw bytes and their translation into value separated text. Missing, blank or
+        non-numeric values raise a ValueError.
+        """
+        # Locate lines, a last line without a newline ends at the end of the buffer
+        line_ends = np.flatnonzero(raw_bytes == _NEWLINE)
+        if len(line_ends) == 0 or line_ends[-1] != len(raw_bytes) - 1:
+            line_ends = np.append(line_ends, len(raw_bytes))
+        line_starts = np.append(0, line_ends[:-1] + 1)
+
+        # Header and empty lines are skipped, as by read_csv
+        content_lengths = line_ends - line_starts
+        content_lengths[content_lengths > 0] -= raw_bytes[line_ends[content_lengths > 0] - 1] == ord("\r")
+        data_lines = (content_lengths > 0) & (np.arange(len(line_ends)) >= skip_lines)
+        for skipped_start, skipped_end in zip(line_starts[~data_lines], line_ends[~data_lines]):
+            translated[skipped_start:skipped_end + 1] = _SPACE
+        line_starts, line_ends = line_starts[data_lines], line_ends[data_lines]
+        num_lines = len(line_ends)
+
+        # The text field ends at the first field separator of every line
+        field_separators = np.append(np.flatnonzero(raw_bytes == _FIELD_SEPARATOR), len(raw_bytes))
+        text_ends = field_separators[np.searchsorted(field_separators, line_starts)]
+        if np.any(text_ends >= line_ends):
+            raise ValueError("Raw data lines without field separators")
+        # Blank the text field and its separator, only values and separators are left
+        text_positions = line_starts[:, np.newaxis] + np.arange(int(np.max(text_ends - line_starts, initial=0)) + 1)
+        text_characters = text_positions <= text_ends[:, np.newaxis]
+        time_values = self._gather_text(raw_bytes, text_positions, text_characters & (text_positions < text_ends[:, np.newaxis]))
+        translated[text_positions[text_characters]] = _SPACE
+        if num_lines > 0:
+            # A separator after the last value would add an empty value
+            translated[line_ends[-1]] = _SPACE
+
+        # Every line must hold all of its values, a missing value would shift all following lines
+        value_separators = np.flatnonzero(translated == _VALUE_SEPARATOR)
+        separators_per_line = np.diff(np.searchsorted(value_separators, line_ends, side="right"), prepend=0)
+        expected_separators = np.full(num_lines, self.values_per_line)
+        expected_separators[-1:] -= 1
+        if len(value_separators) != np.sum(expected_separators) or np.any(separators_per_line != expected_separators):
+            raise ValueError("Raw data lines with missing or extra values")
+
+        values = np.empty(0, dtype=np.float64)
+        if num_lines > 0:
+            values = parse_separated_values(translated)
+        if values.size != num_lines * self.values_per_line:
+            raise ValueError(f"Unable to parse raw data: expected {num_lines * self.values_per_line} "
+                             f"values, found {values.size}")
+
+        return time_values, values.reshape(num_lines, self.values_per_line)
+
+    def _gather_text(self, raw_bytes: np.ndarray, text_positions: np.ndarray, text_characters: np.ndarray) -> np.ndarray:
+        """Copy the text fields into a fixed width array and decode them to str objects."""
+        max_length = max(text_positions.shape[1], 1)
+        characters = np.zeros((len(text_positions), max_length), dtype=np.uint8)
+        characters[text_characters] = raw_bytes[text_positions[text_characters]]
+        return characters.view(f"S{max_length}").ravel().astype(str).astype(object)
+
+    def _to_dataframe(self, time_values: np.ndarray, values: np.ndarray, first_row: int) -> pd.DataFrame:
+        index = pd.RangeIndex(first_row, first_row + len(time_values))
+        columns = {self.raw_columns[0]: time_values}
+        for column in self.scalar_columns:
+            column_values = values[:, self.field_positions[column][0]]
+            if column in self.integer_columns:
+                if not np.all(column_values == np.round(column_values)):
+                    raise ValueError(f"Integer column {column} holds fractional values")
+                column_values = column_values.astype(np.int64)
+            columns[column] = column_values
+        scalar_df = pd.DataFrame(columns, index=index)
+
+        expanded_block = np.ascontiguousarray(values[:, self.expanded_positions].T)
+        expanded_df = pd.DataFrame(expanded_block.T, columns=self.expanded_columns, index=index, copy=False)
+        return pd.concat([scalar_df, expanded_df], axis=1)
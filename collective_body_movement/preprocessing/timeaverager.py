@@ -6,20 +6,77 @@ import numpy as np
 import pandas as pd
 from typing import Dict, List
 
-from ..utils import CollectiveBodyLogger, CollectiveBodyBolt
+from ..storage import IntermediateStorage
+from ..utils import CollectiveBodyLogger, CollectiveBodyBolt, ALL_KEYS, COLUMNS, METADATA_KEYS
 
 class TimeAverageBolt(CollectiveBodyBolt):
 
+    # time_averaging: trailing window mean of every window_size-th row, savitzky_golay: centered
+    # polynomial fit, exponential: exponential moving average, resample: mean per period of a
+    # fixed timestamp grid
+    FILTER_TYPES = ["time_averaging", "savitzky_golay", "exponential", "resample"]
+    # Grid periods without frames are interpolated between the surrounding periods, hold the
+    # previous period or are dropped, gaps longer than max_gap are always dropped
+    GAP_HANDLING = ["interpolate", "hold", "drop"]
+
+    # Filters every column and replaces the rows of datasets
+    stage_inputs = {METADATA_KEYS: ["cleaned_metadata"], COLUMNS: [ALL_KEYS]}
+    stage_outputs = {METADATA_KEYS: ["filtering_metadata", "fundamental_kinematics_metadata"], COLUMNS: [ALL_KEYS]}
+
+    COLUMNS_TO_SMOOTH = [
+        "head_pos_x","head_pos_y","head_pos_z","left_pos_x","left_pos_y",
+        "left_pos_z","right_pos_x","right_pos_y","right_pos_z","bigball_pos_x",
+        "bigball_pos_y","bigball_pos_z","head_rot_i","head_rot_j","head_rot_k",
+        "head_rot_l","left_rot_i","left_rot_j","left_rot_k","left_rot_l",
+        "right_rot_i","right_rot_j","right_rot_k","right_rot_l",
+    ]
+    COLUMNS_TO_DOWN_SAMPLE = [
+        "time","chapitre","leftballscount","rightballscount","dataset_id",
+        "headset_number","session_number","timestamp","elapsed_time"
+    ]
+
     def __init__(
             self, 
             output_directory_path: str, 
             save_intermediate_output: bool, 
-            window_size: int = 10) -> None:
+            window_size: int = 10,
+            filter_type: str = "time_averaging",
+            polyorder: int = 2,
+            filter_window_length: int = None,
+            resample_period: int = 50,
+            gap_handling: str = "interpolate",
+            max_gap: int = 1000,
+            storage: IntermediateStorage=None) -> None:
         # Initialize template class
-        super().__init__(output_directory_path, save_intermediate_output)
+        super().__init__(output_directory_path, save_intermediate_output, storage)
+
+        if filter_type not in self.FILTER_TYPES:
+            raise ValueError(f"Filter type {filter_type} is not one of {self.FILTER_TYPES}")
+        if window_size < 1:
+            raise ValueError(f"Window size must be at least 1, got {window_size}")
 
-        # Store window size for bolt
+        # Store window size and filter parameters for bolt
         self.window_size = window_size
+        self.filter_type = filter_type
+        # Savitzky-Golay windows are centered and odd, spanning the rows around the window by default
+        self.polyorder = polyorder
+        self.filter_window_length = filter_window_length if filter_window_length is not None else 2*window_size + 1
+        if filter_type == "savitzky_golay" and (self.filter_window_length % 2 == 0 or self.filter_window_length <= polyorder):
+            raise ValueError(f"Savitzky-Golay window length must be odd and larger than the polynomial order {polyorder}")
+        # Resample grid period and maximum filled gap in milliseconds of the timestamp column
+        if gap_handling not in self.GAP_HANDLING:
+            raise ValueError(f"Gap handling {gap_handling} is not one of {self.GAP_HANDLING}")
+        if resample_period < 1:
+            raise ValueError(f"Resample period must be at least 1 ms, got {resample_period}")
+        self.resample_period = resample_period
+        self.gap_handling = gap_handling
+        self.max_gap = max_gap
+
+        self.filter_functions = {
+            "time_averaging": self._trailing_window_means,
+            "savitzky_golay": self._savitzky_golay_values,
+            "exponential": self._exponential_values,
+        }
   
         # Initialize logger
         self.logger = CollectiveBodyLogger(__class__.__name__)
@@ -42,6 +99,18 @@ class TimeAverageBolt(CollectiveBodyBolt):
             
         return self.output_df_list, self.aggregate_metadata_output, self.output_metadata_list
 
+    def get_config(self) -> Dict:
+        return {"window_size": self.window_size, **self._get_filter_parameters()}
+
+    def _get_filter_parameters(self) -> Dict:
+        filter_parameters = {"filter_type": self.filter_type}
+        if self.filter_type == "savitzky_golay":
+            filter_parameters.update({"polyorder": self.polyorder, "filter_window_length": self.filter_window_length})
+        elif self.filter_type == "resample":
+            filter_parameters.update({
+                "resample_period": self.resample_period, "gap_handling": self.gap_handling, "max_gap": self.max_gap})
+        return filter_parameters
+
     def _process_all_datasets(self, df_list, metadata_list):
         """"Process functiont to take a metadata disctionary with file paths and
         preprocess and clean them."""
@@ -59,10 +128,11 @@ class TimeAverageBolt(CollectiveBodyBolt):
 
             # Time average all data
             if output_metadata["cleaned_metadata"]["is_valid"]:
-                self._log_output(f"Time averaging data for {output_dataset_id} with window size: {self.window_size}")
-                output_df = self._smooth_and_downsample_location(output_df)
+                self._log_output(f"Filtering data for {output_dataset_id} with {self.filter_type}, window size: {self.window_size}")
+                with self._profile_dataset(output_dataset_id):
+                    output_df = self._smooth_and_downsample_location(output_df)
                 output_metadata["filtering_metadata"] = {
-                    "filter_type": "time_averaging",
+                    **self._get_filter_parameters(),
                     "window_size": self.window_size,
                 }
             else: 
@@ -87,48 +157,142 @@ class TimeAverageBolt(CollectiveBodyBolt):
 
     def _smooth_and_downsample_location(self, data: pd.DataFrame) -> pd.DataFrame:
         """
-        Smooth and downsample accelerometer data using time averaging.
+        Smooth and downsample accelerometer data using the configured filter.
 
         Parameters:
         - data: pandas DataFrame with 'x', 'y', 'z', 'i', 'j', 'k', 'l' and 'timestamp' 
         columns for multiple sensors
-        - window_size: Size of the window for time averaging.
 
         Returns:
-        - Smoothed and downsampled DataFrame.
+        - Smoothed and downsampled DataFrame, the index of the source row and the downsampled
+        columns followed by the smoothed columns.
         """
-        # Sort the data based on the timestamp
-        data = data.sort_values(by='timestamp')
-
-        # Columns to smooth
-        columns_to_smooth = [
-            "head_pos_x","head_pos_y","head_pos_z","left_pos_x","left_pos_y",
-            "left_pos_z","right_pos_x","right_pos_y","right_pos_z","bigball_pos_x",
-            "bigball_pos_y","bigball_pos_z","head_rot_i","head_rot_j","head_rot_k",
-            "head_rot_l","left_rot_i","left_rot_j","left_rot_k","left_rot_l",
-            "right_rot_i","right_rot_j","right_rot_k","right_rot_l",
-        ]
-        columns_to_down_sample = [
-            "time","chapitre","leftballscount","rightballscount","dataset_id",
-            "headset_number","session_number","timestamp","elapsed_time"
-        ]
-
-        # Apply time averaging for each column ('x', 'y', 'z', 'i', 'j', 'k')
-        smoothed_data = data[columns_to_smooth].rolling(window=self.window_size).mean()
+        # Sort the data based on the timestamp, recordings are usually already in order
+        if not data['timestamp'].is_monotonic_increasing:
+            data = data.sort_values(by='timestamp')
+
+        if self.filter_type == "resample":
+            return self._resample_to_grid(data)
 
         # Downsample by selecting every nth row
-        downsampled_data = smoothed_data.iloc[::self.window_size]
-        downsampled_data=downsampled_data.reset_index()
+        output_rows = np.arange(0, len(data), self.window_size)
+        smoothing_function = self.filter_functions[self.filter_type]
+
+        downsampled_data = data[self._get_down_sample_columns(data)].iloc[output_rows].reset_index()
+
+        # Only the output rows of the smoothed columns are materialized, in the column types
+        smoothed_data = pd.DataFrame(
+            {
+                column: smoothing_function(data[column].to_numpy(), output_rows).astype(data[column].dtype, copy=False)
+                for column in self.COLUMNS_TO_SMOOTH
+            },
+            index=downsampled_data.index,
+        )
+
+        return pd.concat([downsampled_data, smoothed_data], axis=1)
+
+    def _get_down_sample_columns(self, data: pd.DataFrame) -> List[str]:
+        # Redundant time columns may be dropped by the dtype policy of the cleaner
+        return [column for column in self.COLUMNS_TO_DOWN_SAMPLE if column in data.columns]
+
+    def _trailing_window_means(self, values: np.ndarray, output_rows: np.ndarray) -> np.ndarray:
+        """
+        Mean of the window_size rows ending at every output row, NaN if the window is incomplete.
+        Output rows are every window_size-th row, so the windows of all rows after the first are
+        the consecutive blocks of values[1:], averaged on a reshaped view without copying.
+        """
+        window_size = self.window_size
+        means = np.full(len(output_rows), np.nan)
+        if window_size == 1:
+            means[:] = values
+            return means
+
+        num_blocks = (len(values) - 1) // window_size
+        if num_blocks > 0:
+            blocks = values[1:1 + num_blocks*window_size].reshape(num_blocks, window_size)
+            means[1:num_blocks + 1] = blocks.mean(axis=1, dtype=np.float64)
+        return means
+
+    def _savitzky_golay_values(self, values: np.ndarray, output_rows: np.ndarray) -> np.ndarray:
+        """
+        Savitzky-Golay filter evaluated at the output rows, a polynomial least squares fit over a
+        centered window, with the edge values repeated beyond the ends of the data.
+        """
+        half_window = self.filter_window_length // 2
+        window_offsets = np.arange(-half_window, half_window + 1)
+        # Value of the fitted polynomial at the window center as a weighted sum of the window
+        coefficients = np.linalg.pinv(np.vander(window_offsets, self.polyorder + 1, increasing=True))[0]
+
+        window_rows = np.clip(output_rows[:, np.newaxis] + window_offsets, 0, len(values) - 1)
+        return values[window_rows] @ coefficients
+
+    def _exponential_values(self, values: np.ndarray, output_rows: np.ndarray) -> np.ndarray:
+        """Exponential moving average with a span of window_size rows, at the output rows."""
+        smoothed = pd.Series(values, copy=False).ewm(span=self.window_size, adjust=False).mean()
+        return smoothed.to_numpy()[output_rows]
+
+    def _resample_to_grid(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Resample sorted data onto a grid of resample_period milliseconds from the first timestamp.
+        Smoothed columns are the mean of the frames in each period, the other columns are taken
+        from the last frame up to the end of the period, and the time columns are set to the
+        start of the period.
+        """
+        if len(data) == 0:
+            smoothed_data = data[self.COLUMNS_TO_SMOOTH].reset_index(drop=True)
+            return pd.concat([data[self._get_down_sample_columns(data)].reset_index(), smoothed_data], axis=1)
+
+        timestamps = data['timestamp'].to_numpy()
+        start_time = timestamps[0]
+        grid_bins = (timestamps - start_time) // self.resample_period
+        num_bins = grid_bins[-1] + 1
+        frame_counts = np.bincount(grid_bins, minlength=num_bins)
+
+        # Keep periods with frames and the gaps that are filled
+        filled_bins = frame_counts > 0
+        kept_bins = filled_bins.copy()
+        if self.gap_handling != "drop":
+            kept_bins |= self._get_short_gap_bins(filled_bins)
+        grid = np.flatnonzero(kept_bins)
+
+        # Last frame up to the end of every kept period, gaps hold the frame before them
+        source_rows = np.searchsorted(grid_bins, grid, side='right') - 1
+        downsampled_data = data[self._get_down_sample_columns(data)].iloc[source_rows].reset_index()
+        grid_timestamps = start_time + grid*self.resample_period
+        downsampled_data['timestamp'] = grid_timestamps
+        downsampled_data['elapsed_time'] = grid*self.resample_period
+        if 'time' in downsampled_data.columns:
+            downsampled_data['time'] = (grid_timestamps * 10**6).astype(np.int64).view('datetime64[ns]')
+
+        filled_grid = filled_bins[grid]
+        smoothed_data = {}
+        for column in self.COLUMNS_TO_SMOOTH:
+            column_sums = np.bincount(grid_bins, weights=data[column].to_numpy(), minlength=num_bins)
+            grid_values = column_sums[grid] / np.where(filled_grid, frame_counts[grid], 1)
+            if not np.all(filled_grid):
+                grid_values = self._fill_gaps(grid, grid_values, filled_grid)
+            smoothed_data[column] = grid_values.astype(data[column].dtype, copy=False)
+
+        return pd.concat([downsampled_data, pd.DataFrame(smoothed_data, index=downsampled_data.index)], axis=1)
 
-        # Add timestamp column back to the downsampled data
-        other_downsample_data = data[columns_to_down_sample].iloc[::self.window_size]   
-        other_downsample_data=other_downsample_data.reset_index()
+    def _get_short_gap_bins(self, filled_bins: np.ndarray) -> np.ndarray:
+        """Empty periods in runs of at most max_gap milliseconds, longer gaps are left empty."""
+        filled_indices = np.flatnonzero(filled_bins)
+        gap_lengths = np.diff(filled_indices) - 1
+        short_gaps = (gap_lengths > 0) & (gap_lengths*self.resample_period <= self.max_gap)
 
-        # TODO - confirm more efficient way to concat
-        downsampled_data=other_downsample_data.join(downsampled_data, how='left',rsuffix='r')
-        downsampled_data.drop(columns=['indexr'], inplace=True)
+        # Mark the bins of every short gap by the difference of run starts and ends
+        gap_markers = np.zeros(len(filled_bins) + 1, dtype=np.int64)
+        np.add.at(gap_markers, filled_indices[:-1][short_gaps] + 1, 1)
+        np.add.at(gap_markers, filled_indices[1:][short_gaps], -1)
+        return np.cumsum(gap_markers[:-1]) > 0
 
-        return downsampled_data
+    def _fill_gaps(self, grid: np.ndarray, grid_values: np.ndarray, filled_grid: np.ndarray) -> np.ndarray:
+        if self.gap_handling == "interpolate":
+            return np.interp(grid, grid[filled_grid], grid_values[filled_grid])
+        # Hold the value of the last period with frames
+        last_filled = np.maximum.accumulate(np.where(filled_grid, np.arange(len(grid)), 0))
+        return grid_values[last_filled]
 
     def _log_output(self, output):
         print(f"{__class__.__name__}: {output}")
\ No newline at end of file
@@ -0,0 +1,261 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+import contextlib
+import itertools
+import json
+import os
+import pathlib
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List
+
+import pandas as pd
+
+class StageProfiler:
+    """Timing and memory probe of pipeline stages and of every dataset processed by a stage."""
+
+    MEMORY_PROBES = ["rss", "tracemalloc", "none"]
+    STAGE_REPORT_COLUMNS = [
+        "stage_name", "wall_time", "cpu_time", "peak_memory_bytes", "datasets_in", "datasets_out",
+        "rows_in", "rows_out", "num_columns_added",
+    ]
+    DATASET_REPORT_COLUMNS = [
+        "stage_name", "dataset_id", "data_path", "wall_time", "cpu_time", "peak_memory_bytes",
+        "rows_in", "rows_out", "num_columns_added",
+    ]
+
+    def __init__(self, memory_probe: str = "rss", rss_sampling_interval: float = 0.01) -> None:
+        if memory_probe not in self.MEMORY_PROBES:
+            raise ValueError(f"Memory probe {memory_probe} is not one of {self.MEMORY_PROBES}")
+        self.memory_probe = memory_probe
+        self.rss_sampler = RssSampler(rss_sampling_interval) if memory_probe == "rss" else None
+        self.stage_reports: List[Dict] = []
+        self.dataset_reports: List[Dict] = []
+        self._started_tracemalloc = False
+        # Stages running concurrently each keep their own peak
+        self._stage_state = threading.local()
+
+    def start(self):
+        if self.memory_probe == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if self.rss_sampler is not None:
+            self.rss_sampler.start()
+
+    def stop(self):
+        if self.rss_sampler is not None:
+            self.rss_sampler.stop()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def profile_stage(
+            self,
+            stage_name: str,
+            stage_function: Callable,
+            input_dataframe_list: List[pd.DataFrame],
+            aggregate_metadata: Dict,
+            input_metadata_list: List[Dict]) -> (List[pd.DataFrame], Dict, List[Dict]):
+        """Run a stage function on the stage inputs and record its report, returning its outputs."""
+        # Record input shapes first, stages modify their inputs in place
+        input_shapes = self._get_dataset_shapes(input_dataframe_list, input_metadata_list)
+        num_dataset_reports = len(self.dataset_reports)
+
+        memory_start = self._start_memory_segment()
+        self._stage_state.peak_traced_bytes = memory_start if self.memory_probe == "tracemalloc" and memory_start is not None else 0
+        start_wall_time, start_cpu_time = time.perf_counter(), self._get_cpu_time()
+
+        output_dataframe_list, aggregate_metadata, output_metadata_list = stage_function(
+            input_dataframe_list, aggregate_metadata, input_metadata_list)
+
+        wall_time, cpu_time = time.perf_counter() - start_wall_time, self._get_cpu_time() - start_cpu_time
+        peak_memory_bytes = self._get_stage_peak_memory(memory_start)
+
+        # Complete the reports of datasets timed by the bolt, and add the other output datasets
+        output_shapes = self._get_dataset_shapes(output_dataframe_list, output_metadata_list)
+        dataset_reports = {
+            report["dataset_id"]: report for report in self.dataset_reports[num_dataset_reports:]
+            if report["stage_name"] == stage_name
+        }
+        for dataset_id, (num_rows, columns, data_path) in output_shapes.items():
+            input_rows, input_columns, _ = input_shapes.get(dataset_id, (0, set(), None))
+            if dataset_id not in dataset_reports:
+                dataset_reports[dataset_id] = self._new_dataset_report(stage_name, dataset_id)
+                self.dataset_reports.append(dataset_reports[dataset_id])
+            dataset_reports[dataset_id].update({
+                "data_path": data_path,
+                "rows_in": input_rows,
+                "rows_out": num_rows,
+                "num_columns_added": len(columns - input_columns),
+            })
+
+        added_columns = set().union(*(columns for _, columns, _ in output_shapes.values())) - \
+            set().union(*(columns for _, columns, _ in input_shapes.values()))
+        self.stage_reports.append({
+            "stage_name": stage_name,
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "peak_memory_bytes": peak_memory_bytes,
+            "datasets_in": len(input_shapes),
+            "datasets_out": len(output_shapes),
+            "rows_in": sum(num_rows for num_rows, _, _ in input_shapes.values()),
+            "rows_out": sum(num_rows for num_rows, _, _ in output_shapes.values()),
+            "num_columns_added": len(added_columns),
+            "columns_added": sorted(added_columns),
+        })
+
+        return output_dataframe_list, aggregate_metadata, output_metadata_list
+
+    @contextlib.contextmanager
+    def profile_dataset(self, stage_name: str, dataset_id) -> Iterator[None]:
+        """Time the processing of one dataset within a stage."""
+        memory_start = self._start_memory_segment()
+        start_wall_time, start_cpu_time = time.perf_counter(), self._get_cpu_time()
+        yield
+        self.record_dataset(
+            stage_name, dataset_id, time.perf_counter() - start_wall_time, self._get_cpu_time() - start_cpu_time,
+            self._end_memory_segment(memory_start))
+
+    def record_dataset(self, stage_name: str, dataset_id, wall_time: float, cpu_time: float, peak_memory_bytes: int = None):
+        """Record the time of a dataset measured elsewhere, e.g. in a worker process."""
+        dataset_report = self._new_dataset_report(stage_name, dataset_id)
+        dataset_report.update({"wall_time": wall_time, "cpu_time": cpu_time, "peak_memory_bytes": peak_memory_bytes})
+        self.dataset_reports.append(dataset_report)
+
+    def save_report(self, report_directory: pathlib.Path):
+        """Save the run report as json, and the dataset reports as csv."""
+        report_directory = pathlib.Path(report_directory)
+        run_report = {
+            "memory_probe": self.memory_probe,
+            "stages": self.stage_reports,
+            "datasets": self.dataset_reports,
+        }
+        with open(report_directory / "run_report.json", "w") as outfile:
+            json_object = json.dumps(run_report, indent = 6, sort_keys=True, default=str)
+            outfile.write(json_object)
+
+        # Added column names are only listed in the json report
+        pd.DataFrame(self.stage_reports, columns=self.STAGE_REPORT_COLUMNS).to_csv(
+            report_directory / "run_report_stages.csv", index=False)
+        pd.DataFrame(self.dataset_reports, columns=self.DATASET_REPORT_COLUMNS).to_csv(
+            report_directory / "run_report_datasets.csv", index=False)
+
+    def _new_dataset_report(self, stage_name: str, dataset_id) -> Dict:
+        dataset_report = dict.fromkeys(self.DATASET_REPORT_COLUMNS)
+        dataset_report.update({"stage_name": stage_name, "dataset_id": dataset_id})
+        return dataset_report
+
+    def _get_dataset_shapes(self, dataframe_list: List[pd.DataFrame], metadata_list: List[Dict]) -> Dict:
+        dataset_shapes = {}
+        for df, metadata in zip(dataframe_list, metadata_list):
+            dataset_id = list(metadata.keys())[0]
+            data_path = metadata[dataset_id].get("cleaned_metadata", {}).get("data_path")
+            dataset_shapes[dataset_id] = (len(df), set(df.columns), data_path)
+        return dataset_shapes
+
+    def _get_cpu_time(self) -> float:
+        # Worker process times are added once the workers have finished
+        process_times = os.times()
+        return time.thread_time() + process_times.children_user + process_times.children_system
+
+    def _start_memory_segment(self) -> int:
+        if self.memory_probe == "rss":
+            return self.rss_sampler.start_segment()
+        if self.memory_probe != "tracemalloc" or not tracemalloc.is_tracing():
+            return None
+        # Keep the peak of the enclosing stage before measuring a new peak
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        self._stage_state.peak_traced_bytes = max(getattr(self._stage_state, "peak_traced_bytes", 0), peak_bytes)
+        tracemalloc.reset_peak()
+        return current_bytes
+
+    def _end_memory_segment(self, memory_start: int) -> int:
+        if self.memory_probe == "rss":
+            return self.rss_sampler.end_segment(memory_start)
+        if memory_start is None:
+            return None
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        self._stage_state.peak_traced_bytes = max(getattr(self._stage_state, "peak_traced_bytes", 0), peak_bytes)
+        tracemalloc.reset_peak()
+        return peak_bytes - memory_start
+
+    def _get_stage_peak_memory(self, memory_start: int) -> int:
+        if self.memory_probe == "rss":
+            return self.rss_sampler.end_segment(memory_start)
+        if memory_start is None:
+            return None
+        # Datasets of the stage reset the traced peak, the stage peak is the largest of their peaks
+        self._end_memory_segment(memory_start)
+        return self._stage_state.peak_traced_bytes - memory_start
+
+
+class RssSampler:
+    """Samples the resident set size of the process in a background thread, keeping its peak for every open segment."""
+
+    def __init__(self, sampling_interval: float = 0.01) -> None:
+        self.sampling_interval = sampling_interval
+        self.segment_peaks: Dict[int, int] = {}
+        self.segment_peaks_lock = threading.Lock()
+        self._segment_ids = itertools.count()
+        self._stop_event = threading.Event()
+        self._sampler_thread: threading.Thread = None
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else None
+        self._process = None
+        if not os.path.exists("/proc/self/statm"):
+            try:
+                import psutil
+                self._process = psutil.Process()
+            except ImportError:
+                # Current memory is not available without /proc or psutil
+                pass
+
+    def start(self):
+        if self._sampler_thread is not None:
+            return
+        self._stop_event.clear()
+        self._sampler_thread = threading.Thread(target=self._sample, name="rss_sampler", daemon=True)
+        self._sampler_thread.start()
+
+    def stop(self):
+        if self._sampler_thread is None:
+            return
+        self._stop_event.set()
+        self._sampler_thread.join()
+        self._sampler_thread = None
+
+    def start_segment(self) -> int:
+        """Open a segment and return its id."""
+        segment_id = next(self._segment_ids)
+        current_bytes = self.get_current_rss_bytes()
+        with self.segment_peaks_lock:
+            self.segment_peaks[segment_id] = current_bytes
+        return segment_id
+
+    def end_segment(self, segment_id: int) -> int:
+        """Close a segment and return the peak resident set size sampled while it was open."""
+        self._record_sample(self.get_current_rss_bytes())
+        with self.segment_peaks_lock:
+            return self.segment_peaks.pop(segment_id, None)
+
+    def get_current_rss_bytes(self) -> int:
+        if self._process is not None:
+            return self._process.memory_info().rss
+        try:
+            with open("/proc/self/statm") as statm_file:
+                return int(statm_file.read().split()[1]) * self._page_size
+        except (OSError, TypeError):
+            return None
+
+    def _sample(self):
+        while not self._stop_event.wait(self.sampling_interval):
+            self._record_sample(self.get_current_rss_bytes())
+
+    def _record_sample(self, current_bytes: int):
+        if current_bytes is None:
+            return
+        with self.segment_peaks_lock:
+            for segment_id, peak_bytes in self.segment_peaks.items():
+                self.segment_peaks[segment_id] = current_bytes if peak_bytes is None else max(peak_bytes, current_bytes)
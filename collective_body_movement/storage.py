@@ -0,0 +1,171 @@
+# Collective Body Movement Application
+# Director: Sarah Silverblatt-Buser (https://www.sarahsilverblatt.com/)
+# Author: Justin Martin (jcm-art)
+
+from abc import ABC, abstractmethod
+import pathlib
+from typing import Dict, List, Type
+
+import pandas as pd
+
+class IntermediateStorage(ABC):
+    """Storage backend used by bolts to write and read their output datasets."""
+
+    file_suffix: str = None
+
+    def __init__(self, compression: str = None) -> None:
+        self.compression = compression
+
+    def write_dataframe(self, df: pd.DataFrame, path_stem: pathlib.Path) -> pathlib.Path:
+        """Write the dataframe to the path stem with the storage file suffix and return the path."""
+        output_path = pathlib.Path(f"{path_stem}{self.file_suffix}")
+        self._write(df, output_path)
+        return output_path
+
+    def read_dataframe(self, path) -> pd.DataFrame:
+        return self._read(path)
+
+    @abstractmethod
+    def _write(self, df: pd.DataFrame, output_path: pathlib.Path):
+        """Write the dataframe to the output path, must be implemented for every storage format"""
+
+    @abstractmethod
+    def _read(self, path) -> pd.DataFrame:
+        """Read a dataframe written by _write, must be implemented for every storage format"""
+
+
+class CsvStorage(IntermediateStorage):
+    """Text storage, kept for compatibility with existing outputs and tools."""
+
+    file_suffix = ".csv"
+
+    def __init__(self, compression: str = None) -> None:
+        if compression is not None:
+            raise ValueError("Compression is not supported for csv storage, use parquet or feather")
+        super().__init__(compression)
+
+    def _write(self, df: pd.DataFrame, output_path: pathlib.Path):
+        df.to_csv(output_path, index=True)
+
+    def _read(self, path) -> pd.DataFrame:
+        # The saved index is restored as the index, as by the binary formats
+        return pd.read_csv(path, index_col=0)
+
+
+class ParquetStorage(IntermediateStorage):
+    """Columnar binary storage, compressed with snappy unless another codec is provided."""
+
+    file_suffix = ".parquet"
+
+    def __init__(self, compression: str = "snappy") -> None:
+        super().__init__(compression if compression is not None else "snappy")
+
+    def _write(self, df: pd.DataFrame, output_path: pathlib.Path):
+        df.to_parquet(output_path, index=True, compression=self.compression)
+
+    def _read(self, path) -> pd.DataFrame:
+        return pd.read_parquet(path)
+
+
+class FeatherStorage(IntermediateStorage):
+    """Arrow IPC storage, uncompressed unless a codec (lz4, zstd) is provided."""
+
+    file_suffix = ".feather"
+
+    def __init__(self, compression: str = "uncompressed") -> None:
+        super().__init__(compression if compression is not None else "uncompressed")
+
+    def _write(self, df: pd.DataFrame, output_path: pathlib.Path):
+        # pandas only writes a default index to feather, pyarrow stores any index with the pandas
+        # schema metadata, which restores it when read
+        from pyarrow import feather
+        feather.write_feather(df, output_path, compression=self.compression)
+
+    def _read(self, path) -> pd.DataFrame:
+        return pd.read_feather(path)
+
+
+STORAGE_FORMATS: Dict[str, Type[IntermediateStorage]] = {
+    "csv": CsvStorage,
+    "parquet": ParquetStorage,
+    "feather": FeatherStorage,
+}
+
+
+def get_intermediate_storage(storage_format: str = "csv", compression: str = None) -> IntermediateStorage:
+    if storage_format not in STORAGE_FORMATS:
+        raise ValueError(f"Storage format {storage_format} is not one of {list(STORAGE_FORMATS.keys())}")
+    return STORAGE_FORMATS[storage_format](compression)
+
+
+def get_storage_for_path(path) -> IntermediateStorage:
+    """Return the storage backend matching the file suffix of a dataset path."""
+    suffix = pathlib.Path(str(path)).suffix.lower()
+    for storage_class in STORAGE_FORMATS.values():
+        if storage_class.file_suffix == suffix:
+            return storage_class()
+    raise ValueError(f"No storage format found for file suffix {suffix} of {path}")
+
+
+def read_dataframe(path) -> pd.DataFrame:
+    """Read a dataset written by any storage backend, selected by file suffix."""
+    return get_storage_for_path(path).read_dataframe(path)
+
+
+def resolve_dataframe_path(path) -> pathlib.Path:
+    """Return the path if it exists, otherwise the same dataset stored in another supported format."""
+    path = pathlib.Path(path)
+    if path.exists():
+        return path
+    for storage_class in STORAGE_FORMATS.values():
+        candidate_path = path.with_suffix(storage_class.file_suffix)
+        if candidate_path.exists():
+            return candidate_path
+    return path
+
+
+class StageSavePolicy:
+    """
+    What a pipeline stage saves: nothing, only its metadata, or its metadata and datasets. Datasets
+    are saved in the pipeline storage format unless the policy sets another format, with all
+    columns or the listed columns present in each dataset.
+    """
+
+    POLICY_KEYS = ["save", "metadata_only", "storage_format", "storage_compression", "columns"]
+
+    def __init__(
+            self,
+            save: bool = True,
+            metadata_only: bool = False,
+            storage_format: str = None,
+            storage_compression: str = None,
+            columns: List[str] = None) -> None:
+        if storage_format is not None and storage_format not in STORAGE_FORMATS:
+            raise ValueError(f"Storage format {storage_format} is not one of {list(STORAGE_FORMATS.keys())}")
+        if storage_compression is not None and storage_format is None:
+            raise ValueError("A storage compression requires a storage format in the save policy")
+        self.save = save
+        self.metadata_only = metadata_only
+        self.storage_format = storage_format
+        self.storage_compression = storage_compression
+        self.columns = list(columns) if columns is not None else None
+
+    @classmethod
+    def from_config(cls, policy_config: Dict) -> "StageSavePolicy":
+        unknown_keys = [key for key in policy_config if key not in cls.POLICY_KEYS]
+        if len(unknown_keys) > 0:
+            raise ValueError(f"Save policy keys {unknown_keys} are not one of {cls.POLICY_KEYS}")
+        return cls(**policy_config)
+
+    def get_config(self) -> Dict:
+        return {key: getattr(self, key) for key in self.POLICY_KEYS}
+
+    def get_storage(self, default_storage: IntermediateStorage) -> IntermediateStorage:
+        if self.storage_format is None:
+            return default_storage
+        return get_intermediate_storage(self.storage_format, self.storage_compression)
+
+    def select_columns(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.columns is None:
+            return df
+        return df[[column for column in self.columns if column in df.columns]]
@@ -3,23 +3,62 @@
 # Author: Justin Martin (jcm-art)
 
 from abc import abstractmethod
+import contextlib
 import json
 import pathlib
+import threading
 import time
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 import pandas as pd
 
+from .output_writer import AsyncOutputWriter
+from .profiling import StageProfiler
+from .storage import CsvStorage, IntermediateStorage, StageSavePolicy
+
+# Kinds of pipeline data declared by bolts: aggregate metadata keys, per-dataset metadata keys and
+# dataset columns
+AGGREGATE_KEYS = "aggregate"
+METADATA_KEYS = "metadata"
+COLUMNS = "columns"
+# Any key of a kind, e.g. for bolts reading every column or adding, dropping or resampling datasets
+ALL_KEYS = "*"
+
 class CollectiveBodyBolt:
 
-    def __init__(self, output_directory_path: str, save_intermediate_output: bool=False) -> None:
+    # Cross-dataset bolts combine results of all datasets, see fit and transform
+    cross_dataset: bool = False
+
+    # Pipeline data read and added or modified by the bolt, by kind of data. The pipeline orders,
+    # skips and runs bolts concurrently by these, see pipeline/scheduler.py
+    stage_inputs: Dict[str, List[str]] = {}
+    stage_outputs: Dict[str, List[str]] = {}
+
+    def __init__(
+            self, 
+            output_directory_path: str, 
+            save_intermediate_output: bool=False, 
+            storage: IntermediateStorage=None) -> None:
         # initialize dataframe and metadata for bolt
         self.output_df_list: List[pd.DataFrame] = []
         self.aggregate_metadata_output = {}
         self.output_metadata_list: List[Dict] = []
 
-        # Initialize output for bolt
+        # Initialize output for bolt, datasets are saved as csv unless another storage is provided
         self.save_intermediate_output = save_intermediate_output
+        self.storage = storage if storage is not None else CsvStorage()
+        # Outputs are written in the background if the pipeline provides a writer
+        self.output_writer: AsyncOutputWriter = None
+        # Saved datasets and columns, and the size and time of all writes
+        self.save_policy = StageSavePolicy()
+        self.write_statistics = {"files_written": 0, "bytes_written": 0, "write_time": 0.0}
+        self.write_statistics_lock = threading.Lock()
+        # Batched pipelines save the aggregate metadata once after all batches, not with every batch
+        self.defer_aggregate_output = False
+        # Datasets are timed if the pipeline provides a profiler
+        self.profiler: StageProfiler = None
+        # Output columns needed by later stages, all outputs are calculated unless the pipeline requests columns
+        self.requested_columns: List[str] = None
         if save_intermediate_output:
             output_directory= pathlib.Path(output_directory_path)
             self.output_path = output_directory/f"{__class__.__name__}_output/"
@@ -34,27 +73,117 @@ class CollectiveBodyBolt:
      ) -> (List[pd.DataFrame], List[Dict]):
         """Process method that transforms a dataframe must be implemented for every"""
 
+    def fit(self, aggregate_metadata: Dict, input_metadata_list: List[Dict]) -> (Dict, List[Dict]):
+        """Cross-dataset step of a cross-dataset bolt, using the metadata of all datasets only."""
+        return aggregate_metadata, input_metadata_list
+
+    def transform(
+        self, 
+        input_dataframe_list: List[pd.DataFrame], 
+        aggregate_metadata: Dict,
+        input_metadata_list: List[Dict]
+     ) -> (List[pd.DataFrame], Dict, List[Dict]):
+        """Per-dataset step of a cross-dataset bolt, applied to a batch of datasets after fit."""
+        return input_dataframe_list, aggregate_metadata, input_metadata_list
+
+    def get_config(self) -> Dict:
+        """Bolt configuration affecting its output, recorded in pipeline checkpoint manifests."""
+        return {}
+
+    def get_checkpoint_inputs(self, aggregate_metadata: Dict) -> Dict:
+        """External inputs read by the bolt beyond the upstream stage output, e.g. raw data files."""
+        return {}
+
+    def get_stage_inputs(self) -> Dict[str, List[str]]:
+        """Pipeline data read by the bolt, by kind of data."""
+        return self.stage_inputs
+
+    def get_stage_outputs(self) -> Dict[str, List[str]]:
+        """Pipeline data added or modified by the bolt, by kind of data."""
+        return self.stage_outputs
+
+    def set_requested_columns(self, requested_columns: List[str]):
+        """Request the output columns needed by later stages, None to request all output columns."""
+        self.requested_columns = sorted(set(requested_columns)) if requested_columns is not None else None
+
+    def _is_requested(self, column: str) -> bool:
+        return self.requested_columns is None or column in self.requested_columns
+
     def save_output(self):
+        if not self.defer_aggregate_output:
+            self.save_aggregate_output()
+        self.save_dataset_output()
+
+    def save_aggregate_output(self):
         # Save aggregate metadata
         json_output = self.output_path/f"{__class__.__name__}_aggregate_metadata.json"
-        with open(json_output,"w") as outfile:
-            # TODO - validate that posix path and datetime aren't broken with forced default str output
-            json_object = json.dumps(self.aggregate_metadata_output, indent = 6, sort_keys=True, default=str) 
-            outfile.write(json_object)
+        # TODO - validate that posix path and datetime aren't broken with forced default str output
+        json_object = json.dumps(self._get_serializable_aggregate_metadata(), indent = 6, sort_keys=True, default=str) 
+        self._write_output(json_output, self._write_text, json_object, json_output)
 
+    def save_dataset_output(self):
         # Save dataset metadata
-        for single_dataset_metadata, dataset_to_save  in zip(self.output_metadata_list, self.output_df_list):
+        for single_dataset_metadata, dataset_to_save  in self._get_saved_datasets():
             # Extract Dataset IT
             dataset_id = single_dataset_metadata[list(single_dataset_metadata.keys())[0]]['cleaned_metadata']['dataset_id']
 
             json_output = self.output_path/f"{__class__.__name__}_{dataset_id}.json"
-            with open(json_output,"w") as outfile:
-                # TODO - validate that posix path and datetime aren't broken with forced default str output
-                json_object = json.dumps(single_dataset_metadata, indent = 6, sort_keys=True, default=str) 
-                outfile.write(json_object)
-
-            dataframe_output = self.output_path/f"{__class__.__name__}_{dataset_id}.csv"
-            dataset_to_save.to_csv(dataframe_output, index=True)
+            # TODO - validate that posix path and datetime aren't broken with forced default str output
+            json_object = json.dumps(single_dataset_metadata, indent = 6, sort_keys=True, default=str) 
+            self._write_output(json_output, self._write_text, json_object, json_output)
+
+            if self.save_policy.metadata_only:
+                continue
+            dataframe_output = self.output_path/f"{__class__.__name__}_{dataset_id}"
+            dataset_to_save = self.save_policy.select_columns(dataset_to_save)
+            # Metadata is queued as text, datasets as a copy, later stages modify datasets in place
+            if self.output_writer is not None:
+                dataset_to_save = dataset_to_save.copy(deep=True)
+            self._write_output(dataframe_output, self.storage.write_dataframe, dataset_to_save, dataframe_output)
+
+    def _get_saved_datasets(self) -> List[Tuple[Dict, pd.DataFrame]]:
+        """Metadata and datasets saved by save_output, all output datasets by default."""
+        return list(zip(self.output_metadata_list, self.output_df_list))
+
+    def _profile_dataset(self, dataset_id):
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.profile_dataset(self.__class__.__name__, dataset_id)
+
+    def get_write_statistics(self) -> Dict:
+        with self.write_statistics_lock:
+            return dict(self.write_statistics)
+
+    def _write_output(self, output_path: pathlib.Path, write_function, *args):
+        if self.output_writer is None:
+            self._timed_write(write_function, *args)
+        else:
+            self.output_writer.submit(f"{self.__class__.__name__} {output_path}", self._timed_write, write_function, *args)
+
+    def _timed_write(self, write_function, *args):
+        # Write functions return the written path, measured once written
+        start_time = time.perf_counter()
+        written_path = write_function(*args)
+        write_time = time.perf_counter() - start_time
+        with self.write_statistics_lock:
+            self.write_statistics["files_written"] += 1
+            self.write_statistics["bytes_written"] += pathlib.Path(written_path).stat().st_size
+            self.write_statistics["write_time"] += write_time
+
+    def _write_text(self, text: str, output_path: pathlib.Path) -> pathlib.Path:
+        with open(output_path,"w") as outfile:
+            outfile.write(text)
+        return output_path
+
+    def _get_serializable_aggregate_metadata(self) -> Dict:
+        # Tables in the aggregate metadata, e.g. the metric table, are saved in their nested layout
+        serializable_metadata = {}
+        for key, value in self.aggregate_metadata_output.items():
+            if hasattr(value, "to_metadata_layout"):
+                serializable_metadata.update(value.to_metadata_layout())
+            else:
+                serializable_metadata[key] = value
+        return serializable_metadata
 
     def print_intermediate_metadata(self):
         # TODO - consider using logger
@@ -33,6 +33,7 @@ source cbenv/bin/activate
 pip3 install --upgrade pip
 pip3 install numpy
 pip3 install pandas
+pip3 install pyarrow
 pip3 install matplotlib
 pip3 install PyInstaller
 pip3 install tk